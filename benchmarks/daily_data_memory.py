@@ -0,0 +1,140 @@
+"""Peak RSS of holding a full daily data backfill in memory
+
+Simulates create_daily_data_records for new symbols (five years of rows each)
+with synthetic history frames, once keeping a dict per row as the updater used
+to do and once with DailyDataBuffer. Each mode runs in a fresh subprocess so
+the reported peak RSS is not shared between them.
+
+Usage:
+    python benchmarks/daily_data_memory.py --symbols 1000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daily_data_buffer import DailyDataBuffer  # noqa: E402
+
+INT_COLS = ["volume", "market_cap", "mcap_method"]
+
+
+def make_history(n_days, seed):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=n_days)
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days)))
+    data = pd.DataFrame(
+        {
+            "Close": close.round(2),
+            "Volume": rng.integers(1e4, 1e8, n_days).astype(float),
+            "Market Cap": close * 1e9,
+            "mcap_method": 2.0,
+        },
+        index=dates.strftime("%Y-%m-%d"),
+    )
+    data.iloc[-1, data.columns.get_loc("mcap_method")] = 1.0
+    return data
+
+
+def cast_int(num):
+    return round(num) if pd.notna(num) else None
+
+
+def run_dicts(n_symbols, n_days):
+    updated_on = pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S")
+    all_symbols_rows = []
+    for i in range(n_symbols):
+        symbol = f"S{i:05d}.JK"
+        data = make_history(n_days, i)
+        for idx, close, volume, mcap, method in zip(
+            data.index,
+            data["Close"].tolist(),
+            data["Volume"].tolist(),
+            data["Market Cap"].tolist(),
+            data["mcap_method"].tolist(),
+        ):
+            all_symbols_rows.append(
+                {
+                    "symbol": symbol,
+                    "date": idx,
+                    "close": close,
+                    "volume": volume,
+                    "market_cap": mcap,
+                    "mcap_method": method,
+                }
+            )
+
+    all_symbols_rows = [{"updated_on": updated_on, **r} for r in all_symbols_rows]
+    for row in all_symbols_rows:
+        for col in INT_COLS:
+            row[col] = cast_int(row[col])
+
+    return len(all_symbols_rows)
+
+
+def run_buffer(n_symbols, n_days):
+    updated_on = pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S")
+    all_symbols_rows = DailyDataBuffer(updated_on, INT_COLS)
+    for i in range(n_symbols):
+        all_symbols_rows.append_frame(f"S{i:05d}.JK", make_history(n_days, i))
+
+    # upsert-sized slices are what _batch_upsert materializes
+    for i in range(0, len(all_symbols_rows), 25):
+        all_symbols_rows[i : i + 25]
+
+    return len(all_symbols_rows)
+
+
+def run_mode(mode, n_symbols, n_days):
+    start = time.perf_counter()
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    n_rows = {"dicts": run_dicts, "buffer": run_buffer}[mode](n_symbols, n_days)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed = time.perf_counter() - start
+    print(f"{mode},{n_rows},{baseline_kb},{peak_kb},{elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=5 * 252)
+    parser.add_argument("--mode", choices=["dicts", "buffer"], default=None)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.symbols, args.days)
+        return
+
+    print(f"{args.symbols} symbols x {args.days} days")
+    print(f"{'mode':<8} {'rows':>10} {'peak RSS (MB)':>14} {'over import (MB)':>17} {'time (s)':>9}")
+    for mode in ["dicts", "buffer"]:
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--mode",
+                mode,
+                "--symbols",
+                str(args.symbols),
+                "--days",
+                str(args.days),
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip().splitlines()[-1]
+        _, n_rows, baseline_kb, peak_kb, elapsed = output.split(",")
+        # ru_maxrss is in kilobytes on Linux
+        peak_mb = int(peak_kb) / 1024
+        growth_mb = (int(peak_kb) - int(baseline_kb)) / 1024
+        print(f"{mode:<8} {n_rows:>10} {peak_mb:>14.0f} {growth_mb:>17.0f} {elapsed:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,605 @@
+"""Synthetic load test of upsert_data_to_db at universe scale
+
+Runs the real IdxYFDataUpdater.upsert_data_to_db against a fake yfinance
+backend and a fake Supabase client, so nothing leaves the machine:
+
+- the fake Ticker serves info, dividends, annual/quarterly statements and
+  price histories generated from a per-symbol seed, and the fake batch quote
+  endpoint serves forwardEps and marketCap, after a log-normally
+  distributed latency, and both fail a configurable share of requests
+- the fake client serves the symbol list and last-state queries (a share of
+  the symbols is new and gets a five-year backfill) and counts upserted rows
+  after its own latency; with --local_db the updater writes to a local SQLite
+  or DuckDB file instead, where every symbol starts new
+
+Each universe size runs in a fresh subprocess, so the reported peak RSS is
+its own. Per stage (symbol extraction, last-state reads, record creation,
+upsert) the wall time is reported, and per request kind (YF attribute, DB
+select/upsert, whole symbol) the p50/p95/p99/max latency.
+
+Usage:
+    python benchmarks/load_test.py --sizes 1000,10000,50000 --tables idx_daily_data,idx_key_stats
+"""
+import argparse
+import gzip
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yfdataupdater  # noqa: E402
+from idxyfdataupdater import IdxYFDataUpdater  # noqa: E402
+from run_stats import RUN_STATS_TABLE  # noqa: E402
+from storage_sink import LocalSink, SupabaseSink  # noqa: E402
+
+INCOME_STMT_ROWS = [
+    "Total Revenue",
+    "Gross Profit",
+    "Operating Income",
+    "Pretax Income",
+    "Tax Provision",
+    "Net Income",
+    "EBIT",
+    "EBITDA",
+    "Diluted Average Shares",
+    "Interest Expense Non Operating",
+    "Interest Income",
+    "Interest Expense",
+    "Operating Expense",
+    "Cost Of Revenue",
+]
+BALANCE_SHEET_ROWS = [
+    "Cash Cash Equivalents And Short Term Investments",
+    "Total Assets",
+    "Total Non Current Assets",
+    "Total Liabilities Net Minority Interest",
+    "Current Liabilities",
+    "Total Debt",
+    "Stockholders Equity",
+    "Total Equity Gross Minority Interest",
+    "Inventory",
+    "Retained Earnings",
+    "Current Assets",
+]
+CASH_FLOW_ROWS = [
+    "Free Cash Flow",
+    "Operating Cash Flow",
+    "Changes In Cash",
+    "Capital Expenditure",
+]
+
+# stage name per wrapped updater method
+STAGES = {
+    "extract_symbols_from_db": "extract symbols",
+    "_get_last_daily_data": "last state",
+    "_get_last_dates": "last state",
+    "create_daily_data_records": "create records",
+    "create_key_stats_records": "create records",
+    "create_dividend_records": "create records",
+    "create_financials_records": "create records",
+    "_batch_upsert": "upsert",
+}
+
+
+class Latencies:
+    """Thread-safe latency samples per request kind, and wall time per stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.stages = {}
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.samples.setdefault(kind, []).append(seconds)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def summary(self):
+        summary = {}
+        for kind, samples in self.samples.items():
+            ms = np.array(samples) * 1000
+            summary[kind] = {
+                "n": len(ms),
+                "p50": float(np.percentile(ms, 50)),
+                "p95": float(np.percentile(ms, 95)),
+                "p99": float(np.percentile(ms, 99)),
+                "max": float(ms.max()),
+            }
+        return summary
+
+
+class FakeBackend:
+    """Latency and error distributions shared by the fake Ticker and client"""
+
+    def __init__(self, latencies, yf_latency_ms, yf_sigma, error_rate, db_latency_ms, seed):
+        self.latencies = latencies
+        self.yf_latency = yf_latency_ms / 1000
+        self.yf_sigma = yf_sigma
+        self.error_rate = error_rate
+        self.db_latency = db_latency_ms / 1000
+        self._rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()
+
+    def _draw(self):
+        with self._rng_lock:
+            return self._rng.lognormal(0, self.yf_sigma), self._rng.random()
+
+    def yf_request(self, kind):
+        factor, draw = self._draw()
+        seconds = self.yf_latency * factor
+        time.sleep(seconds)
+        self.latencies.add(f"yf {kind}", seconds)
+        if draw < self.error_rate:
+            raise ConnectionError(f"synthetic {kind} failure")
+
+    def db_request(self, kind):
+        start = time.perf_counter()
+        time.sleep(self.db_latency)
+        self.latencies.add(f"db {kind}", time.perf_counter() - start)
+
+
+def _symbol_rng(symbol, salt=""):
+    return np.random.default_rng(zlib.crc32(f"{symbol}{salt}".encode()))
+
+
+def _symbol_price(symbol):
+    return float(_symbol_rng(symbol).uniform(50, 10000))
+
+
+def _symbol_shares(symbol):
+    return float(_symbol_rng(symbol, "s").uniform(1e8, 1e11))
+
+
+def _quote(symbol):
+    price = _symbol_price(symbol)
+    return {
+        "symbol": symbol,
+        "marketCap": price * _symbol_shares(symbol),
+        "forwardEps": round(price / 15, 2),
+    }
+
+
+def _statement(symbol, rows, quarterly):
+    rng = _symbol_rng(symbol, "q" if quarterly else "a")
+    end = pd.Timestamp.now().normalize() - pd.offsets.QuarterEnd(1)
+    if quarterly:
+        dates = pd.date_range(end=end, periods=5, freq="QE")
+    else:
+        dates = pd.date_range(end=end, periods=4, freq="YE")
+    values = rng.lognormal(27, 1.5, (len(rows), len(dates)))
+    # statements come with some line items missing
+    values[rng.random(values.shape) < 0.1] = np.nan
+    return pd.DataFrame(values, index=rows, columns=dates[::-1])
+
+
+def make_ticker_class(backend):
+    class FakeTicker:
+        def __init__(self, symbol, session=None):
+            self.ticker = symbol
+            self._price = _symbol_price(symbol)
+            self._shares = _symbol_shares(symbol)
+
+        @property
+        def info(self):
+            backend.yf_request("info")
+            return {**_quote(self.ticker), "financialCurrency": "IDR", "currency": "IDR"}
+
+        @property
+        def dividends(self):
+            backend.yf_request("dividends")
+            rng = _symbol_rng(self.ticker, "d")
+            dates = pd.date_range(end=pd.Timestamp.now().normalize(), periods=5, freq="YE")
+            return pd.Series(rng.uniform(0.01, 0.05, len(dates)) * self._price, index=dates)
+
+        def _statement(self, kind, rows, quarterly):
+            backend.yf_request(kind)
+            return _statement(self.ticker, rows, quarterly)
+
+        income_stmt = property(lambda self: self._statement("income_stmt", INCOME_STMT_ROWS, False))
+        balance_sheet = property(lambda self: self._statement("balance_sheet", BALANCE_SHEET_ROWS, False))
+        cashflow = property(lambda self: self._statement("cashflow", CASH_FLOW_ROWS, False))
+        quarterly_income_stmt = property(lambda self: self._statement("quarterly_income_stmt", INCOME_STMT_ROWS, True))
+        quarterly_balance_sheet = property(lambda self: self._statement("quarterly_balance_sheet", BALANCE_SHEET_ROWS, True))
+        quarterly_cashflow = property(lambda self: self._statement("quarterly_cashflow", CASH_FLOW_ROWS, True))
+
+        def history(self, start=None, end=None, **kwargs):
+            backend.yf_request("history")
+            # end is exclusive, as in yfinance
+            if end:
+                dates = pd.bdate_range(start=start, end=pd.Timestamp(end) - pd.Timedelta(days=1))
+            else:
+                dates = pd.bdate_range(start=start, end=pd.Timestamp.now().normalize())
+            rng = _symbol_rng(self.ticker, "h")
+            close = self._price * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+            return pd.DataFrame(
+                {
+                    "Close": close.round(0),
+                    "Volume": rng.integers(1e4, 1e8, len(dates)).astype(float),
+                },
+                index=dates,
+            )
+
+    return FakeTicker
+
+
+def make_yf_data_class(backend):
+    class FakeYfData:
+        """Serves the batch quote endpoint"""
+
+        def get_raw_json(self, url, params=None, timeout=30):
+            backend.yf_request("quote")
+            return {
+                "quoteResponse": {
+                    "result": [_quote(symbol) for symbol in params["symbols"].split(",")]
+                }
+            }
+
+    return FakeYfData
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeHttpResponse:
+    is_success = True
+    status_code = 201
+    text = ""
+
+
+class FakeSession:
+    """The httpx client SupabaseSink posts encoded upserts with"""
+
+    def __init__(self, backend, target_table):
+        self.backend = backend
+        self.target_table = target_table
+
+    def post(self, path, params=None, headers=None, content=b""):
+        self.backend.db_request("upsert")
+        # bytes on the wire, compressed or not
+        self.backend.upsert_bytes += len(content)
+        if headers and headers.get("Content-Encoding") == "gzip":
+            content = gzip.decompress(content)
+        self.backend.rows_written[self.target_table] = self.backend.rows_written.get(
+            self.target_table, 0
+        ) + len(json.loads(content))
+        return FakeHttpResponse()
+
+
+class FakeQuery:
+    """The subset of postgrest's query builder used by IdxYFDataUpdater"""
+
+    def __init__(self, backend, rows_for, target_table=None):
+        self.backend = backend
+        self.rows_for = rows_for
+        self.target_table = target_table
+        self.symbols = None
+        self.bounds = None
+        self.records = None
+        self.inserted = False
+        self.session = FakeSession(backend, target_table)
+        self.path = f"/{target_table}"
+
+    def select(self, *columns):
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def in_(self, column, values):
+        self.symbols = list(values)
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, n):
+        self.bounds = (0, n - 1)
+        return self
+
+    def upsert(self, records, **kwargs):
+        self.records = records
+        return self
+
+    def insert(self, record, **kwargs):
+        # run_stats ledger rows
+        self.backend.run_stats.append(record)
+        self.inserted = True
+        return self
+
+    def execute(self):
+        if self.inserted:
+            return FakeResponse([])
+
+        if self.records is not None:
+            self.backend.db_request("upsert")
+            self.backend.rows_written[self.target_table] = (
+                self.backend.rows_written.get(self.target_table, 0) + len(self.records)
+            )
+            return FakeResponse([])
+
+        self.backend.db_request("select")
+        rows = self.rows_for(self.symbols)
+        if self.bounds is not None:
+            rows = rows[self.bounds[0] : self.bounds[1] + 1]
+        return FakeResponse(rows)
+
+
+class FakeSupabaseClient:
+    def __init__(self, backend, n_symbols, new_share):
+        self.backend = backend
+        self.universe = [f"S{i:05d}.JK" for i in range(n_symbols)]
+        rng = np.random.default_rng(1)
+        self.new_symbols = set(
+            np.array(self.universe)[rng.random(n_symbols) < new_share].tolist()
+        )
+        self.last_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+        # stored financials end one to four quarters before the last quarter end
+        self.last_financial_dates = [
+            (pd.Timestamp.now().normalize() - pd.offsets.QuarterEnd(k)).strftime("%Y-%m-%d")
+            for k in range(1, 5)
+        ]
+
+    def _existing(self, symbols):
+        return [s for s in (symbols or self.universe) if s not in self.new_symbols]
+
+    def table(self, name):
+        if name == "idx_active_company_profile":
+            return FakeQuery(
+                self.backend,
+                lambda symbols: [
+                    {"symbol": s, "wsj_format": 1} for s in (symbols or self.universe)
+                ],
+            )
+        if name == "idx_key_stats":
+            # stored forward_eps, unchanged for the existing symbols
+            return FakeQuery(
+                self.backend,
+                lambda symbols: [
+                    {"symbol": s, "forward_eps": _quote(s)["forwardEps"]}
+                    for s in self._existing(symbols)
+                ],
+                target_table=name,
+            )
+        # existence checks return one row, upserts go to the sink
+        return FakeQuery(self.backend, lambda symbols: [{}], target_table=name)
+
+    def rpc(self, name, params=None):
+        if name == "get_last_daily_data":
+
+            def rows_for(symbols):
+                rows = []
+                for s in self._existing(symbols):
+                    price = _symbol_price(s)
+                    rows.append(
+                        {
+                            "symbol": s,
+                            "date": self.last_date,
+                            "close": round(price),
+                            "volume": 1000,
+                            "market_cap": round(price * 1e9),
+                            "mcap_method": 1,
+                        }
+                    )
+                return rows
+
+        else:
+            financials = "financials" in params["table_name"]
+
+            def rows_for(symbols):
+                return [
+                    {
+                        "symbol": s,
+                        "last_date": self.last_financial_dates[
+                            _symbol_rng(s, "f").integers(4)
+                        ]
+                        if financials
+                        else self.last_date,
+                    }
+                    for s in self._existing(symbols)
+                ]
+
+        return FakeQuery(self.backend, rows_for)
+
+
+def instrument(updater, latencies):
+    """Times the updater's stages and each symbol's fetch"""
+    for method_name, stage in STAGES.items():
+        method = getattr(updater, method_name)
+
+        def timed(*args, _method=method, _stage=stage, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                latencies.add_stage(_stage, time.perf_counter() - start)
+
+        setattr(updater, method_name, timed)
+
+    finish_symbol = updater._finish_symbol
+
+    def timed_finish(started):
+        if started is not None:
+            latencies.add("symbol", time.monotonic() - started)
+        finish_symbol(started)
+
+    updater._finish_symbol = timed_finish
+
+
+def run_size(args):
+    latencies = Latencies()
+    backend = FakeBackend(
+        latencies,
+        args.yf_latency_ms,
+        args.yf_sigma,
+        args.error_rate,
+        args.db_latency_ms,
+        args.seed,
+    )
+    backend.rows_written = {}
+    backend.run_stats = []
+    backend.upsert_bytes = 0
+    failed_tables = {}
+    yfdataupdater.yf.Ticker = make_ticker_class(backend)
+    yfdataupdater.YfData = make_yf_data_class(backend)
+    if args.local_db:
+        # a fresh file, so every run of a size writes the same rows
+        if os.path.exists(args.local_db):
+            os.remove(args.local_db)
+        client = LocalSink(args.local_db)
+        client.upsert(
+            "idx_active_company_profile",
+            [
+                {"symbol": f"S{i:05d}.JK", "updated_on": "2000-01-01 00:00:00", "wsj_format": 1}
+                for i in range(args.size)
+            ],
+            ["symbol"],
+        )
+    else:
+        client = SupabaseSink(
+            FakeSupabaseClient(backend, args.size, args.new_share),
+            compress=args.compress_upserts,
+        )
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    # output of the updater itself is not part of the report
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            for target_table in args.tables.split(","):
+                lanes = [args.daily_lane]
+                if args.daily_lane == "split":
+                    lanes = ["incremental", "backfill"] if "daily_data" in target_table else ["all"]
+                for lane in lanes:
+                    updater = IdxYFDataUpdater(max_workers=args.workers)
+                    updater.set_daily_lane(lane, args.backfill_workers)
+                    updater.set_financials_sweep(args.financials_sweep_weeks)
+                    if args.transform_workers > 1:
+                        updater.set_transform_pool(args.transform_workers)
+                    instrument(updater, latencies)
+                    try:
+                        updater.upsert_data_to_db(client, target_table, batch_size=-1)
+                    except Exception as e:
+                        # the scrape scripts stage the records and carry on likewise
+                        failed_tables[target_table] = repr(e)
+                    finally:
+                        updater.close_transform_pool()
+        finally:
+            sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.local_db:
+        columns = [
+            "target_table", "symbols_attempted", "symbols_succeeded", "requests_issued",
+            "cache_hit_rate", "rows_written", "rows_skipped", "stage_seconds",
+        ]
+        for run in client.select_page(RUN_STATS_TABLE, columns, [("started_at", False)]):
+            run["stage_seconds"] = json.loads(run["stage_seconds"])
+            backend.run_stats.append(run)
+            backend.rows_written[run["target_table"]] = (
+                backend.rows_written.get(run["target_table"], 0) + run["rows_written"]
+            )
+        client.close()
+
+    print(
+        json.dumps(
+            {
+                "size": args.size,
+                "elapsed": elapsed,
+                "peak_mb": peak_kb / 1024,
+                "growth_mb": (peak_kb - baseline_kb) / 1024,
+                "rows_written": backend.rows_written,
+                "upsert_mb": backend.upsert_bytes / (1 << 20),
+                "failed_tables": failed_tables,
+                "run_stats": backend.run_stats,
+                "stages": latencies.stages,
+                "latencies": latencies.summary(),
+            }
+        )
+    )
+
+
+def report(result):
+    rows = sum(result["rows_written"].values())
+    print(
+        f"\n{result['size']} symbols: {result['elapsed']:.1f}s, "
+        f"{result['size'] / result['elapsed']:.1f} symbols/s, {rows} rows written "
+        f"({', '.join(f'{t}: {n}' for t, n in result['rows_written'].items())}), "
+        f"peak RSS {result['peak_mb']:.0f} MB ({result['growth_mb']:.0f} MB over import), "
+        f"{result['upsert_mb']:.1f} MB of upsert bodies"
+    )
+    for target_table, error in result["failed_tables"].items():
+        print(f"  {target_table} failed: {error}")
+    for run in result["run_stats"]:
+        print(
+            f"  {run['target_table']}: {run['symbols_succeeded']}/{run['symbols_attempted']} symbols, "
+            f"{run['requests_issued']} requests, cache hit rate {run['cache_hit_rate']}, "
+            f"{run['rows_written']} rows written, {run['rows_skipped']} unchanged rows skipped, "
+            f"{sum(run['stage_seconds'].values()):.2f}s"
+        )
+    print(f"  {'stage':<16} {'wall (s)':>9}")
+    for stage, seconds in result["stages"].items():
+        print(f"  {stage:<16} {seconds:>9.2f}")
+    print(f"  {'latency (ms)':<26} {'n':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for kind, stats in sorted(result["latencies"].items()):
+        print(
+            f"  {kind:<26} {stats['n']:>8} {stats['p50']:>8.1f} {stats['p95']:>8.1f} "
+            f"{stats['p99']:>8.1f} {stats['max']:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma separated universe sizes")
+    parser.add_argument("--tables", default="idx_daily_data,idx_key_stats,idx_dividend", help="Comma separated target tables, run in order")
+    parser.add_argument("--workers", type=int, default=8, help="max_workers of the updater")
+    parser.add_argument("--yf_latency_ms", type=float, default=2.0, help="Median YF request latency")
+    parser.add_argument("--yf_sigma", type=float, default=0.75, help="Sigma of the log-normal YF latency")
+    parser.add_argument("--error_rate", type=float, default=0.01, help="Share of failing YF requests")
+    parser.add_argument("--db_latency_ms", type=float, default=5.0, help="Latency of each DB request")
+    parser.add_argument("--new_share", type=float, default=0.02, help="Share of symbols without stored data")
+    parser.add_argument("--daily_lane", default="all", choices=["all", "incremental", "backfill", "split"], help="Daily data lane, split runs the incremental lane and then the backfill lane")
+    parser.add_argument("--backfill_workers", type=int, default=1, help="Concurrency of the backfill lane")
+    parser.add_argument("--transform_workers", type=int, default=1, help="Worker processes of the record transforms, 1 transforms in process")
+    parser.add_argument("--financials_sweep_weeks", type=int, default=4, help="Rolling sweep of the financials symbol selection, 1 fetches every symbol")
+    parser.add_argument("--local_db", default=None, help="Write to this local SQLite (or .duckdb) file, recreated per size, instead of the fake Supabase client")
+    parser.add_argument("--compress_upserts", action="store_true", help="gzip the upsert bodies sent to the fake Supabase client")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        run_size(args)
+        return
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        output = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--size", str(size)],
+            capture_output=True,
+            text=True,
+        )
+        if output.returncode != 0:
+            print(f"\n{size} symbols failed:\n{output.stderr}")
+            continue
+        report(json.loads(output.stdout.strip().splitlines()[-1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# One row per (symbol, date). Symbols are stored as codes into
+# DailyDataBuffer.symbols, missing floats as NaN and a missing mcap_method as 0.
+DAILY_DATA_DTYPE = np.dtype(
+    [
+        ("symbol", "i4"),
+        ("date", "M8[D]"),
+        ("close", "f8"),
+        ("volume", "f8"),
+        ("market_cap", "f8"),
+        ("mcap_method", "i1"),
+    ]
+)
+
+# Columns compared with the stored last row by drop_unchanged
+CHANGE_COLUMNS = ["close", "volume", "market_cap"]
+
+# Number of rows turned into dicts at a time when iterating over a buffer
+ITER_CHUNK_SIZE = 1000
+
+
+def frame_to_rows(data):
+    """Returns the rows of a frame indexed by "%Y-%m-%d" date strings, with symbol code 0
+
+    Args:
+        data (pd.DataFrame): Frame with Close, Volume, Market Cap and mcap_method columns
+    """
+    rows = np.zeros(len(data), dtype=DAILY_DATA_DTYPE)
+    if len(data) == 0:
+        return rows
+
+    rows["date"] = np.asarray(data.index, dtype="M8[D]")
+    rows["close"] = pd.to_numeric(data["Close"], errors="coerce").to_numpy("f8")
+    rows["volume"] = pd.to_numeric(data["Volume"], errors="coerce").to_numpy("f8")
+    rows["market_cap"] = pd.to_numeric(data["Market Cap"], errors="coerce").to_numpy("f8")
+    rows["mcap_method"] = (
+        pd.to_numeric(data["mcap_method"], errors="coerce").fillna(0).to_numpy("i1")
+    )
+    return rows
+
+
+class DailyDataBuffer:
+    """Compact store of daily data rows that are turned into record dicts on demand
+
+    Supports len(), iteration and slicing like the list of records it replaces,
+    so _batch_upsert only builds dicts for the batch it is sending.
+    """
+
+    def __init__(self, updated_on, int_cols=["volume", "market_cap", "mcap_method"]):
+        self.updated_on = updated_on
+        self.int_cols = list(int_cols)
+        self.symbols = []
+        self.symbol_key = "symbol"
+        self._symbol_codes = {}
+        self._symbol_map = None
+        self._chunks = []
+        self._rows = np.empty(0, dtype=DAILY_DATA_DTYPE)
+
+    def _get_symbol_code(self, symbol):
+        code = self._symbol_codes.get(symbol)
+        if code is None:
+            code = len(self.symbols)
+            self._symbol_codes[symbol] = code
+            self.symbols.append(symbol)
+        return code
+
+    def append_frame(self, symbol, data):
+        """Appends a symbol's frame indexed by "%Y-%m-%d" date strings
+
+        Args:
+            symbol (str): Symbol of the rows
+            data (pd.DataFrame): Frame with Close, Volume, Market Cap and mcap_method columns
+        """
+        if len(data) == 0:
+            return
+
+        self.append_rows(symbol, frame_to_rows(data))
+
+    def append_rows(self, symbol, rows):
+        """Appends a symbol's rows made by frame_to_rows, e.g. in a transform worker process"""
+        if len(rows) == 0:
+            return
+
+        rows["symbol"] = self._get_symbol_code(symbol)
+        self._chunks.append(rows)
+
+    def map_symbols(self, key, mapping):
+        """Emits mapping[symbol] under key instead of the symbol, e.g. stock_id for the US tables"""
+        self.symbol_key = key
+        self._symbol_map = mapping
+
+    @property
+    def rows(self):
+        if self._chunks:
+            self._rows = np.concatenate([self._rows] + self._chunks)
+            self._chunks = []
+        return self._rows
+
+    def _get_symbol_values(self):
+        if self._symbol_map is None:
+            return self.symbols
+        return [self._symbol_map[symbol] for symbol in self.symbols]
+
+    def _to_records(self, rows, use_symbols=False):
+        symbol_values = self.symbols if use_symbols else self._get_symbol_values()
+        symbol_key = "symbol" if use_symbols else self.symbol_key
+        dates = np.datetime_as_string(rows["date"], unit="D").tolist()
+        int_cols = set(self.int_cols)
+
+        def convert(col, value):
+            if value != value:
+                return None
+            if col in int_cols:
+                return round(value)
+            return value
+
+        records = []
+        for (code, _, close, volume, market_cap, mcap_method), date in zip(
+            rows.tolist(), dates
+        ):
+            records.append(
+                {
+                    "updated_on": self.updated_on,
+                    symbol_key: symbol_values[code],
+                    "date": date,
+                    "close": convert("close", close),
+                    "volume": convert("volume", volume),
+                    "market_cap": convert("market_cap", market_cap),
+                    "mcap_method": mcap_method if mcap_method else None,
+                }
+            )
+        return records
+
+    def get_last_records(self):
+        """Returns the record of each symbol's latest date, keyed by symbol even if symbols are mapped"""
+        rows = self.rows
+        if len(rows) == 0:
+            return []
+
+        order = np.lexsort((rows["date"], rows["symbol"]))
+        sorted_rows = rows[order]
+        is_last = np.append(sorted_rows["symbol"][1:] != sorted_rows["symbol"][:-1], True)
+        return self._to_records(sorted_rows[is_last], use_symbols=True)
+
+    def drop_unchanged(self, last_data):
+        """Drops rows that would rewrite a symbol's stored last row with the same values
+
+        A row is dropped when it has the stored row's date and exactly its
+        close, volume and market_cap, like the re-fetched last_date row used to
+        be dropped in _get_daily_data; a missing value never matches.
+
+        Args:
+            last_data (dict): Last stored row per symbol, with date, close, volume and market_cap
+
+        Returns:
+            int: Number of rows dropped
+        """
+        rows = self.rows
+        if len(rows) == 0 or not last_data:
+            return 0
+
+        # stored last row per symbol code, NaT/NaN where the symbol has none
+        last_rows = np.zeros(len(self.symbols), dtype=DAILY_DATA_DTYPE)
+        last_rows["date"] = np.datetime64("NaT")
+        for code, symbol in enumerate(self.symbols):
+            datum = last_data.get(symbol)
+            if not datum:
+                continue
+            last_rows["date"][code] = np.datetime64(str(datum["date"])[:10], "D")
+            for col in CHANGE_COLUMNS:
+                value = datum.get(col)
+                last_rows[col][code] = np.nan if value is None else float(value)
+
+        stored = last_rows[rows["symbol"]]
+        unchanged = rows["date"] == stored["date"]
+        for col in CHANGE_COLUMNS:
+            unchanged &= rows[col] == stored[col]
+
+        self._rows = rows[~unchanged]
+        return int(unchanged.sum())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._to_records(self.rows[key])
+        return self._to_records(self.rows[key : key + 1])[0]
+
+    def __iter__(self):
+        rows = self.rows
+        for i in range(0, len(rows), ITER_CHUNK_SIZE):
+            yield from self._to_records(rows[i : i + ITER_CHUNK_SIZE])
+
+    def to_arrow(self):
+        """Returns the rows as a pyarrow Table with the record column names"""
+        rows = self.rows
+        symbol_values = self._get_symbol_values()
+
+        def to_array(col):
+            values = rows[col]
+            if col in self.int_cols:
+                return pa.array(np.round(values), from_pandas=True).cast(pa.int64())
+            return pa.array(values, from_pandas=True)
+
+        symbol_array = pa.DictionaryArray.from_arrays(
+            pa.array(rows["symbol"]), pa.array(symbol_values)
+        ).dictionary_decode()
+
+        return pa.table(
+            {
+                "updated_on": pa.repeat(self.updated_on, len(rows)),
+                self.symbol_key: symbol_array,
+                "date": pa.array(np.datetime_as_string(rows["date"], unit="D")),
+                "close": to_array("close"),
+                "volume": to_array("volume"),
+                "market_cap": to_array("market_cap"),
+                "mcap_method": pa.array(rows["mcap_method"], mask=rows["mcap_method"] == 0),
+            }
+        )
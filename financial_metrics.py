@@ -0,0 +1,405 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the financials tables and how they are read from the YF statements.
+# Each metric is either read from a statement, taking the first of its source rows
+# that has a value, or set to a constant value. Optional keys:
+#
+# - derive: fallback computed from the other columns (numpy arrays by column)
+#   where the source rows have no value
+# - dtype: "int" (default) or "float"
+# - null_for_wsj_formats: WSJ formats whose statements lack the metric, it is
+#   set to None for their symbols
+# - convert_currency: whether the value is an amount in financialCurrency
+#   (see IdxYFDataUpdater.convert_financials_currency)
+#
+# Records have the columns in this order, after symbol and date.
+FINANCIAL_METRICS = [
+    # income statement
+    {
+        "column": "total_revenue",
+        "statement": "income_stmt",
+        "sources": ["Total Revenue"],
+        "convert_currency": True,
+    },
+    {
+        "column": "gross_income",
+        "statement": "income_stmt",
+        "sources": ["Gross Profit"],
+        "null_for_wsj_formats": [3, 4],
+        "convert_currency": True,
+    },
+    {
+        "column": "operating_income",
+        "statement": "income_stmt",
+        "sources": ["Operating Income"],
+        "convert_currency": True,
+    },
+    {
+        "column": "pretax_income",
+        "statement": "income_stmt",
+        "sources": ["Pretax Income"],
+        "convert_currency": True,
+    },
+    {
+        "column": "income_taxes",
+        "statement": "income_stmt",
+        "sources": ["Tax Provision"],
+        "convert_currency": True,
+    },
+    {
+        "column": "net_income",
+        "statement": "income_stmt",
+        "sources": ["Net Income"],
+        "convert_currency": True,
+    },
+    {
+        "column": "ebit",
+        "statement": "income_stmt",
+        "sources": ["EBIT"],
+        "null_for_wsj_formats": [4],
+        "convert_currency": True,
+    },
+    {
+        "column": "ebitda",
+        "statement": "income_stmt",
+        "sources": ["EBITDA"],
+        "null_for_wsj_formats": [3, 4],
+        "convert_currency": True,
+    },
+    {
+        "column": "diluted_shares_outstanding",
+        "statement": "income_stmt",
+        "sources": ["Diluted Average Shares"],
+    },
+    {
+        "column": "interest_expense_non_operating",
+        "statement": "income_stmt",
+        "sources": ["Interest Expense Non Operating"],
+        "null_for_wsj_formats": [4],
+        "convert_currency": True,
+    },
+    {
+        "column": "interest_income",
+        "statement": "income_stmt",
+        "sources": ["Interest Income"],
+    },
+    {
+        "column": "interest_expense",
+        "statement": "income_stmt",
+        "sources": ["Interest Expense"],
+    },
+    {
+        "column": "net_interest_income",
+        "statement": "income_stmt",
+        "sources": ["Net Interest Income"],
+    },
+    {
+        "column": "non_interest_income",
+        "statement": "income_stmt",
+        "sources": ["Interest Income Non Operating"],
+        "derive": lambda m: m["total_revenue"] - m["net_interest_income"],
+    },
+    {
+        "column": "operating_expense",
+        "statement": "income_stmt",
+        "sources": ["Operating Expense"],
+    },
+    {
+        "column": "non_operating_income_or_loss",
+        "statement": "income_stmt",
+        "sources": ["Net Non Operating Interest Income Expense"],
+    },
+    {
+        "column": "minorities",
+        "statement": "income_stmt",
+        "sources": ["Minority Interests"],
+    },
+    {
+        "column": "provision",
+        "statement": "income_stmt",
+        "sources": ["Provision For Doubtful Accounts", "Provision For Credit Losses"],
+    },
+    {
+        "column": "cost_of_revenue",
+        "statement": "income_stmt",
+        "sources": ["Cost Of Revenue", "Reconciled Cost Of Revenue"],
+    },
+    # balance sheet, cash_only and total_cash_and_due_from_banks are missing from YF API
+    {
+        "column": "cash_and_short_term_investments",
+        "statement": "balance_sheet",
+        "sources": ["Cash Cash Equivalents And Short Term Investments"],
+        "null_for_wsj_formats": [3, 4],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_assets",
+        "statement": "balance_sheet",
+        "sources": ["Total Assets"],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_non_current_assets",
+        "statement": "balance_sheet",
+        "sources": ["Total Non Current Assets"],
+        "null_for_wsj_formats": [3, 4],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_liabilities",
+        "statement": "balance_sheet",
+        "sources": ["Total Liabilities Net Minority Interest"],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_current_liabilities",
+        "statement": "balance_sheet",
+        "sources": ["Current Liabilities"],
+        "null_for_wsj_formats": [3, 4],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_debt",
+        "statement": "balance_sheet",
+        "sources": ["Total Debt"],
+        "convert_currency": True,
+    },
+    {
+        "column": "stockholders_equity",
+        "statement": "balance_sheet",
+        "sources": ["Stockholders Equity"],
+        "convert_currency": True,
+    },
+    {
+        "column": "total_equity",
+        "statement": "balance_sheet",
+        "sources": ["Total Equity Gross Minority Interest"],
+        "convert_currency": True,
+    },
+    {
+        "column": "inventories",
+        "statement": "balance_sheet",
+        "sources": ["Inventory"],
+    },
+    {
+        "column": "retained_earnings",
+        "statement": "balance_sheet",
+        "sources": ["Retained Earnings"],
+    },
+    {
+        "column": "prepaid_assets",
+        "statement": "balance_sheet",
+        "sources": ["Prepaid Assets"],
+    },
+    {
+        "column": "allowance_for_loans",
+        "statement": "balance_sheet",
+        "sources": ["Allowance For Doubtful Accounts Receivable"],
+    },
+    {
+        "column": "total_current_asset",
+        "statement": "balance_sheet",
+        "sources": ["Current Assets"],
+    },
+    {
+        "column": "total_non_current_liabilities",
+        "statement": "balance_sheet",
+        "sources": ["Total Non Current Liabilities Net Minority Interest"],
+    },
+    # cash flow statement
+    {
+        "column": "free_cash_flow",
+        "statement": "cashflow",
+        "sources": ["Free Cash Flow"],
+        "convert_currency": True,
+    },
+    {
+        "column": "net_operating_cash_flow",
+        "statement": "cashflow",
+        "sources": [
+            "Cash Flowsfromusedin Operating Activities Direct",
+            "Operating Cash Flow",
+        ],
+        "convert_currency": True,
+    },
+    {
+        "column": "net_cash_flow",
+        "statement": "cashflow",
+        "sources": ["Changes In Cash"],
+    },
+    {
+        "column": "capital_expenditure",
+        "statement": "cashflow",
+        "sources": ["Capital Expenditure"],
+    },
+    # 1 is the YF API
+    {"column": "source", "value": 1},
+]
+
+
+class MetricPlan:
+    """Transform of YF statements into records, compiled once from a metric spec
+
+    The statements of all symbols are read into one (symbol, date) x source row
+    matrix, and every column, fallback, derivation and WSJ format rule is then
+    applied to whole columns of it.
+    """
+
+    def __init__(self, metrics):
+        """
+        Args:
+            metrics (list): Metric spec, see FINANCIAL_METRICS
+        """
+        self.columns = [metric["column"] for metric in metrics]
+        # source rows read from each statement, and their matrix column
+        self.statement_rows = {}
+        source_index = {}
+        for metric in metrics:
+            for source in metric.get("sources", []):
+                key = (metric["statement"], source)
+                if key not in source_index:
+                    source_index[key] = len(source_index)
+                    self.statement_rows.setdefault(metric["statement"], []).append(source)
+        self.n_sources = len(source_index)
+        self._statement_index = {
+            statement: [source_index[(statement, source)] for source in sources]
+            for statement, sources in self.statement_rows.items()
+        }
+
+        self._sourced = [
+            (i, [source_index[(metric["statement"], s)] for s in metric["sources"]])
+            for i, metric in enumerate(metrics)
+            if metric.get("sources")
+        ]
+        self._constants = [
+            (i, metric["value"]) for i, metric in enumerate(metrics) if "value" in metric
+        ]
+        self._derived = [
+            (i, metric["derive"]) for i, metric in enumerate(metrics) if "derive" in metric
+        ]
+        wsj_nulls = {}
+        for i, metric in enumerate(metrics):
+            for wsj_format in metric.get("null_for_wsj_formats", []):
+                wsj_nulls.setdefault(wsj_format, []).append(i)
+        self._wsj_nulls = wsj_nulls
+        self._int_columns = [
+            i for i, metric in enumerate(metrics) if metric.get("dtype", "int") == "int"
+        ]
+        self._float_columns = [
+            i for i, metric in enumerate(metrics) if metric.get("dtype") == "float"
+        ]
+
+    def _read_statements(self, companies_statements, last_dates):
+        keys = []
+        key_index = {}
+        rows_by_statement = {statement: ([], []) for statement in self.statement_rows}
+
+        for symbol, statements in companies_statements.items():
+            last_date = None
+            if last_dates:
+                last_date = pd.to_datetime(last_dates.get(symbol) or "1900-01-01")
+
+            for statement, sources in self.statement_rows.items():
+                for date, data in (statements.get(statement) or {}).items():
+                    date = pd.Timestamp(date)
+                    if last_date is not None and not date > last_date:
+                        continue
+
+                    key = (symbol, date)
+                    index = key_index.get(key)
+                    if index is None:
+                        index = key_index[key] = len(keys)
+                        keys.append(key)
+
+                    indices, values = rows_by_statement[statement]
+                    indices.append(index)
+                    values.append([data.get(source) for source in sources])
+
+        matrix = np.full((len(keys), self.n_sources), np.nan)
+        for statement, (indices, values) in rows_by_statement.items():
+            if indices:
+                matrix[np.ix_(indices, self._statement_index[statement])] = np.array(
+                    values, dtype="f8"
+                )
+
+        return keys, matrix
+
+    def compute(self, companies_statements, last_dates={}, wsj_formats={}):
+        """Returns the (symbol, date) keys found in any of the statements and their column values
+
+        Args:
+            companies_statements (dict): Statements per symbol, each {date: {row: value}}
+            last_dates (dict, optional): Last stored date per symbol, only later dates are kept. Defaults to {}, which keeps all dates.
+            wsj_formats (dict, optional): WSJ format per symbol. Defaults to {}.
+
+        Returns:
+            tuple: List of keys and a float array of one row per key and one column per metric, NaN where missing
+        """
+        keys, matrix = self._read_statements(companies_statements, last_dates)
+        if not keys:
+            return [], np.empty((0, len(self.columns)))
+
+        values = np.full((len(keys), len(self.columns)), np.nan)
+        for i, sources in self._sourced:
+            column = matrix[:, sources[0]].copy()
+            for source in sources[1:]:
+                column = np.where(np.isnan(column), matrix[:, source], column)
+            values[:, i] = column
+
+        for i, value in self._constants:
+            values[:, i] = value
+
+        by_column = {column: values[:, i] for i, column in enumerate(self.columns)}
+        for i, derive in self._derived:
+            values[:, i] = np.where(np.isnan(values[:, i]), derive(by_column), values[:, i])
+
+        if wsj_formats:
+            symbol_formats = np.array([wsj_formats.get(symbol) for symbol, _ in keys], dtype=object)
+            for wsj_format, columns in self._wsj_nulls.items():
+                values[np.ix_(symbol_formats == wsj_format, columns)] = np.nan
+
+        return keys, values
+
+    def to_records(self, keys, values, updated_on=None):
+        """Returns the records of computed keys and values, sorted by symbol and date
+
+        Args:
+            keys (list): (symbol, date) of each row
+            values (np.ndarray): Column values of each row
+            updated_on (str, optional): updated_on of the records. Defaults to None, which leaves it out.
+        """
+        if not keys:
+            return []
+
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        values = values[order]
+        missing = np.isnan(values)
+
+        output = np.empty(values.shape, dtype=object)
+        if self._int_columns:
+            int_values = values[:, self._int_columns]
+            ints = np.round(np.where(np.isnan(int_values), 0, int_values))
+            output[:, self._int_columns] = ints.astype(np.int64).astype(object)
+        if self._float_columns:
+            output[:, self._float_columns] = values[:, self._float_columns].astype(object)
+        output[missing] = None
+
+        records = []
+        for index, row in zip(order, output.tolist()):
+            symbol, date = keys[index]
+            record = {"symbol": symbol, "date": date.strftime("%Y-%m-%d")}
+            record.update(zip(self.columns, row))
+            if updated_on is not None:
+                record["updated_on"] = updated_on
+            records.append(record)
+
+        return records
+
+    def transform(self, companies_statements, last_dates={}, wsj_formats={}, updated_on=None):
+        """Returns one record per (symbol, date) found in any of the statements, see compute"""
+        keys, values = self.compute(companies_statements, last_dates, wsj_formats)
+        return self.to_records(keys, values, updated_on)
+
+
+FINANCIALS_PLAN = MetricPlan(FINANCIAL_METRICS)
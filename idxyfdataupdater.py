@@ -1,48 +1,88 @@
-import time
 from datetime import datetime
 
 from currency_converter import ECB_URL, CurrencyConverter
 
+from financial_metrics import FINANCIAL_METRICS
+from storage_sink import SupabaseSink
 from yfdataupdater import YFDataUpdater
 
+# Financials columns converted to IDR when a company reports in USD
+CURRENCY_COLUMNS = {
+    metric["column"] for metric in FINANCIAL_METRICS if metric.get("convert_currency")
+}
 
-class IdxYFDataUpdater(YFDataUpdater):
-    def __init__(self):
-        super().__init__()
 
-    def extract_symbols_from_db(self, supabase_client, batch_size=100, batch_num=1):
+class IdxYFDataUpdater(YFDataUpdater):
+    ON_CONFLICT = {
+        "daily_data": ["symbol", "date"],
+        "key_stats": ["symbol"],
+        "dividend": ["symbol", "date"],
+        "financials": ["symbol", "date"],
+    }
+    DEFAULT_SINK = SupabaseSink
+    FETCH_FINANCIAL_CURRENCY = True
+    SELECT_DUE_FINANCIALS = True
+    TRADING_CALENDAR = "IDX"
+
+    def __init__(self, max_workers=1):
+        super().__init__(max_workers=max_workers)
+
+    def extract_symbols_from_db(self, db_client, batch_size=100, batch_num=1):
         """Extracts symbols from a table in the database
 
         Args:
-            supabase_client (SupabaseClient): Supabase client
-            target_table (str): Target table name
+            db_client (StorageSink or SupabaseClient): Storage sink, or a Supabase client
             batch_size (int, optional): Number of symbols to extract. Defaults to 100. If batch_size is set to -1, all symbols will be extracted.
             batch_num (int, optional): Batch number. Defaults to 1.
 
         Raises:
             Exception:  If there are no symbols to extract
         """
-        response = (
-            supabase_client.table("idx_active_company_profile")
-            .select("symbol")
-            .order("updated_on", desc=False)
-            .execute()
-        )
-
-        symbols = [symbol["symbol"] for symbol in response.data]
+        sink = self._as_sink(db_client)
+        order = [("updated_on", False), ("symbol", False)]
 
         if batch_size == -1:
-            batch_symbols = symbols
+            rows = sink.select_page("idx_active_company_profile", ["symbol"], order)
         elif batch_size > 0:
-            batch_symbols = symbols[
-                (batch_num - 1) * batch_size : batch_num * batch_size
-            ]
+            rows = sink.select_page(
+                "idx_active_company_profile",
+                ["symbol"],
+                order,
+                start=(batch_num - 1) * batch_size,
+                end=batch_num * batch_size - 1,
+            )
+
+        batch_symbols = [row["symbol"] for row in rows]
 
         if len(batch_symbols) == 0:
             raise Exception("No symbols to extract")
 
         self.symbols = batch_symbols
 
+    def _get_last_daily_data(self, sink, target_table, symbols):
+        rows = sink.select_last_rows(target_table, "symbol", symbols)
+
+        return {
+            entry["symbol"]: {
+                "date": entry["date"],
+                "close": entry["close"],
+                "volume": entry["volume"],
+                "market_cap": entry["market_cap"],
+                "mcap_method": entry["mcap_method"],
+            }
+            for entry in rows
+        }
+
+    def _get_last_dates(self, sink, target_table, symbols):
+        rows = sink.select_last_dates(target_table, "symbol", symbols)
+
+        return {row["symbol"]: row["last_date"] for row in rows}
+
+    def _get_stored_key_stats(self, sink, target_table, symbols):
+        rows = sink.select_in(target_table, ["symbol", "forward_eps"], "symbol", symbols)
+
+        return {row["symbol"]: row for row in rows}
+
     def convert_financials_currency(self, financial_records, currency_dict):
         def get_conversion_rate(from_currency, to_currency, str_date):
             rate = self._conversion_rates["USD_IDR"].get(str_date)
@@ -65,27 +105,7 @@ class IdxYFDataUpdater(YFDataUpdater):
 
                 new_record = record.copy()
                 for k, v in new_record.items():
-                    if k in [
-                        "total_revenue",
-                        "gross_income",
-                        "operating_income",
-                        "pretax_income",
-                        "income_taxes",
-                        "net_income",
-                        "ebit",
-                        "ebitda",
-                        "interest_expense_non_operating",
-                        "cash_and_short_term_investments",
-                        "total_assets",
-                        "total_non_current_assets",
-                        "total_liabilities",
-                        "total_current_liabilities",
-                        "total_debt",
-                        "stockholders_equity",
-                        "total_equity",
-                        "free_cash_flow",
-                        "net_operating_cash_flow",
-                    ]:
+                    if k in CURRENCY_COLUMNS:
                         if type(new_record[k]) == int:
                             new_record[k] = self._cast_int(v * conversion_rate)
                         elif type(new_record[k]) == float:
@@ -103,139 +123,131 @@ class IdxYFDataUpdater(YFDataUpdater):
 
         return new_records
 
-    def _batch_upsert(
-        self,
-        supabase_client,
-        target_table,
-        records,
-        on_conflict,
-        batch_size=25,
-        max_retry=3,
-    ):
-        if not records:
-            print("No records to upsert")
-        else:
-            for i in range(0, len(records), batch_size):
-                retry_count = 0
-                while retry_count < max_retry:
-                    try:
-                        supabase_client.table(target_table).upsert(
-                            records[i : i + batch_size],
-                            returning="minimal",
-                            on_conflict=on_conflict,
-                        ).execute()
-                        break
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count == max_retry:
-                            raise e
-                        time.sleep(3)
-
-            print(f"Successfully upserted {len(records)} records to {target_table}")
-
     def upsert_data_to_db(
-        self, supabase_client, target_table, batch_size=100, batch_num=1
+        self, db_client, target_table, batch_size=100, batch_num=1, extract_symbols=True
     ):
         """Upserts data to the target table in the database
 
         Args:
-            supabase_client (SupabaseClient): Supabase client
+            db_client (StorageSink or SupabaseClient): Storage sink, or a Supabase client
             target_table (str): Target table name
             batch_size (int, optional): Number of symbols to extract. Defaults to 100. If batch_size is set to -1, all symbols will be extracted.
             batch_num (int, optional): Batch number. Defaults to 1.
+            extract_symbols (bool, optional): Whether to extract the batch's symbols first. Defaults to True, False keeps the current symbols.
         """
+        sink = self._as_sink(db_client)
 
-        try:
-            supabase_client.table(target_table).select("*").limit(1).execute()
-        except Exception as e:
+        if not sink.table_exists(target_table):
             print(f"Table {target_table} does not exist")
             return
 
-        self.extract_symbols_from_db(
-            supabase_client,
-            batch_size,
-            batch_num,
-        )
+        self._start_run(target_table, batch_size, batch_num)
 
-        if "daily_data" in target_table:
-            response = supabase_client.rpc("get_last_daily_data", params=None).execute()
-            last_daily_data = {
-                entry["symbol"]: {
-                    "date": entry["date"],
-                    "close": entry["close"],
-                    "volume": entry["volume"],
-                    "market_cap": entry["market_cap"],
-                    "mcap_method": entry["mcap_method"],
-                }
-                for entry in response.data
-            }
-            self.create_daily_data_records(last_daily_data, int_close=True)
-            records = self.new_records["daily_data"]
-            on_conflict = "symbol, date"
-
-        elif "key_stats" in target_table:
-            self.create_key_stats_records()
-            records = self.new_records["key_stats"]
-            on_conflict = "symbol"
-
-        elif "dividend" in target_table:
-            response = supabase_client.rpc(
-                "get_last_date", params={"table_name": target_table}
-            ).execute()
-            last_dividend_dates = {
-                row["symbol"]: row["last_date"] for row in response.data
-            }
-            self.create_dividend_records(last_dividend_dates)
-            records = self.new_records["dividend"]
-            on_conflict = "symbol, date"
-
-        elif "financials" in target_table:
-            if "quarterly" in target_table:
-                quarterly = True
-                period = "quarterly"
-            elif "annual" in target_table:
-                quarterly = False
-                period = "annual"
-            else:
-                raise Exception("Invalid table name")
-
-            # response = supabase_client.rpc(
-            #     "get_outdated_symbols", params={"table_name": target_table, "source":1}
-            # ).execute()
-
-            response = supabase_client.rpc(
-                "get_last_date", params={"table_name": target_table}
-            ).execute()
+        try:
+            if extract_symbols:
+                self.extract_symbols_from_db(
+                    sink,
+                    batch_size,
+                    batch_num,
+                )
+            self.run_stats.lap("extract_symbols")
 
-            last_financial_dates = {
-                row["symbol"]: row["last_date"] for row in response.data
-            }
+            if "daily_data" in target_table:
+                last_daily_data = self._get_last_state(
+                    target_table,
+                    lambda: self._get_max_updated_on(sink, target_table),
+                    lambda symbols: self._get_last_daily_data(sink, target_table, symbols),
+                )
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(
+                    target_table,
+                    batch_num,
+                    {symbol: datum["date"] for symbol, datum in last_daily_data.items()},
+                )
+                self.create_daily_data_records(last_daily_data, int_close=True)
+                records = self._skip_unchanged_records(
+                    target_table, self.new_records["daily_data"], last_daily_data
+                )
+                on_conflict = self.ON_CONFLICT["daily_data"]
 
-            # self.symbols = [s for s in self.symbols if s in last_financial_dates]
+            elif "key_stats" in target_table:
+                stored_key_stats = self._get_stored_key_stats(
+                    sink, target_table, self.symbols
+                )
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(target_table, batch_num)
+                self.create_key_stats_records()
+                records = self._skip_unchanged_records(
+                    target_table, self.new_records["key_stats"], stored_key_stats
+                )
+                self.new_records["key_stats"] = records
+                on_conflict = self.ON_CONFLICT["key_stats"]
+
+            elif "dividend" in target_table:
+                last_dividend_dates = self._get_last_state(
+                    target_table,
+                    lambda: self._get_max_updated_on(sink, target_table),
+                    lambda symbols: self._get_last_dates(
+                        sink, target_table, symbols
+                    ),
+                )
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(target_table, batch_num, last_dividend_dates)
+                self.create_dividend_records(last_dividend_dates)
+                records = self.new_records["dividend"]
+                on_conflict = self.ON_CONFLICT["dividend"]
+
+            elif "financials" in target_table:
+                if "quarterly" in target_table:
+                    quarterly = True
+                    period = "quarterly"
+                elif "annual" in target_table:
+                    quarterly = False
+                    period = "annual"
+                else:
+                    raise Exception("Invalid table name")
+
+                last_financial_dates = self._get_last_state(
+                    target_table,
+                    lambda: self._get_max_updated_on(sink, target_table),
+                    lambda symbols: self._get_last_dates(
+                        sink, target_table, symbols
+                    ),
+                )
+                self.run_stats.lap("last_state")
+                self.symbols = self._select_due_financials_symbols(
+                    last_financial_dates, quarterly
+                )
+                self.run_stats.lap("select_symbols")
+                self._order_by_staleness(target_table, batch_num, last_financial_dates)
 
-            response = (
-                supabase_client.table("idx_active_company_profile")
-                .select("symbol", "wsj_format")
-                .execute()
-            )
+                rows = sink.select_in(
+                    "idx_active_company_profile", ["symbol", "wsj_format"], "symbol", self.symbols
+                )
 
-            wsj_formats = {row["symbol"]: row["wsj_format"] for row in response.data}
+                wsj_formats = {row["symbol"]: row["wsj_format"] for row in rows}
 
-            currency_dict = {}
-            for symbol in self.symbols:
-                financial_currency = self._request_yf_api(symbol, "info").get(
-                    "financialCurrency"
+                self.create_financials_records(
+                    quarterly=quarterly,
+                    last_financial_dates=last_financial_dates,
+                    wsj_formats=wsj_formats,
                 )
-                currency_dict[symbol] = financial_currency
-
-            self.create_financials_records(
-                quarterly=quarterly,
-                last_financial_dates=last_financial_dates,
-                wsj_formats=wsj_formats,
-            )
-            records = self.new_records["financials"][period]
-            if records:
-                records = self.convert_financials_currency(records, currency_dict)
-            on_conflict = "symbol, date"
+                # financialCurrency is fetched together with the statements
+                currency_dict = self.financial_currencies
+                records = self.new_records["financials"][period]
+                if records:
+                    records = self.convert_financials_currency(records, currency_dict)
+                    # keep the converted records so a staged copy can be replayed as is
+                    self.new_records["financials"][period] = records
+                on_conflict = self.ON_CONFLICT["financials"]
+        except Exception as e:
+            self._fail_run(sink, e)
+            raise e
 
-        self._batch_upsert(supabase_client, target_table, records, on_conflict)
+        self._finish_upsert(
+            sink,
+            target_table,
+            records,
+            batch_num,
+            lambda: self._batch_upsert(sink, target_table, records, on_conflict),
+        )
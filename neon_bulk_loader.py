@@ -0,0 +1,124 @@
+import csv
+import io
+
+import psycopg2
+from psycopg2 import sql
+
+# NULL marker used in the COPY stream, so empty strings stay distinguishable
+COPY_NULL = "\\N"
+
+
+class RecordsCsvStream(io.TextIOBase):
+    """Read-only file object that renders records as CSV lines on demand
+
+    psycopg2's copy_expert pulls from it in chunks, so records (a list or a
+    DailyDataBuffer) are never rendered into one big string.
+    """
+
+    def __init__(self, records, columns):
+        self._records = iter(records)
+        self._columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        self.row_count = 0
+
+    def readable(self):
+        return True
+
+    def _render_rows(self, size):
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        while self._buffer.tell() < size:
+            record = next(self._records, None)
+            if record is None:
+                break
+            self._writer.writerow(
+                [
+                    COPY_NULL if record.get(col) is None else record.get(col)
+                    for col in self._columns
+                ]
+            )
+            self.row_count += 1
+        return self._buffer.getvalue()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 20
+
+        while len(self._pending) < size:
+            chunk = self._render_rows(size)
+            if not chunk:
+                break
+            self._pending += chunk
+
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def copy_upsert(connection_string, target_table, records, conflict_columns):
+    """Upserts records through a temporary staging table loaded with COPY
+
+    The records are streamed into a temporary table that has the target
+    table's column types, then merged with a single INSERT ... ON CONFLICT.
+
+    Args:
+        connection_string (str): PostgreSQL connection string
+        target_table (str): The name of the table to upsert records into
+        records (list): Record dicts, or a buffer yielding record dicts
+        conflict_columns (list): Column names used for conflict resolution
+
+    Returns:
+        int: Number of rows copied into the staging table
+    """
+    if not records:
+        return 0
+
+    columns = list(records[0:1][0].keys())
+    staging_table = f"{target_table}_staging"
+
+    col_list = sql.SQL(", ").join(sql.Identifier(col) for col in columns)
+    conflict_list = sql.SQL(", ").join(sql.Identifier(col) for col in conflict_columns)
+    update_list = sql.SQL(", ").join(
+        sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(col), sql.Identifier(col))
+        for col in columns
+        if col not in conflict_columns
+    )
+
+    create_query = sql.SQL(
+        "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+    ).format(sql.Identifier(staging_table), col_list, sql.Identifier(target_table))
+    copy_query = sql.SQL(
+        "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL {})"
+    ).format(sql.Identifier(staging_table), col_list, sql.Literal(COPY_NULL))
+    # DISTINCT ON keeps one row per key, as ON CONFLICT cannot update a row twice
+    merge_query = sql.SQL(
+        "INSERT INTO {target} ({cols}) "
+        "SELECT DISTINCT ON ({keys}) {cols} FROM {staging} ORDER BY {keys}, ctid DESC "
+        "ON CONFLICT ({keys}) DO "
+    ).format(
+        target=sql.Identifier(target_table),
+        cols=col_list,
+        keys=conflict_list,
+        staging=sql.Identifier(staging_table),
+    )
+    if update_list.seq:
+        merge_query += sql.SQL("UPDATE SET ") + update_list
+    else:
+        merge_query += sql.SQL("NOTHING")
+
+    connection = psycopg2.connect(connection_string)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_query)
+            stream = RecordsCsvStream(records, columns)
+            cursor.copy_expert(copy_query, stream)
+            cursor.execute(merge_query)
+        connection.commit()
+    except psycopg2.Error as e:
+        connection.rollback()
+        raise e
+    finally:
+        connection.close()
+
+    return stream.row_count
@@ -0,0 +1,171 @@
+import hashlib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+
+
+class PooledNeonConnector:
+    """Drop-in for NeonConnector's select_query and batch_upsert on a connection pool
+
+    NeonConnector opens a new connection for every query. This keeps up to
+    max_connections open, prepares one upsert statement per shape (table,
+    columns and conflict columns) on each connection, and runs writes on
+    background threads: map spreads upsert chunks over the connections and
+    submit runs a whole table's write while the caller goes on fetching.
+    """
+
+    def __init__(self, connection_string, max_connections=4):
+        """
+        Args:
+            connection_string (str): PostgreSQL connection string
+            max_connections (int, optional): Number of concurrent writes. Defaults to 4.
+        """
+        self.connection_string = connection_string
+        self.max_connections = max_connections
+        # one more connection for queries made by the caller while writes run
+        self._pool = ThreadedConnectionPool(1, max_connections + 1, connection_string)
+        self._prepared = {}
+        self._prepared_lock = threading.Lock()
+        self._chunk_executor = ThreadPoolExecutor(max_workers=max_connections)
+        # a single pipeline thread keeps submitted table writes in order
+        self._pipeline_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _run(self, func):
+        connection = self._pool.getconn()
+        try:
+            result = func(connection)
+            connection.commit()
+        except Exception as e:
+            self._discard_prepared(connection)
+            if connection.closed:
+                self._pool.putconn(connection, close=True)
+            else:
+                connection.rollback()
+                # statements prepared in the failed transaction may or may not exist now
+                with connection.cursor() as cursor:
+                    cursor.execute("DEALLOCATE ALL")
+                connection.commit()
+                self._pool.putconn(connection)
+            raise e
+
+        self._pool.putconn(connection)
+        return result
+
+    def _discard_prepared(self, connection):
+        with self._prepared_lock:
+            self._prepared.pop(id(connection), None)
+
+    def select_query(self, query):
+        """Executes a SELECT query and returns the rows as dictionaries"""
+
+        def select(connection):
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                column_names = [desc[0] for desc in cursor.description]
+                return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+
+        return self._run(select)
+
+    def _prepare_upsert(self, cursor, connection, target_table, columns, conflict_columns):
+        shape = f"{target_table}|{','.join(columns)}|{','.join(conflict_columns)}"
+        name = "upsert_" + hashlib.md5(shape.encode()).hexdigest()[:16]
+
+        with self._prepared_lock:
+            prepared = self._prepared.setdefault(id(connection), set())
+            if name in prepared:
+                return name
+
+        insert_query = sql.SQL("INSERT INTO {} ({}) VALUES ({}) ").format(
+            sql.Identifier(target_table),
+            sql.SQL(", ").join(sql.Identifier(col) for col in columns),
+            sql.SQL(", ").join(sql.SQL(f"${i + 1}") for i in range(len(columns))),
+        )
+        update_list = [col for col in columns if col not in conflict_columns]
+        if conflict_columns and update_list:
+            conflict_query = sql.SQL("ON CONFLICT ({}) DO UPDATE SET {}").format(
+                sql.SQL(", ").join(sql.Identifier(col) for col in conflict_columns),
+                sql.SQL(", ").join(
+                    sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(col), sql.Identifier(col))
+                    for col in update_list
+                ),
+            )
+        else:
+            conflict_query = sql.SQL("ON CONFLICT DO NOTHING")
+
+        cursor.execute(
+            sql.SQL("PREPARE {} AS ").format(sql.Identifier(name))
+            + insert_query
+            + conflict_query
+        )
+        with self._prepared_lock:
+            prepared.add(name)
+        return name
+
+    def batch_upsert(self, target_table, records, conflict_columns=[], batch_size=100):
+        """Upserts records in one transaction with the prepared statement of their shape
+
+        Args:
+            target_table (str): The name of the table to upsert records into
+            records (list): Record dicts, all with the same keys
+            conflict_columns (list, optional): Column names used for conflict resolution. Defaults to [].
+            batch_size (int, optional): Number of statements sent per round trip. Defaults to 100.
+        """
+        if not records:
+            return
+
+        columns = list(records[0].keys())
+        values = [tuple(record[col] for col in columns) for record in records]
+
+        def upsert(connection):
+            with connection.cursor() as cursor:
+                name = self._prepare_upsert(
+                    cursor, connection, target_table, columns, conflict_columns
+                )
+                execute_query = sql.SQL("EXECUTE {} ({})").format(
+                    sql.Identifier(name),
+                    sql.SQL(", ").join(sql.SQL("%s") for _ in columns),
+                )
+                execute_batch(cursor, execute_query, values, page_size=batch_size)
+
+        self._run(upsert)
+
+    def map(self, func, items):
+        """Calls func on every item on up to max_connections threads
+
+        Items are taken lazily, so a large DailyDataBuffer is not sliced all at
+        once. The first exception is raised once the running calls finish.
+        """
+        items = iter(items)
+        running = set()
+        error = None
+
+        while True:
+            while error is None and len(running) < self.max_connections:
+                item = next(items, None)
+                if item is None:
+                    break
+                running.add(self._chunk_executor.submit(func, item))
+
+            if not running:
+                break
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None and error is None:
+                    error = future.exception()
+
+        if error is not None:
+            raise error
+
+    def submit(self, func):
+        """Runs func on the write pipeline thread, returns its Future"""
+        return self._pipeline_executor.submit(func)
+
+    def close(self):
+        self._pipeline_executor.shutdown(wait=True)
+        self._chunk_executor.shutdown(wait=True)
+        self._pool.closeall()
@@ -0,0 +1,131 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Column types of the staged records per target table. The US updater swaps
+# "symbol" for "stock_id" before upserting, so both keys are listed. A type of
+# None is inferred from the records (IDX daily close is cast to int).
+STAGING_SCHEMAS = {
+    "daily_data": {
+        "updated_on": pa.string(),
+        "symbol": pa.string(),
+        "stock_id": pa.int64(),
+        "date": pa.string(),
+        "close": None,
+        "volume": pa.int64(),
+        "market_cap": pa.int64(),
+        "mcap_method": pa.int8(),
+    },
+    "key_stats": {
+        "symbol": pa.string(),
+        "stock_id": pa.int64(),
+        "forward_eps": pa.float64(),
+        "updated_on": pa.string(),
+    },
+    "dividend": {
+        "updated_on": pa.string(),
+        "symbol": pa.string(),
+        "stock_id": pa.int64(),
+        "date": pa.string(),
+        "dividend": pa.float64(),
+        "yield": pa.float64(),
+    },
+    "financials": {
+        "symbol": pa.string(),
+        "stock_id": pa.int64(),
+        "date": pa.string(),
+        "updated_on": pa.string(),
+        "source": pa.int8(),
+    },
+}
+
+# Financial statement metrics that are not listed above are staged as int64,
+# matching the int_cols casting done in create_financials_records.
+DEFAULT_COLUMN_TYPES = {"financials": pa.int64()}
+
+
+def _build_schema(table_kind, columns, target_table, infer_type):
+    known_types = STAGING_SCHEMAS[table_kind]
+    default_type = DEFAULT_COLUMN_TYPES.get(table_kind, pa.string())
+
+    fields = []
+    for col in columns:
+        col_type = known_types.get(col, default_type)
+        if col_type is None:
+            col_type = infer_type(col)
+        fields.append(pa.field(col, col_type))
+
+    return pa.schema(fields, metadata={"target_table": target_table})
+
+
+def stage_records(records, table_kind, target_table, file_path):
+    """Writes records to a zstd-compressed Parquet file
+
+    Args:
+        records (list): List of record dicts or a buffer with to_arrow, as stored in YFDataUpdater.new_records
+        table_kind (str): One of the STAGING_SCHEMAS keys
+        target_table (str): Target table name, kept in the file metadata
+        file_path (str): Destination path of the Parquet file
+
+    Returns:
+        str: The written file path, or None if there were no records to stage
+    """
+    if not records:
+        print("No records to stage")
+        return None
+
+    if hasattr(records, "to_arrow"):
+        # typed buffers (e.g. DailyDataBuffer) convert without building dicts
+        table = records.to_arrow()
+        schema = _build_schema(
+            table_kind,
+            table.column_names,
+            target_table,
+            lambda col: table.schema.field(col).type,
+        )
+        table = table.cast(schema)
+    else:
+        columns = []
+        for record in records:
+            for col in record:
+                if col not in columns:
+                    columns.append(col)
+
+        schema = _build_schema(
+            table_kind,
+            columns,
+            target_table,
+            lambda col: pa.array([record.get(col) for record in records]).type,
+        )
+        table = pa.Table.from_pylist(list(records), schema=schema)
+
+    dir = os.path.dirname(file_path)
+    if dir and not os.path.exists(dir):
+        os.makedirs(dir)
+
+    pq.write_table(table, file_path, compression="zstd")
+    print(f"Staged {len(records)} records to {file_path}")
+
+    return file_path
+
+
+def read_staged_target_table(file_path):
+    metadata = pq.read_schema(file_path).metadata or {}
+    target_table = metadata.get(b"target_table")
+
+    return target_table.decode() if target_table else None
+
+
+def iter_staged_records(file_path, batch_size=1000):
+    """Streams a staged Parquet file as lists of record dicts
+
+    Only one record batch at a time is turned into Python dicts.
+
+    Args:
+        file_path (str): Path of the staged Parquet file
+        batch_size (int, optional): Number of records per yielded list. Defaults to 1000.
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield batch.to_pylist()
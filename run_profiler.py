@@ -0,0 +1,153 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Updater methods profiled with cProfile, and the stage they belong to
+STAGE_METHODS = {
+    "extract_symbols_from_db": "extract_symbols",
+    "_get_last_state": "last_state",
+    "prefetch_companies_data": "fetch",
+    "create_daily_data_records": "fetch",
+    "create_key_stats_records": "fetch",
+    "create_dividend_records": "fetch",
+    "create_financials_records": "fetch",
+    "_batch_upsert": "upsert",
+}
+
+# Function names that attribute a sampled stack to a stage, innermost match wins
+STAGE_MARKERS = [
+    ("upsert", ["_batch_upsert", "timed_write", "copy_upsert"]),
+    ("last_state", ["_get_last_", "_get_max_updated_on", "_get_stored_", "select_last_", "select_outdated_"]),
+    ("extract_symbols", ["extract_symbols_from_db"]),
+    ("fetch", ["create_", "prefetch_companies_data", "_map_symbols", "_get_companies_"]),
+]
+
+
+class RunProfiler:
+    """Profiles a scrape run per stage
+
+    Two kinds of artifacts are written to output_dir for every stage
+    (extract_symbols, last_state, fetch, upsert):
+
+    - {stage}.pstats: cProfile of the stage's updater methods, on the thread
+      calling them (fetch worker threads are not included)
+    - {stage}.collapsed: stacks of all threads sampled every interval seconds,
+      one "frame;frame;... count" line per stack, for flamegraph.pl or speedscope
+
+    With trace_allocations, every create_*_records call also writes the peak
+    traced memory and its top allocation sites to {method}_allocations.txt.
+    """
+
+    def __init__(self, output_dir, trace_allocations=False, interval=0.005):
+        self.output_dir = output_dir
+        self.trace_allocations = trace_allocations
+        self.interval = interval
+        self._profiles = {}
+        self._profile_lock = threading.Lock()
+        self._samples = {}
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def instrument(self, updater):
+        """Wraps the updater's stage methods with cProfile (and tracemalloc)"""
+        for method_name, stage in STAGE_METHODS.items():
+            method = getattr(updater, method_name)
+            setattr(updater, method_name, self._wrap(method_name, stage, method))
+
+    def _wrap(self, method_name, stage, method):
+        def profiled(*args, **kwargs):
+            # cProfile follows one thread, concurrent or nested calls run unprofiled
+            if not self._profile_lock.acquire(blocking=False):
+                return method(*args, **kwargs)
+
+            trace = self.trace_allocations and method_name.startswith("create_")
+            if trace:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                tracemalloc.reset_peak()
+
+            profile = self._profiles.setdefault(stage, cProfile.Profile())
+            profile.enable()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._profile_lock.release()
+                if trace:
+                    self._write_allocations(method_name)
+
+        return profiled
+
+    def _write_allocations(self, method_name):
+        _, peak = tracemalloc.get_traced_memory()
+        top_stats = tracemalloc.take_snapshot().statistics("lineno")[:25]
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, f"{method_name}_allocations.txt"), "a") as f:
+            f.write(f"{method_name}: peak traced memory {peak / 2**20:.1f} MB\n")
+            for stat in top_stats:
+                f.write(f"{stat}\n")
+            f.write("\n")
+
+    def _get_stage(self, frames):
+        for frame in frames:
+            name = frame.f_code.co_name
+            for stage, markers in STAGE_MARKERS:
+                if any(name.startswith(marker) for marker in markers):
+                    return stage
+        return "other"
+
+    def _sample(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+
+                frames = []
+                while frame is not None:
+                    frames.append(frame)
+                    frame = frame.f_back
+
+                # co_qualname is new in Python 3.11, the workflows run 3.9 and 3.10
+                stack = ";".join(
+                    f"{os.path.basename(f.f_code.co_filename)}:{getattr(f.f_code, 'co_qualname', f.f_code.co_name)}"
+                    for f in reversed(frames)
+                )
+                stage_samples = self._samples.setdefault(self._get_stage(frames), {})
+                stage_samples[stack] = stage_samples.get(stack, 0) + 1
+
+    def start(self):
+        self._started = time.monotonic()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Stops sampling and writes the artifacts"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        for stage, profile in self._profiles.items():
+            profile.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+
+        for stage, stacks in self._samples.items():
+            with open(os.path.join(self.output_dir, f"{stage}.collapsed"), "w") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+
+        summary = ", ".join(
+            f"{stage} {sum(stacks.values()) * self.interval:.1f}s"
+            for stage, stacks in sorted(self._samples.items())
+        )
+        print(
+            f"Profile of {time.monotonic() - self._started:.1f}s written to {self.output_dir} "
+            f"(sampled thread time: {summary})"
+        )
@@ -0,0 +1,105 @@
+import time
+
+import pandas as pd
+
+# Ledger table written by every upsert_data_to_db run, e.g. on PostgreSQL:
+#
+# CREATE TABLE run_stats (
+#     id bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+#     target_table text NOT NULL,
+#     batch_num integer,
+#     batch_size integer,
+#     status text NOT NULL,
+#     error text,
+#     started_at timestamp NOT NULL,
+#     finished_at timestamp NOT NULL,
+#     symbols_attempted integer,
+#     symbols_succeeded integer,
+#     symbols_deferred integer,
+#     requests_issued integer,
+#     requests_coalesced integer,
+#     cache_hits integer,
+#     cache_hit_rate double precision,
+#     rows_written integer,
+#     rows_skipped integer,
+#     stage_seconds jsonb
+# );
+RUN_STATS_TABLE = "run_stats"
+
+
+class RunStats:
+    """Ledger row of one upsert_data_to_db run
+
+    Stage durations are laps: lap(stage) adds the time since the previous lap
+    to the stage, so a run marks the end of each stage as it goes.
+    """
+
+    def __init__(self, target_table, batch_size, batch_num, request_metrics):
+        """
+        Args:
+            target_table (str): Target table name
+            batch_size (int): Number of symbols per batch
+            batch_num (int): Batch number
+            request_metrics (dict): The updater's request metrics when the run starts
+        """
+        self.target_table = target_table
+        self.batch_size = batch_size
+        self.batch_num = batch_num
+        self.started_at = pd.Timestamp.now(tz="GMT")
+        self.stage_seconds = {}
+        self._lap_started = time.monotonic()
+        self._start_metrics = request_metrics
+        self.request_metrics = {key: 0 for key in request_metrics}
+        self.symbols_attempted = 0
+        self.symbols_failed = 0
+        self.symbols_deferred = 0
+        # rows left out because they match the stored values
+        self.rows_skipped = 0
+
+    def add_stage(self, stage, seconds):
+        self.stage_seconds[stage] = round(self.stage_seconds.get(stage, 0) + seconds, 3)
+
+    def lap(self, stage):
+        """Adds the time since the previous lap to stage"""
+        now = time.monotonic()
+        self.add_stage(stage, now - self._lap_started)
+        self._lap_started = now
+
+    def finish_fetch(self, symbols, failed_symbols, deferred_symbols, request_metrics):
+        """Records the symbols and requests of the run once its records are created"""
+        self.symbols_attempted = len(symbols)
+        symbols = set(symbols)
+        self.symbols_failed = len(symbols & set(failed_symbols))
+        self.symbols_deferred = len(symbols & set(deferred_symbols))
+        self.request_metrics = {
+            key: value - self._start_metrics.get(key, 0)
+            for key, value in request_metrics.items()
+        }
+
+    def to_record(self, rows_written, error=None):
+        issued = self.request_metrics.get("issued", 0)
+        hits = self.request_metrics.get("cache_hits", 0) + self.request_metrics.get(
+            "coalesced", 0
+        )
+
+        return {
+            "target_table": self.target_table,
+            "batch_num": self.batch_num,
+            "batch_size": self.batch_size,
+            "status": "failed" if error is not None else "succeeded",
+            "error": str(error)[:1000] if error is not None else None,
+            "started_at": self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "finished_at": pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S"),
+            "symbols_attempted": self.symbols_attempted,
+            "symbols_succeeded": self.symbols_attempted
+            - self.symbols_failed
+            - self.symbols_deferred,
+            "symbols_deferred": self.symbols_deferred,
+            "requests_issued": issued,
+            "requests_coalesced": self.request_metrics.get("coalesced", 0),
+            "cache_hits": self.request_metrics.get("cache_hits", 0),
+            "cache_hit_rate": round(hits / (hits + issued), 4) if hits + issued else None,
+            "rows_written": rows_written,
+            "rows_skipped": self.rows_skipped,
+            "stage_seconds": self.stage_seconds,
+        }
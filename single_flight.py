@@ -0,0 +1,66 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one in-flight call
+
+    The first caller of a key runs the function, callers arriving while it is
+    running wait for it and get the same result (or exception). Once the call
+    finishes the key is released, so a later call runs the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.issued = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Returns func(), sharing the call with concurrent callers of key
+
+        Args:
+            key (hashable): Identifies the call, e.g. (symbol, attribute)
+            func (callable): Called without arguments by the first caller
+
+        Returns:
+            object: The result of func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.issued += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def get_metrics(self):
+        with self._lock:
+            return {"issued": self.issued, "coalesced": self.coalesced}
@@ -0,0 +1,142 @@
+import json
+import os
+import sqlite3
+from decimal import Decimal
+
+import pandas as pd
+
+
+def _json_default(value):
+    # numeric columns read with psycopg2 come back as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+class LastStateStore:
+    """Local SQLite mirror of the last stored state per symbol and target table
+
+    The state is what the updaters otherwise read from the database before
+    fetching: the last daily data row (date, close, volume, market_cap,
+    mcap_method) or the last date of a dividend/financials table. Each target
+    table's mirror remembers the database's max(updated_on) it corresponds to,
+    and is dropped when the database no longer reports the same value.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS last_state (
+                target_table TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                state TEXT,
+                PRIMARY KEY (target_table, symbol)
+            );
+            CREATE TABLE IF NOT EXISTS sync (
+                target_table TEXT PRIMARY KEY,
+                max_updated_on TEXT
+            );
+            """
+        )
+
+    def _normalize_timestamp(self, value):
+        if value is None:
+            return None
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert("UTC").tz_localize(None)
+        return ts.strftime("%Y-%m-%d %H:%M:%S")
+
+    def is_in_sync(self, target_table, db_max_updated_on):
+        row = self.connection.execute(
+            "SELECT max_updated_on FROM sync WHERE target_table = ?", (target_table,)
+        ).fetchone()
+        return row is not None and row[0] == self._normalize_timestamp(
+            db_max_updated_on
+        )
+
+    def reset(self, target_table, db_max_updated_on):
+        """Drops the mirror of a table and marks it as matching db_max_updated_on"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM last_state WHERE target_table = ?", (target_table,)
+            )
+            self._set_max_updated_on(target_table, db_max_updated_on)
+
+    def _set_max_updated_on(self, target_table, max_updated_on):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sync (target_table, max_updated_on) VALUES (?, ?)",
+            (target_table, self._normalize_timestamp(max_updated_on)),
+        )
+
+    def get_missing_symbols(self, target_table, symbols):
+        """Returns the symbols whose state has not been mirrored yet"""
+        mirrored = {
+            row[0]
+            for row in self.connection.execute(
+                "SELECT symbol FROM last_state WHERE target_table = ?", (target_table,)
+            )
+        }
+        return [symbol for symbol in symbols if symbol not in mirrored]
+
+    def put_states(self, target_table, states, symbols):
+        """Mirrors the states read from the database for symbols
+
+        Args:
+            target_table (str): Target table name
+            states (dict): State per symbol, symbols without one have no rows in the database
+            symbols (list): Symbols the states were read for
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO last_state (target_table, symbol, state) VALUES (?, ?, ?)",
+                [
+                    (target_table, symbol, json.dumps(states.get(symbol), default=_json_default))
+                    for symbol in symbols
+                ],
+            )
+
+    def get_states(self, target_table, symbols):
+        """Returns the mirrored state per symbol, leaving out symbols without one"""
+        states = {}
+        for symbol, state in self.connection.execute(
+            "SELECT symbol, state FROM last_state WHERE target_table = ?",
+            (target_table,),
+        ):
+            state = json.loads(state)
+            if state is not None:
+                states[symbol] = state
+
+        return {symbol: states[symbol] for symbol in symbols if symbol in states}
+
+    def update_states(self, target_table, states, max_updated_on, get_date):
+        """Advances the mirror after a successful upsert
+
+        Args:
+            target_table (str): Target table name
+            states (dict): Latest upserted state per symbol
+            max_updated_on (str): updated_on written by the upsert
+            get_date (callable): Returns the date of a state, only newer states replace mirrored ones
+        """
+        current = self.get_states(target_table, list(states.keys()))
+        newer = {
+            symbol: state
+            for symbol, state in states.items()
+            if symbol not in current or get_date(state) >= get_date(current[symbol])
+        }
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO last_state (target_table, symbol, state) VALUES (?, ?, ?)",
+                [
+                    (target_table, symbol, json.dumps(state, default=_json_default))
+                    for symbol, state in newer.items()
+                ],
+            )
+            self._set_max_updated_on(target_table, max_updated_on)
+
+    def close(self):
+        self.connection.close()
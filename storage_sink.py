@@ -0,0 +1,601 @@
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from upsert_encoding import JsonChunk, dumps, iter_json_chunks
+
+# Rows per request; kept at or below PostgREST's max-rows so pages are never truncated
+SUPABASE_PAGE_SIZE = 1000
+# Symbols per in.() filter, keeps the request URL short
+SUPABASE_SYMBOL_CHUNK_SIZE = 200
+# Rows per paginated Neon query
+NEON_PAGE_SIZE = 1000
+# Values per IN (...) filter of the Neon last-state queries
+NEON_IN_CHUNK_SIZE = 500
+# Values per IN (...) filter of the local queries, below SQLite's variable limit
+LOCAL_IN_CHUNK_SIZE = 500
+# Bytes of uncompressed JSON per Supabase upsert request
+SUPABASE_UPSERT_MAX_BYTES = 1 << 20
+# Table the local sink joins for the symbol of tables keyed by stock_id, like the Neon functions do
+LOCAL_SYMBOL_ID_TABLE = "company_stock"
+
+
+class StorageSink:
+    """Where the updaters read their last stored state from and upsert records to
+
+    The updaters only talk to the database through these methods, so the
+    same pipeline runs against Supabase (IDX), Neon (US) or a local SQLite or
+    DuckDB file. Rows are dicts; on_conflict is a list of column names.
+
+    A sink may also provide map(func, items), which spreads upsert chunks
+    over connections, and submit(func), which runs a table's write in the
+    background (see YFDataUpdater._finish_upsert).
+
+    Records are upserted in the chunks returned by chunk_records, slices of
+    the records by default and encoded JSON bodies for SupabaseSink.
+    """
+
+    map = None
+    submit = None
+    # records per upsert call, None keeps the updater's batch size
+    upsert_batch_size = None
+
+    def table_exists(self, table):
+        raise NotImplementedError
+
+    def select_page(self, table, columns, order, start=0, end=None):
+        """Returns rows start to end (inclusive) of an ordered table, reading every page
+
+        Args:
+            table (str): Table name
+            columns (list): Columns to select
+            order (list): (column, descending) pairs
+            start (int, optional): Index of the first row. Defaults to 0.
+            end (int, optional): Index of the last row. Defaults to None, which reads until the last row.
+        """
+        raise NotImplementedError
+
+    def select_in(self, table, columns, column, values):
+        """Returns the columns of the rows whose column is one of values"""
+        raise NotImplementedError
+
+    def select_last_rows(self, table, column, values):
+        """Returns the latest daily data row of each of values, which includes a symbol column"""
+        raise NotImplementedError
+
+    def select_last_dates(self, table, column, values):
+        """Returns rows of column and last_date, the latest date stored for each of values"""
+        raise NotImplementedError
+
+    def select_outdated_symbols(self, table, symbols):
+        """Returns rows of symbol and last_date of the symbols due for new financials"""
+        raise NotImplementedError
+
+    def select_max_updated_on(self, table):
+        raise NotImplementedError
+
+    def chunk_records(self, records, batch_size):
+        """Returns the chunks records are upserted in, each passed to one upsert call
+
+        Args:
+            records (list): Record dicts, or a DailyDataBuffer
+            batch_size (int): Records per chunk, unless the sink sets upsert_batch_size
+        """
+        batch_size = self.upsert_batch_size or batch_size
+        return (records[i : i + batch_size] for i in range(0, len(records), batch_size))
+
+    def upsert(self, table, records, on_conflict):
+        """Inserts records, updating the rows that conflict on the on_conflict columns"""
+        raise NotImplementedError
+
+    def insert(self, table, record):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SupabaseSink(StorageSink):
+    """Sink of the IDX tables on Supabase, read through PostgREST
+
+    Upserts are encoded by upsert_encoding into request bodies of up to
+    max_bytes and posted as they are, instead of being re-encoded by the
+    client's stdlib json.
+    """
+
+    def __init__(self, supabase_client, max_bytes=SUPABASE_UPSERT_MAX_BYTES, compress=False):
+        """
+        Args:
+            supabase_client (supabase.Client): Supabase client
+            max_bytes (int, optional): Bytes of JSON per upsert request. Defaults to SUPABASE_UPSERT_MAX_BYTES.
+            compress (bool, optional): Whether upsert bodies are sent gzip-compressed, for endpoints
+                (or proxies in front of them) that decode Content-Encoding: gzip. Defaults to False.
+        """
+        self.client = supabase_client
+        self.max_bytes = max_bytes
+        self.compress = compress
+
+    def table_exists(self, table):
+        try:
+            self.client.table(table).select("*").limit(1).execute()
+        except:
+            return False
+        return True
+
+    def _select_all_pages(self, build_query, start=0, end=None):
+        """Runs a query page by page with range() and returns all rows
+
+        Args:
+            build_query (callable): Returns a fresh, ordered query builder
+            start (int, optional): Index of the first row. Defaults to 0.
+            end (int, optional): Index of the last row (inclusive). Defaults to None, which reads until the last row.
+        """
+        rows = []
+        while end is None or start <= end:
+            page_end = start + SUPABASE_PAGE_SIZE - 1
+            if end is not None:
+                page_end = min(page_end, end)
+
+            response = build_query().range(start, page_end).execute()
+            rows.extend(response.data)
+
+            if len(response.data) < page_end - start + 1:
+                break
+            start = page_end + 1
+
+        return rows
+
+    def _select_for_values(self, build_query, column, values):
+        """Runs a query for a chunk of values at a time, reading every page of each chunk"""
+        rows = []
+        for i in range(0, len(values), SUPABASE_SYMBOL_CHUNK_SIZE):
+            chunk = values[i : i + SUPABASE_SYMBOL_CHUNK_SIZE]
+            rows.extend(
+                self._select_all_pages(lambda: build_query().in_(column, chunk))
+            )
+
+        return rows
+
+    def select_page(self, table, columns, order, start=0, end=None):
+        def build_query():
+            query = self.client.table(table).select(*columns)
+            for order_column, desc in order:
+                query = query.order(order_column, desc=desc)
+            return query
+
+        return self._select_all_pages(build_query, start, end)
+
+    def select_in(self, table, columns, column, values):
+        return self._select_for_values(
+            lambda: self.client.table(table).select(*columns).order(column),
+            column,
+            values,
+        )
+
+    def select_last_rows(self, table, column, values):
+        # the get_last_daily_data function reads idx_daily_data
+        return self._select_for_values(
+            lambda: self.client.rpc("get_last_daily_data", params=None).order(column),
+            column,
+            values,
+        )
+
+    def select_last_dates(self, table, column, values):
+        return self._select_for_values(
+            lambda: self.client.rpc(
+                "get_last_date", params={"table_name": table}
+            ).order(column),
+            column,
+            values,
+        )
+
+    def select_max_updated_on(self, table):
+        response = (
+            self.client.table(table)
+            .select("updated_on")
+            .order("updated_on", desc=True, nullsfirst=False)
+            .limit(1)
+            .execute()
+        )
+
+        return response.data[0]["updated_on"] if response.data else None
+
+    def chunk_records(self, records, batch_size):
+        # sized by bytes, batch_size does not apply
+        return iter_json_chunks(records, self.max_bytes)
+
+    def upsert(self, table, records, on_conflict):
+        """Upserts records, a list of dicts or a JsonChunk of chunk_records"""
+        if not isinstance(records, JsonChunk):
+            records = next(iter_json_chunks(records, max_bytes=float("inf")), None)
+            if records is None:
+                return
+
+        headers = {
+            "Prefer": "return=minimal,resolution=merge-duplicates",
+            "Content-Type": "application/json",
+        }
+        body = records.body
+        if self.compress:
+            body = records.compress()
+            headers["Content-Encoding"] = "gzip"
+
+        # the same request supabase-py's upsert makes, with the body encoded already
+        query = self.client.table(table)
+        response = query.session.post(
+            query.path,
+            params={
+                "on_conflict": ", ".join(on_conflict),
+                "columns": ",".join(f'"{column}"' for column in records.columns),
+            },
+            headers=headers,
+            content=body,
+        )
+        if not response.is_success:
+            raise Exception(
+                f"Upsert to {table} failed with status {response.status_code}: {response.text}"
+            )
+
+    def insert(self, table, record):
+        self.client.table(table).insert(record, returning="minimal").execute()
+
+
+class NeonSink(StorageSink):
+    """Sink of the US tables on Neon, through a NeonConnector or PooledNeonConnector
+
+    Dates read for the last state come back as "%Y-%m-%d" strings, like
+    Supabase returns them.
+    """
+
+    def __init__(self, neon_connector):
+        self.connector = neon_connector
+        # a PooledNeonConnector writes chunks and tables concurrently
+        self.map = getattr(neon_connector, "map", None)
+        self.submit = getattr(neon_connector, "submit", None)
+
+    def table_exists(self, table):
+        try:
+            self.connector.select_query(f"SELECT * FROM {table} LIMIT 1")
+        except:
+            return False
+        return True
+
+    def _sql_in_list(self, values):
+        return ", ".join(
+            str(int(v)) if isinstance(v, int) else "'" + str(v).replace("'", "''") + "'"
+            for v in values
+        )
+
+    def _select_for_values(self, query, column, values):
+        """Runs query filtered with "column IN (...)" for a chunk of values at a time
+
+        Args:
+            query (str): SELECT query without a WHERE clause
+            column (str): Column to filter on
+            values (list): Symbols or stock ids to select
+        """
+        rows = []
+        for i in range(0, len(values), NEON_IN_CHUNK_SIZE):
+            chunk = values[i : i + NEON_IN_CHUNK_SIZE]
+            rows.extend(
+                self.connector.select_query(f"{query} WHERE {column} IN ({self._sql_in_list(chunk)})")
+            )
+
+        return rows
+
+    def _format_dates(self, rows):
+        for row in rows:
+            for key, value in row.items():
+                if isinstance(value, date) and not isinstance(value, datetime):
+                    row[key] = value.strftime("%Y-%m-%d")
+        return rows
+
+    def select_page(self, table, columns, order, start=0, end=None):
+        query = "SELECT {} FROM {} ORDER BY {}".format(
+            ", ".join(columns),
+            table,
+            ", ".join(f"{column} {'DESC' if desc else 'ASC'}" for column, desc in order),
+        )
+
+        rows = []
+        while end is None or start <= end:
+            limit = NEON_PAGE_SIZE if end is None else min(NEON_PAGE_SIZE, end - start + 1)
+            page = self.connector.select_query(f"{query} LIMIT {limit} OFFSET {start}")
+            rows.extend(page)
+            if len(page) < limit:
+                break
+            start += limit
+
+        return rows
+
+    def select_in(self, table, columns, column, values):
+        return self._select_for_values(
+            f"SELECT {', '.join(columns)} FROM {table}", column, values
+        )
+
+    def select_last_rows(self, table, column, values):
+        # the get_last_daily_data function reads daily_data
+        return self._format_dates(
+            self._select_for_values("SELECT * from get_last_daily_data()", column, values)
+        )
+
+    def select_last_dates(self, table, column, values):
+        return self._format_dates(
+            self._select_for_values(f"SELECT * FROM get_last_date('{table}')", column, values)
+        )
+
+    def select_outdated_symbols(self, table, symbols):
+        # get_outdated_symbols function has two parameters: table_name and source (1 indicates YF API)
+        return self._select_for_values(
+            f"SELECT * FROM get_outdated_symbols('{table}', 1)", "symbol", symbols
+        )
+
+    def select_max_updated_on(self, table):
+        response = self.connector.select_query(
+            f"SELECT max(updated_on) AS max_updated_on FROM {table}"
+        )
+
+        return response[0]["max_updated_on"] if response else None
+
+    def upsert(self, table, records, on_conflict):
+        self.connector.batch_upsert(table, records, conflict_columns=on_conflict)
+
+    def copy_upsert(self, table, records, on_conflict):
+        """Loads records with COPY into a staging table and merges them in one statement, returns the row count"""
+        # psycopg2 comes with the US requirements only
+        from neon_bulk_loader import copy_upsert
+
+        return copy_upsert(self.connector.connection_string, table, records, on_conflict)
+
+    def insert(self, table, record):
+        self.connector.batch_upsert(
+            table,
+            [
+                {
+                    key: dumps(value).decode() if isinstance(value, (dict, list)) else value
+                    for key, value in record.items()
+                }
+            ],
+        )
+
+    def close(self):
+        close = getattr(self.connector, "close", None)
+        if close is not None:
+            close()
+
+
+class LocalSink(StorageSink):
+    """Sink of an embedded SQLite or DuckDB file, for dry runs without a remote database
+
+    Tables are created by their first upsert, with the on_conflict columns as
+    primary key, and gain the columns of later records as they come. Reads of
+    a missing table return no rows, so a fresh file starts every symbol as
+    new. Seed the symbol table the updater extracts symbols from
+    (idx_active_company_profile or company_stock) with upsert.
+
+    The last-state reads compute what the remote database functions return:
+    the latest row or date per symbol, joined with company_stock for the
+    symbol of tables keyed by stock_id. Every symbol counts as outdated for
+    the financials.
+    """
+
+    # each upsert call is one transaction, without the request size limits of the remote sinks
+    upsert_batch_size = 10000
+
+    def __init__(self, path, backend=None):
+        """
+        Args:
+            path (str): Database file
+            backend (str, optional): "sqlite" or "duckdb". Defaults to None, which picks duckdb for a .duckdb file and sqlite otherwise.
+        """
+        self.path = path
+        self.backend = backend or ("duckdb" if path.endswith(".duckdb") else "sqlite")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if self.backend == "duckdb":
+            import duckdb
+
+            self.connection = duckdb.connect(path)
+        elif self.backend == "sqlite":
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+        else:
+            raise ValueError(f"Unknown local sink backend: {backend}")
+        self._lock = threading.Lock()
+
+    def _execute(self, query, params=None, many=False):
+        with self._lock:
+            cursor = self.connection.cursor()
+            try:
+                if many:
+                    cursor.executemany(query, params)
+                else:
+                    cursor.execute(query, params or [])
+                if cursor.description is None:
+                    self.connection.commit()
+                    return []
+                column_names = [desc[0] for desc in cursor.description]
+                return [dict(zip(column_names, row)) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+
+    def _get_columns(self, table):
+        if self.backend == "duckdb":
+            rows = self._execute(
+                "SELECT column_name AS name FROM information_schema.columns WHERE table_name = ?",
+                [table],
+            )
+        else:
+            rows = self._execute(f'PRAGMA table_info("{table}")')
+        return [row["name"] for row in rows]
+
+    def _get_column_type(self, values):
+        value = next((v for v in values if v is not None), None)
+        if isinstance(value, bool):
+            return "BOOLEAN"
+        if isinstance(value, int):
+            return "BIGINT"
+        if isinstance(value, float):
+            return "DOUBLE"
+        return "VARCHAR"
+
+    def _ensure_table(self, table, records, on_conflict):
+        columns = list(dict.fromkeys(key for record in records for key in record))
+        existing = self._get_columns(table)
+        if not existing:
+            definitions = [
+                f'"{column}" {self._get_column_type(r.get(column) for r in records)}'
+                for column in columns
+            ]
+            if on_conflict:
+                definitions.append(
+                    "PRIMARY KEY ({})".format(", ".join(f'"{c}"' for c in on_conflict))
+                )
+            self._execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(definitions)})')
+        else:
+            for column in columns:
+                if column not in existing:
+                    column_type = self._get_column_type(r.get(column) for r in records)
+                    self._execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {column_type}')
+
+        return columns
+
+    def _write(self, table, records, on_conflict):
+        records = list(records)
+        if not records:
+            return
+
+        columns = self._ensure_table(table, records, on_conflict)
+        query = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            table,
+            ", ".join(f'"{c}"' for c in columns),
+            ", ".join("?" for _ in columns),
+        )
+        update_columns = [c for c in columns if c not in on_conflict]
+        if on_conflict and update_columns:
+            query += " ON CONFLICT ({}) DO UPDATE SET {}".format(
+                ", ".join(f'"{c}"' for c in on_conflict),
+                ", ".join(f'"{c}" = excluded."{c}"' for c in update_columns),
+            )
+        elif on_conflict:
+            query += " ON CONFLICT DO NOTHING"
+
+        values = [
+            [
+                dumps(value).decode() if isinstance(value, (dict, list)) else value
+                for value in (record.get(column) for column in columns)
+            ]
+            for record in records
+        ]
+        self._execute(query, values, many=True)
+
+    def table_exists(self, table):
+        # missing tables are created by their first upsert
+        return True
+
+    def _select_for_values(self, query, column, values, params=[]):
+        rows = []
+        for i in range(0, len(values), LOCAL_IN_CHUNK_SIZE):
+            chunk = list(values[i : i + LOCAL_IN_CHUNK_SIZE])
+            placeholders = ", ".join("?" for _ in chunk)
+            rows.extend(
+                self._execute(
+                    query.format(filter=f'"{column}" IN ({placeholders})'), params + chunk
+                )
+            )
+
+        return rows
+
+    def _keyed_source(self, table, column, existing):
+        """Returns a FROM clause of the table that has column, joining company_stock for the symbol"""
+        if column in existing or "stock_id" not in existing:
+            return f'"{table}"'
+        return (
+            f'(SELECT s.symbol AS symbol, t.* FROM "{table}" t '
+            f'JOIN "{LOCAL_SYMBOL_ID_TABLE}" s ON s.id = t.stock_id)'
+        )
+
+    def select_page(self, table, columns, order, start=0, end=None):
+        existing = self._get_columns(table)
+        if not existing:
+            return []
+
+        query = 'SELECT {} FROM "{}" ORDER BY {}'.format(
+            ", ".join(f'"{c}"' for c in columns if c in existing),
+            table,
+            ", ".join(
+                f'"{c}" {"DESC" if desc else "ASC"}' for c, desc in order if c in existing
+            ),
+        )
+        if end is not None:
+            query += f" LIMIT {end - start + 1} OFFSET {start}"
+        elif start:
+            query += f" LIMIT -1 OFFSET {start}" if self.backend == "sqlite" else f" OFFSET {start}"
+
+        return self._execute(query)
+
+    def select_in(self, table, columns, column, values):
+        existing = self._get_columns(table)
+        if not existing:
+            return []
+
+        rows = self._select_for_values(
+            'SELECT {} FROM "{}" WHERE {{filter}}'.format(
+                ", ".join(f'"{c}"' for c in columns if c in existing), table
+            ),
+            column,
+            values,
+        )
+        # columns the local table does not have are read as NULL
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    def select_last_rows(self, table, column, values):
+        existing = self._get_columns(table)
+        if not existing:
+            return []
+
+        source = self._keyed_source(table, column, existing)
+        return self._select_for_values(
+            f'SELECT t.* FROM {source} t JOIN (SELECT "{column}" AS k, max(date) AS d '
+            f'FROM {source} u WHERE {{filter}} GROUP BY "{column}") m '
+            f'ON t."{column}" = m.k AND t.date = m.d',
+            column,
+            values,
+        )
+
+    def select_last_dates(self, table, column, values):
+        existing = self._get_columns(table)
+        if not existing:
+            return []
+
+        source = self._keyed_source(table, column, existing)
+        return self._select_for_values(
+            f'SELECT "{column}", max(date) AS last_date FROM {source} t '
+            f'WHERE {{filter}} GROUP BY "{column}"',
+            column,
+            values,
+        )
+
+    def select_outdated_symbols(self, table, symbols):
+        last_dates = {
+            row["symbol"]: row["last_date"]
+            for row in self.select_last_dates(table, "symbol", symbols)
+        }
+        return [{"symbol": symbol, "last_date": last_dates.get(symbol)} for symbol in symbols]
+
+    def select_max_updated_on(self, table):
+        if "updated_on" not in self._get_columns(table):
+            return None
+
+        rows = self._execute(f'SELECT max(updated_on) AS max_updated_on FROM "{table}"')
+        return rows[0]["max_updated_on"] if rows else None
+
+    def upsert(self, table, records, on_conflict):
+        self._write(table, records, on_conflict)
+
+    def insert(self, table, record):
+        self._write(table, [record], [])
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,73 @@
+import zlib
+
+import pandas as pd
+import pytest
+
+from idxyfdataupdater import IdxYFDataUpdater
+
+
+def get_earnings_ts(date):
+    return int(pd.Timestamp(date).timestamp())
+
+
+def get_symbols(now, weeks, count, in_sweep):
+    """Returns count symbols that are (or are not) in now's share of the rolling sweep"""
+    sweep_week = now.to_period("W").ordinal % weeks
+    symbols = []
+    i = 0
+    while len(symbols) < count:
+        symbol = f"S{i:04d}.JK"
+        if (zlib.crc32(symbol.encode()) % weeks == sweep_week) == in_sweep:
+            symbols.append(symbol)
+        i += 1
+    return symbols
+
+
+def select_due(now, last_dates, earnings_dates, quarterly=False):
+    updater = IdxYFDataUpdater()
+    updater.symbols = list(last_dates)
+    quotes = {
+        symbol: {"earningsTimestamp": get_earnings_ts(date)}
+        for symbol, date in earnings_dates.items()
+        if date is not None
+    }
+    updater._get_companies_quotes = lambda symbols: quotes
+    return updater._select_due_financials_symbols(last_dates, quarterly, now=now)
+
+
+@pytest.mark.parametrize("earnings_date", ["2025-07-30", "2025-03-01", None])
+def test_symbol_in_lag_window_is_due_whatever_its_earnings_date(earnings_date):
+    # the annual period ending 2024-12-31 is due from 2025-02-14 until 2025-06-29
+    now = pd.Timestamp("2025-05-15")
+    (symbol,) = get_symbols(now, 4, 1, in_sweep=False)
+
+    assert select_due(now, {symbol: "2023-12-31"}, {symbol: earnings_date}) == [symbol]
+
+
+def test_past_earnings_date_makes_symbol_due_outside_lag_window():
+    now = pd.Timestamp("2025-08-15")
+    past, future, unknown, before_period = get_symbols(now, 4, 4, in_sweep=False)
+    last_dates = {past: "2023-12-31", future: "2023-12-31", unknown: "2023-12-31", before_period: "2023-12-31"}
+    earnings_dates = {past: "2025-03-01", future: "2025-09-01", unknown: None, before_period: "2024-11-01"}
+
+    assert select_due(now, last_dates, earnings_dates) == [past]
+
+
+def test_past_earnings_date_makes_symbol_due_before_min_lag():
+    # the quarter ending 2025-03-31 is due by its lag from 2025-04-20
+    now = pd.Timestamp("2025-04-10")
+    reported, unreported = get_symbols(now, 4, 2, in_sweep=False)
+    last_dates = {reported: "2024-12-31", unreported: "2024-12-31"}
+    earnings_dates = {reported: "2025-04-05", unreported: "2025-04-25"}
+
+    assert select_due(now, last_dates, earnings_dates, quarterly=True) == [reported]
+
+
+def test_symbols_without_stored_period_or_in_sweep_share_are_due():
+    now = pd.Timestamp("2025-04-10")
+    (swept,) = get_symbols(now, 4, 1, in_sweep=True)
+    new, up_to_date = get_symbols(now, 4, 2, in_sweep=False)
+    last_dates = {swept: "2025-03-31", new: None, up_to_date: "2025-03-31"}
+    earnings_dates = {swept: "2025-07-30", new: None, up_to_date: "2025-07-30"}
+
+    assert select_due(now, last_dates, earnings_dates, quarterly=True) == [swept, new]
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+from financial_metrics import FINANCIALS_PLAN
+
+UPDATED_ON = "2025-05-01 00:00:00"
+
+
+def make_statement(columns):
+    """Returns a statement as _request_yf_api reads it from a YF frame of one column per date, {date: {row: value}}"""
+    return pd.DataFrame(columns).to_dict()
+
+
+def make_record(symbol, date, **values):
+    record = {"symbol": symbol, "date": date}
+    record.update({column: None for column in FINANCIALS_PLAN.columns})
+    record["source"] = 1
+    record.update(values)
+    record["updated_on"] = UPDATED_ON
+    return record
+
+
+QUARTERLY_STATEMENTS = {
+    "BANK.JK": {
+        "income_stmt": make_statement(
+            {
+                pd.Timestamp("2024-12-31"): {
+                    "Total Revenue": 1000.4,
+                    "Net Interest Income": 600.0,
+                    "Interest Income Non Operating": np.nan,
+                    "Provision For Doubtful Accounts": np.nan,
+                    "Provision For Credit Losses": 12.5,
+                    "Gross Profit": 800.0,
+                },
+                pd.Timestamp("2025-03-31"): {
+                    "Total Revenue": 1100.0,
+                    "Net Interest Income": 650.0,
+                    "Interest Income Non Operating": 300.0,
+                    "Provision For Doubtful Accounts": 7.0,
+                    "Provision For Credit Losses": 13.5,
+                    "Gross Profit": 900.0,
+                },
+            }
+        ),
+        "balance_sheet": make_statement(
+            {
+                pd.Timestamp("2025-03-31"): {
+                    "Total Assets": 5000.5,
+                    "Current Liabilities": 1500.0,
+                },
+            }
+        ),
+        "cashflow": make_statement(
+            {
+                pd.Timestamp("2025-03-31"): {
+                    "Cash Flowsfromusedin Operating Activities Direct": np.nan,
+                    "Operating Cash Flow": -2.5,
+                },
+            }
+        ),
+    },
+    "MINE.JK": {
+        "income_stmt": make_statement(
+            {
+                pd.Timestamp("2025-03-31"): {
+                    "Total Revenue": 2000.0,
+                    "Gross Profit": 700.0,
+                    "EBITDA": 400.0,
+                    "Cost Of Revenue": 1300.0,
+                    "Reconciled Cost Of Revenue": 1299.0,
+                },
+            }
+        ),
+        "balance_sheet": make_statement(
+            {
+                pd.Timestamp("2025-03-31"): {
+                    "Cash Cash Equivalents And Short Term Investments": 250.0,
+                    "Current Liabilities": 900.0,
+                },
+            }
+        ),
+        "cashflow": {},
+    },
+}
+
+
+def test_quarterly_records():
+    records = FINANCIALS_PLAN.transform(
+        QUARTERLY_STATEMENTS, wsj_formats={"BANK.JK": 1, "MINE.JK": 2}, updated_on=UPDATED_ON
+    )
+
+    assert records == [
+        make_record(
+            "BANK.JK",
+            "2024-12-31",
+            total_revenue=1000,
+            net_interest_income=600,
+            # derived from total_revenue - net_interest_income without a source value
+            non_interest_income=400,
+            # second source row where the first has no value
+            provision=12,
+            gross_income=800,
+        ),
+        make_record(
+            "BANK.JK",
+            "2025-03-31",
+            total_revenue=1100,
+            net_interest_income=650,
+            non_interest_income=300,
+            provision=7,
+            gross_income=900,
+            total_assets=5000,
+            total_current_liabilities=1500,
+            net_operating_cash_flow=-2,
+        ),
+        make_record(
+            "MINE.JK",
+            "2025-03-31",
+            total_revenue=2000,
+            gross_income=700,
+            ebitda=400,
+            cost_of_revenue=1300,
+            cash_and_short_term_investments=250,
+            total_current_liabilities=900,
+        ),
+    ]
+    assert all(type(record["total_revenue"]) is int for record in records)
+
+
+def test_wsj_formats_null_missing_metrics():
+    records = FINANCIALS_PLAN.transform(
+        QUARTERLY_STATEMENTS, wsj_formats={"MINE.JK": 3}, updated_on=UPDATED_ON
+    )
+
+    # format 3 statements lack gross income, EBITDA, cash and current liabilities
+    assert records[2] == make_record("MINE.JK", "2025-03-31", total_revenue=2000, cost_of_revenue=1300)
+    assert records[1]["gross_income"] == 900
+
+
+def test_annual_records_after_last_date():
+    statements = {
+        "BANK.JK": {
+            "income_stmt": make_statement(
+                {
+                    pd.Timestamp("2023-12-31"): {"Total Revenue": 3500.5, "Net Income": 1.5},
+                    pd.Timestamp("2024-12-31"): {"Total Revenue": 4000.49, "Net Income": 2.5},
+                }
+            ),
+            "balance_sheet": make_statement(
+                {pd.Timestamp("2024-12-31"): {"Total Equity Gross Minority Interest": 123456789012.7}}
+            ),
+        },
+    }
+
+    records = FINANCIALS_PLAN.transform(
+        statements, last_dates={"BANK.JK": "2023-12-31"}, updated_on=UPDATED_ON
+    )
+
+    # ints are rounded half to even, like round() of the former transform
+    assert records == [
+        make_record("BANK.JK", "2024-12-31", total_revenue=4000, net_income=2, total_equity=123456789013),
+    ]
@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import run_profiler
+from run_profiler import RunProfiler
+
+
+def create_daily_data_records(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def read_collapsed(output_dir, stage):
+    with open(os.path.join(output_dir, f"{stage}.collapsed")) as f:
+        return f.read().splitlines()
+
+
+def test_sampler_writes_collapsed_stacks(tmp_path):
+    profiler = RunProfiler(str(tmp_path), interval=0.001)
+    stop = threading.Event()
+    worker = threading.Thread(target=create_daily_data_records, args=(stop,))
+    worker.start()
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    worker.join()
+
+    lines = read_collapsed(str(tmp_path), "fetch")
+    assert any("test_run_profiler.py:create_daily_data_records" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_sampler_names_frames_without_co_qualname(tmp_path, monkeypatch):
+    # code objects of Python 3.10 and earlier have no co_qualname
+    def make_frame(name, back=None):
+        return SimpleNamespace(f_code=SimpleNamespace(co_filename=f"/src/{name}.py", co_name=name), f_back=back)
+
+    frame = make_frame("_batch_upsert", make_frame("upsert_data_to_db"))
+    current_frames = sys._current_frames
+    monkeypatch.setattr(run_profiler.sys, "_current_frames", lambda: {-1: frame, **current_frames()})
+    profiler = RunProfiler(str(tmp_path), interval=0.001)
+    profiler.start()
+    time.sleep(0.05)
+    profiler.stop()
+
+    lines = read_collapsed(str(tmp_path), "upsert")
+    assert lines[0].startswith("upsert_data_to_db.py:upsert_data_to_db;_batch_upsert.py:_batch_upsert ")
@@ -0,0 +1,84 @@
+import pytest
+
+from idxyfdataupdater import IdxYFDataUpdater
+from storage_sink import LocalSink
+from usyfdataupdater import USYFDataUpdater
+
+
+def make_updater(updater_class, tmp_path):
+    updater = updater_class()
+    updater.ledger_rows = []
+    updater._insert_run_stats = lambda db_client, record: updater.ledger_rows.append(record)
+    return updater, LocalSink(str(tmp_path / "local.sqlite"))
+
+
+def fail(message):
+    def raise_error(*args, **kwargs):
+        raise RuntimeError(message)
+
+    return raise_error
+
+
+@pytest.mark.parametrize("updater_class", [IdxYFDataUpdater, USYFDataUpdater])
+def test_failed_symbol_extraction_writes_failed_row(updater_class, tmp_path):
+    updater, sink = make_updater(updater_class, tmp_path)
+    updater.extract_symbols_from_db = fail("symbols unavailable")
+
+    with pytest.raises(RuntimeError, match="symbols unavailable"):
+        updater.upsert_data_to_db(sink, "idx_key_stats" if updater_class is IdxYFDataUpdater else "key_stats")
+
+    assert len(updater.ledger_rows) == 1
+    assert updater.ledger_rows[0]["status"] == "failed"
+    assert updater.ledger_rows[0]["error"] == "symbols unavailable"
+
+
+def test_failed_fetch_writes_failed_row(tmp_path):
+    updater, sink = make_updater(IdxYFDataUpdater, tmp_path)
+    updater.symbols = ["AAAA.JK", "BBBB.JK"]
+    updater.create_key_stats_records = fail("quotes unavailable")
+
+    with pytest.raises(RuntimeError, match="quotes unavailable"):
+        updater.upsert_data_to_db(sink, "idx_key_stats", extract_symbols=False)
+
+    (row,) = updater.ledger_rows
+    assert (row["status"], row["error"], row["symbols_attempted"]) == ("failed", "quotes unavailable", 2)
+
+
+def test_failed_write_writes_one_failed_row(tmp_path):
+    updater, sink = make_updater(IdxYFDataUpdater, tmp_path)
+    updater.symbols = []
+    updater._batch_upsert = fail("database unavailable")
+
+    with pytest.raises(RuntimeError, match="database unavailable"):
+        updater.upsert_data_to_db(sink, "idx_key_stats", extract_symbols=False)
+
+    assert [(row["status"], row["error"]) for row in updater.ledger_rows] == [("failed", "database unavailable")]
+
+
+def test_deferred_symbols_are_counted_per_table(tmp_path):
+    updater, sink = make_updater(IdxYFDataUpdater, tmp_path)
+    updater.symbols = ["AAAA.JK", "BBBB.JK"]
+    updater.set_time_budget(60, str(tmp_path / "checkpoints"))
+    # the budget is used up while the first table is fetched and grows again for the second
+    budget_left = {"idx_key_stats": False, "idx_dividend": True}
+    updater.prefetch_companies_data = lambda target_tables: None
+
+    def make_create_records(target_table, kind):
+        def create_records(*args, **kwargs):
+            updater.time_budget.can_start = lambda: budget_left[target_table]
+            for symbol in updater.symbols:
+                updater._start_symbol(symbol)
+            updater.new_records[kind] = []
+
+        return create_records
+
+    updater.create_key_stats_records = make_create_records("idx_key_stats", "key_stats")
+    updater.create_dividend_records = make_create_records("idx_dividend", "dividend")
+
+    updater.upsert_tables_to_db(sink, ["idx_key_stats", "idx_dividend"], extract_symbols=False)
+
+    assert [(row["target_table"], row["symbols_deferred"]) for row in updater.ledger_rows] == [
+        ("idx_key_stats", 2),
+        ("idx_dividend", 0),
+    ]
+    assert sorted(p.name for p in (tmp_path / "checkpoints").iterdir()) == ["idx_key_stats_batch_1_checkpoint.json"]
@@ -0,0 +1,93 @@
+from datetime import date, datetime
+
+import pytest
+
+from trading_calendar import IDX_HOLIDAYS, TradingCalendar
+
+
+def at(calendar, day, hour, minute=0):
+    return datetime.fromisoformat(f"{day}T{hour:02d}:{minute:02d}").replace(tzinfo=calendar.tz)
+
+
+@pytest.mark.parametrize("exchange", ["IDX", "US"])
+def test_weekends_are_not_sessions(exchange):
+    calendar = TradingCalendar(exchange)
+
+    assert not calendar.is_session(date(2025, 3, 15))
+    assert not calendar.is_session(date(2025, 3, 16))
+    assert calendar.is_session(date(2025, 3, 17))
+    assert calendar.previous_session(date(2025, 3, 17)) == date(2025, 3, 14)
+
+
+@pytest.mark.parametrize("year", [2024, 2025, 2026])
+def test_tabled_idx_holidays_are_not_sessions(year, capsys):
+    calendar = TradingCalendar("IDX")
+    holidays = [date.fromisoformat(day) for day in IDX_HOLIDAYS[year]]
+
+    assert [day for day in holidays if calendar.is_session(day)] == []
+    assert not set(calendar.sessions(date(year, 1, 1), date(year, 12, 31))) & set(holidays)
+    assert "Warning" not in capsys.readouterr().out
+
+
+def test_computed_idx_holidays():
+    calendar = TradingCalendar("IDX")
+
+    # New Year, Good Friday, Labour Day, Ascension Day, Independence Day, Christmas and the year-end closure
+    for day in ["2025-01-01", "2025-04-18", "2025-05-01", "2025-05-29", "2025-12-25", "2025-12-31", "2026-08-17"]:
+        assert not calendar.is_session(date.fromisoformat(day)), day
+    assert calendar.sessions(date(2025, 4, 14), date(2025, 4, 18)) == [
+        date(2025, 4, 14),
+        date(2025, 4, 15),
+        date(2025, 4, 16),
+        date(2025, 4, 17),
+    ]
+
+
+def test_year_without_idx_holidays_warns_once(capsys):
+    calendar = TradingCalendar("IDX")
+    year = max(IDX_HOLIDAYS) + 1
+
+    assert calendar.is_session(date(year, 1, 5)) == (date(year, 1, 5).weekday() < 5)
+    calendar.is_session(date(year, 1, 6))
+
+    out = capsys.readouterr().out
+    assert out.count(f"IDX_HOLIDAYS has no dates for {year}") == 1
+
+
+def test_us_holidays():
+    calendar = TradingCalendar("US")
+
+    # Good Friday, Juneteenth, Independence Day observed on a Friday, Thanksgiving, national day of mourning
+    for day in ["2025-04-18", "2025-06-19", "2026-07-03", "2025-11-27", "2025-01-09"]:
+        assert not calendar.is_session(date.fromisoformat(day)), day
+    assert calendar.is_session(date(2025, 11, 28))
+
+
+def test_last_session_opens_at_the_session_open():
+    calendar = TradingCalendar("IDX")
+
+    assert calendar.get_last_session(at(calendar, "2025-03-17", 8, 59)) == date(2025, 3, 14)
+    assert calendar.get_last_session(at(calendar, "2025-03-17", 9)) == date(2025, 3, 17)
+    assert calendar.get_last_session(at(calendar, "2025-03-16", 12)) == date(2025, 3, 14)
+
+
+def test_is_up_to_date_refetches_the_current_session_day():
+    calendar = TradingCalendar("IDX")
+
+    # on a session day the stored row of that day may still change
+    assert not calendar.is_up_to_date("2025-03-17", at(calendar, "2025-03-17", 15))
+    # before the open the previous session is the last one
+    assert calendar.is_up_to_date("2025-03-14", at(calendar, "2025-03-17", 8))
+    assert not calendar.is_up_to_date("2025-03-13", at(calendar, "2025-03-17", 8))
+    # on a weekend or holiday the last session's row is final
+    assert calendar.is_up_to_date("2025-03-14 00:00:00", at(calendar, "2025-03-16", 12))
+    assert calendar.is_up_to_date("2025-03-27", at(calendar, "2025-03-31", 12))
+    assert not calendar.is_up_to_date("2025-03-27", at(calendar, "2025-04-08", 9, 30))
+
+
+def test_is_up_to_date_converts_the_time_zone():
+    calendar = TradingCalendar("IDX")
+    # 2025-03-17 01:00 UTC is 08:00 in Jakarta, before the open
+    now = datetime.fromisoformat("2025-03-17T01:00:00+00:00")
+
+    assert calendar.is_up_to_date("2025-03-14", now)
@@ -0,0 +1,56 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+
+import upsert_encoding
+from upsert_encoding import dumps, iter_json_chunks
+
+RECORDS = [
+    {
+        "symbol": "BBCA.JK",
+        "date": date(2025, 1, 2),
+        "close": np.float64("nan"),
+        "volume": np.int64(1200),
+        "market_cap": float("inf"),
+        "forward_eps": np.float32(1.5),
+        "holders_breakdown": {"insiders": float("nan"), "institutions": 0.25},
+        "prices": np.array([1.0, np.nan]),
+        "updated_on": datetime(2025, 1, 2, 9, 30),
+        "note": "Saham ✓",
+    },
+    {"symbol": "BBRI.JK", "date": "2025-01-02", "close": -float("inf"), "volume": None},
+]
+
+EXPECTED = (
+    '[{"symbol":"BBCA.JK","date":"2025-01-02","close":null,"volume":1200,"market_cap":null,'
+    '"forward_eps":1.5,"holders_breakdown":{"insiders":null,"institutions":0.25},"prices":[1.0,null],'
+    '"updated_on":"2025-01-02T09:30:00","note":"Saham ✓"},'
+    '{"symbol":"BBRI.JK","date":"2025-01-02","close":null,"volume":null}]'
+).encode()
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(upsert_encoding, "orjson", None)
+    return request.param
+
+
+def test_dumps_writes_non_finite_floats_as_null(encoder):
+    assert dumps(RECORDS) == EXPECTED
+
+
+def test_json_chunks_are_the_same_with_either_encoder(monkeypatch):
+    pytest.importorskip("orjson")
+    records = RECORDS * 300
+    orjson_chunks = list(iter_json_chunks(records, max_bytes=4096))
+    monkeypatch.setattr(upsert_encoding, "orjson", None)
+    json_chunks = list(iter_json_chunks(records, max_bytes=4096))
+
+    assert len(orjson_chunks) > 1
+    assert [(chunk.body, len(chunk)) for chunk in json_chunks] == [
+        (chunk.body, len(chunk)) for chunk in orjson_chunks
+    ]
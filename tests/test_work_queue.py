@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+import work_queue
+from work_queue import MAX_ATTEMPTS, SqliteWorkQueue
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "work_queue.sqlite")
+
+
+def open_queue(path, lease_size=2, lease_seconds=60):
+    return SqliteWorkQueue(path, "job", lease_size=lease_size, lease_seconds=lease_seconds)
+
+
+def get_rows(queue):
+    rows = queue._execute(
+        "SELECT symbol, attempts, done_at FROM symbol_work_queue WHERE job = ? ORDER BY position", [queue.job]
+    )
+    return {symbol: (attempts, done_at) for symbol, attempts, done_at in rows}
+
+
+def test_seed_twice_keeps_the_queued_state(queue_path):
+    queue = open_queue(queue_path)
+    queue.seed(["A", "B", "C"])
+    leased = queue.claim()
+    queue.complete(leased)
+
+    open_queue(queue_path).seed(["A", "B", "C", "D"])
+
+    assert queue.get_progress() == {"done": 2, "leased": 0, "pending": 1, "given_up": 0}
+    assert list(get_rows(queue)) == ["A", "B", "C"]
+
+
+def test_queues_never_lease_the_same_symbol(queue_path):
+    first = open_queue(queue_path)
+    second = open_queue(queue_path)
+    first.seed(["A", "B", "C", "D", "E"])
+
+    leases = [first.claim(), second.claim(), first.claim(), second.claim()]
+
+    assert leases == [["A", "B"], ["C", "D"], ["E"], []]
+
+
+def test_concurrent_claims_never_lease_the_same_symbol(queue_path):
+    symbols = [f"S{i:03d}" for i in range(200)]
+    open_queue(queue_path).seed(symbols)
+    leased = [[], [], []]
+
+    def claim_all(leased_symbols):
+        queue = open_queue(queue_path, lease_size=3)
+        while True:
+            claimed = queue.claim()
+            if not claimed:
+                return
+            leased_symbols.extend(claimed)
+
+    threads = [threading.Thread(target=claim_all, args=(leased_symbols,)) for leased_symbols in leased]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sum(leased, [])) == symbols
+
+
+def test_renew_fails_once_the_lease_expired_and_was_claimed(queue_path):
+    first = open_queue(queue_path, lease_seconds=0.1)
+    second = open_queue(queue_path)
+    first.seed(["A", "B"])
+    first.claim()
+    assert first.renew()
+
+    time.sleep(0.2)
+    assert second.claim() == ["A", "B"]
+    assert not first.renew()
+    assert second.renew()
+
+
+def test_release_does_not_use_up_an_attempt(queue_path):
+    queue = open_queue(queue_path)
+    queue.seed(["A", "B"])
+
+    for _ in range(MAX_ATTEMPTS + 1):
+        assert queue.claim() == ["A", "B"]
+        queue.release(["A", "B"])
+
+    assert get_rows(queue) == {"A": (0, None), "B": (0, None)}
+    assert queue.get_progress()["pending"] == 2
+
+
+def test_symbol_is_given_up_after_max_attempts(queue_path):
+    queue = open_queue(queue_path)
+    queue.seed(["A", "B"])
+    assert queue.claim() == ["A", "B"]
+    queue.complete(["B"])
+    queue.release(["A"], count_attempt=True)
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert queue.claim() == ["A"]
+        queue.release(["A"], count_attempt=True)
+
+    assert queue.claim() == []
+    assert queue.get_progress() == {"done": 1, "leased": 0, "pending": 0, "given_up": 1}
+
+
+def test_leases_end_once_every_symbol_is_done(queue_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "IDLE_POLL_SECONDS", 0.05)
+    queue = open_queue(queue_path)
+    queue.seed(["A", "B", "C"])
+
+    leased = []
+    for symbols in queue.leases():
+        leased.append(symbols)
+        queue.complete(symbols)
+
+    assert leased == [["A", "B"], ["C"]]
+    assert queue.get_progress() == {"done": 3, "leased": 0, "pending": 0, "given_up": 0}
@@ -0,0 +1,44 @@
+import time
+
+
+class TimeBudget:
+    """Wall-clock budget for a run, used to stop fetching before a runner deadline
+
+    Tracks how long a symbol takes to fetch and refuses to start another one when
+    it would not finish before the budget minus the part reserved for upserting.
+    """
+
+    def __init__(self, seconds, flush_reserve=0.1, smoothing=0.2):
+        """
+        Args:
+            seconds (float): Total budget, counted from now
+            flush_reserve (float, optional): Fraction of the budget kept for upserting the fetched records. Defaults to 0.1.
+            smoothing (float, optional): Weight of the latest symbol in the moving average duration. Defaults to 0.2.
+        """
+        self.seconds = seconds
+        self.reserve = seconds * flush_reserve
+        self.smoothing = smoothing
+        self.started = time.monotonic()
+        self.symbol_seconds = None
+        self.completed = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def record(self, duration):
+        """Records the fetch duration of one symbol"""
+        if self.symbol_seconds is None:
+            self.symbol_seconds = duration
+        else:
+            self.symbol_seconds += self.smoothing * (duration - self.symbol_seconds)
+        self.completed += 1
+
+    def can_start(self):
+        """Whether one more symbol is projected to finish within the budget"""
+        projected = self.elapsed() + (self.symbol_seconds or 0)
+        return projected <= self.seconds - self.reserve
+
+    def throughput(self):
+        """Completed symbols per minute so far"""
+        elapsed = self.elapsed()
+        return self.completed / elapsed * 60 if elapsed > 0 else 0
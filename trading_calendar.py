@@ -0,0 +1,235 @@
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# Time zone and regular session open of each exchange
+EXCHANGE_SESSIONS = {
+    "IDX": ("Asia/Jakarta", time(9, 0)),
+    "US": ("America/New_York", time(9, 30)),
+}
+
+# NYSE closures outside the holiday rules (national days of mourning)
+US_SPECIAL_CLOSURES = [
+    "2018-12-05",
+    "2025-01-09",
+]
+
+# IDX holidays that follow the lunar and Islamic calendars, and the collective
+# leave days (cuti bersama) around them, as announced by IDX per year. Fixed
+# and Easter based holidays are computed. Days of years missing here count as
+# sessions, which only forgoes skipping them; a warning is printed for such years.
+IDX_HOLIDAYS = {
+    2024: [
+        "2024-02-08",
+        "2024-02-09",
+        "2024-02-14",
+        "2024-03-11",
+        "2024-03-12",
+        "2024-04-08",
+        "2024-04-09",
+        "2024-04-10",
+        "2024-04-11",
+        "2024-04-12",
+        "2024-04-15",
+        "2024-05-10",
+        "2024-05-23",
+        "2024-05-24",
+        "2024-06-17",
+        "2024-06-18",
+        "2024-09-16",
+        "2024-12-26",
+    ],
+    2025: [
+        "2025-01-27",
+        "2025-01-28",
+        "2025-01-29",
+        "2025-03-28",
+        "2025-03-31",
+        "2025-04-01",
+        "2025-04-02",
+        "2025-04-03",
+        "2025-04-04",
+        "2025-04-07",
+        "2025-05-12",
+        "2025-05-13",
+        "2025-05-30",
+        "2025-06-06",
+        "2025-06-09",
+        "2025-06-27",
+        "2025-08-18",
+        "2025-09-05",
+        "2025-12-26",
+    ],
+    2026: [
+        "2026-01-16",
+        "2026-02-16",
+        "2026-02-17",
+        "2026-03-18",
+        "2026-03-19",
+        "2026-03-20",
+        "2026-03-23",
+        "2026-03-24",
+        "2026-05-15",
+        "2026-05-27",
+        "2026-05-28",
+        "2026-06-16",
+        "2026-08-25",
+        "2026-12-24",
+    ],
+}
+
+
+def _easter(year):
+    """Returns Easter Sunday of a year (anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    """Returns the nth (from 1, or -1 for the last) weekday of a month"""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    last = next_month - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    """Moves a Saturday holiday to Friday and a Sunday holiday to Monday"""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+def _us_holidays(year):
+    holidays = [
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(date(year, 12, 25)),
+    ]
+    # a Saturday New Year's Day is not observed on the Friday before
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.append(_observed(new_year))
+    if year >= 2022:
+        holidays.append(_observed(date(year, 6, 19)))  # Juneteenth
+    holidays.extend(
+        date.fromisoformat(day) for day in US_SPECIAL_CLOSURES if day.startswith(str(year))
+    )
+    return holidays
+
+
+def _idx_holidays(year):
+    holidays = [
+        date(year, 1, 1),
+        _easter(year) - timedelta(days=2),  # Good Friday
+        date(year, 5, 1),
+        _easter(year) + timedelta(days=39),  # Ascension Day
+        date(year, 6, 1),  # Pancasila Day
+        date(year, 8, 17),
+        date(year, 12, 25),
+        # the exchange closes on the last day of the year
+        date(year, 12, 31),
+    ]
+    if year not in IDX_HOLIDAYS:
+        print(
+            f"Warning: IDX_HOLIDAYS has no dates for {year}, its lunar holidays and "
+            "cuti bersama count as IDX sessions"
+        )
+    holidays.extend(date.fromisoformat(day) for day in IDX_HOLIDAYS.get(year, []))
+    return holidays
+
+
+class TradingCalendar:
+    """Offline calendar of the regular trading sessions of the IDX or a US exchange
+
+    Lets the daily data update skip symbols that cannot have a new session
+    since their last stored row, e.g. on weekends, holidays and before the
+    open. Holidays are computed by rule or read from IDX_HOLIDAYS, no request
+    is made.
+    """
+
+    def __init__(self, exchange):
+        """
+        Args:
+            exchange (str): "IDX" or "US"
+        """
+        if exchange not in EXCHANGE_SESSIONS:
+            raise ValueError(f"Unknown exchange: {exchange}")
+
+        self.exchange = exchange
+        tz_name, self.open_time = EXCHANGE_SESSIONS[exchange]
+        self.tz = ZoneInfo(tz_name)
+        self._get_holidays = _idx_holidays if exchange == "IDX" else _us_holidays
+        self._holidays = {}
+
+    def is_session(self, day):
+        if day.weekday() >= 5:
+            return False
+        if day.year not in self._holidays:
+            self._holidays[day.year] = set(self._get_holidays(day.year))
+        return day not in self._holidays[day.year]
+
+    def previous_session(self, day):
+        """Returns the last session before day"""
+        day -= timedelta(days=1)
+        while not self.is_session(day):
+            day -= timedelta(days=1)
+        return day
+
+    def sessions(self, start, end):
+        """Returns the sessions from start to end, both included"""
+        days = []
+        day = start
+        while day <= end:
+            if self.is_session(day):
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def get_last_session(self, now=None):
+        """Returns the last session whose rows YF may have changed since then
+
+        That is today's session once it has opened, and the session before
+        today otherwise.
+
+        Args:
+            now (datetime, optional): Time zone aware time. Defaults to None, which is the current time.
+        """
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        today = now.date()
+        if self.is_session(today) and now.time() >= self.open_time:
+            return today
+        return self.previous_session(today)
+
+    def is_up_to_date(self, last_date, now=None):
+        """Whether a symbol whose last stored row is on last_date can have no new session rows
+
+        The stored row of the last session is re-fetched while that session
+        may still be open, i.e. on the day itself.
+
+        Args:
+            last_date (str): Date of the last stored row, "%Y-%m-%d"
+            now (datetime, optional): Time zone aware time. Defaults to None, which is the current time.
+        """
+        now = (now or datetime.now(self.tz)).astimezone(self.tz)
+        last_session = self.get_last_session(now)
+        if last_session == now.date():
+            return False
+        return date.fromisoformat(str(last_date)[:10]) >= last_session
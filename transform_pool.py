@@ -0,0 +1,60 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Payloads (symbols) sent to a worker process at a time
+TRANSFORM_BATCH_SIZE = 50
+
+
+def iter_batches(payloads, batch_size=TRANSFORM_BATCH_SIZE):
+    """Yields lists of up to batch_size consecutive payloads, consuming payloads lazily"""
+    batch = []
+    for payload in payloads:
+        batch.append(payload)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TransformPool:
+    """Runs the CPU-bound transforms of fetched YF payloads in worker processes
+
+    The fetch threads then only wait on the network, and the pandas work of
+    the transforms no longer holds the GIL they need. func must be a module
+    level function taking a list of payloads, like the ones in transforms.py,
+    and its payloads and results must be picklable.
+    """
+
+    def __init__(self, max_workers, batch_size=TRANSFORM_BATCH_SIZE):
+        """
+        Args:
+            max_workers (int): Number of worker processes
+            batch_size (int, optional): Payloads per batch. Defaults to TRANSFORM_BATCH_SIZE.
+        """
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        # forking a process with running fetch threads may copy held locks
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def map_batches(self, func, payloads, *args):
+        """Yields func(batch, *args) for consecutive batches of payloads, in order
+
+        Payloads are consumed lazily and at most two batches per worker are in
+        flight, so a large fetch is transformed while it is still running
+        without being held in memory all at once.
+        """
+        pending = deque()
+        for batch in iter_batches(payloads, self.batch_size):
+            pending.append(self._executor.submit(func, batch, *args))
+            while len(pending) >= 2 * self.max_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
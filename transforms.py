@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+from daily_data_buffer import DAILY_DATA_DTYPE
+from financial_metrics import FINANCIALS_PLAN
+
+# Transforms of fetched YF payloads. They do no I/O and are module level, so
+# TransformPool can run them in worker processes; the updater calls them in
+# process when it has no transform pool.
+
+
+def _get_dates(index):
+    """Returns the "%Y-%m-%d" dates of a history index as datetime64[D], in the index's own time zone"""
+    if isinstance(index, pd.DatetimeIndex):
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        return index.to_numpy().astype("M8[D]")
+    return np.asarray(pd.to_datetime(index).strftime("%Y-%m-%d"), dtype="M8[D]")
+
+
+def _get_floats(data, column):
+    """Returns a column as floats, NaN where it is missing, None or not numeric"""
+    if column not in data:
+        return np.full(len(data), np.nan)
+    values = data[column]
+    if values.dtype.kind in "biuf":
+        return values.to_numpy("f8")
+    return pd.to_numeric(values, errors="coerce").to_numpy("f8")
+
+
+def transform_daily_batch(payloads):
+    """Fills the market cap of the daily data of a batch of symbols in one pass
+
+    The frames are concatenated into one long set of arrays. Per symbol, the
+    latest row gets the current market cap (method 1), and rows without a
+    market cap get their close times the share number implied by the current
+    market cap (method 2) or, without it, by the stored last row (method 3).
+
+    Args:
+        payloads (list): (symbol, data, new_mcap, calc_share_db) per symbol, data being
+            Close and Volume (and the stored last row's Market Cap and mcap_method) by date
+
+    Returns:
+        list: (symbol, rows, error) per symbol, rows being DailyDataBuffer rows with
+            symbol code 0 and error None or the failure's message
+    """
+    results = []
+    columns, new_mcaps, share_dbs, indices = [], [], [], []
+    for symbol, data, new_mcap, calc_share_db in payloads:
+        if len(data) == 0:
+            results.append((symbol, np.zeros(0, dtype=DAILY_DATA_DTYPE), None))
+            continue
+
+        try:
+            columns.append(
+                [
+                    _get_dates(data.index),
+                    _get_floats(data, "Close"),
+                    _get_floats(data, "Volume"),
+                    _get_floats(data, "Market Cap"),
+                    _get_floats(data, "mcap_method"),
+                ]
+            )
+        except Exception as e:
+            results.append((symbol, None, f"{type(e).__name__}: {e}"))
+            continue
+
+        indices.append(len(results))
+        results.append((symbol, None, None))
+        new_mcaps.append(new_mcap)
+        share_dbs.append(calc_share_db)
+
+    if not columns:
+        return results
+
+    dates, close, volume, market_cap, mcap_method = [
+        np.concatenate(values) for values in zip(*columns)
+    ]
+    lengths = np.array([len(values[0]) for values in columns])
+    segment = np.repeat(np.arange(len(columns)), lengths)
+    # the latest row of each symbol, the last of its segment once sorted by date
+    last = np.lexsort((dates, segment))[np.cumsum(lengths) - 1]
+
+    # None or zero counts as no market cap or share number, like NaN does not
+    new_mcap = np.array([np.nan if v is None else float(v) for v in new_mcaps])
+    share_db = np.array([np.nan if v is None else float(v) for v in share_dbs])
+    has_new_mcap = np.array([bool(v) for v in new_mcaps])
+
+    market_cap[last] = new_mcap
+    mcap_method[last] = np.where(has_new_mcap, 1, np.nan)
+
+    share_number = np.where(has_new_mcap, new_mcap / close[last], share_db)
+    has_share_number = np.where(
+        has_new_mcap, share_number != 0, [bool(v) for v in share_dbs]
+    )
+    fill_method = np.where(has_new_mcap, 2, 3)
+
+    fill = np.isnan(market_cap) & has_share_number[segment]
+    market_cap[fill] = close[fill] * share_number[segment[fill]]
+    mcap_method[fill] = fill_method[segment[fill]]
+
+    rows = np.zeros(len(dates), dtype=DAILY_DATA_DTYPE)
+    rows["date"] = dates
+    rows["close"] = close
+    rows["volume"] = volume
+    rows["market_cap"] = market_cap
+    rows["mcap_method"] = np.nan_to_num(mcap_method, nan=0).astype("i1")
+
+    for i, symbol_rows in zip(indices, np.split(rows, np.cumsum(lengths)[:-1])):
+        results[i] = (results[i][0], symbol_rows, None)
+
+    return results
+
+
+def transform_dividends_batch(payloads):
+    """Returns the dividend records of dividend payloads
+
+    Args:
+        payloads (list): (symbol, dividends, mean_prices) per symbol, with the new
+            dividends by date and the mean close of each past year among them
+
+    Returns:
+        list: Records without updated_on, yield is None for this year's dividends
+    """
+    records = []
+    for symbol, dividends, mean_prices in payloads:
+        for date, val in dividends.items():
+            records.append(
+                {
+                    "symbol": symbol,
+                    "date": date.strftime("%Y-%m-%d"),
+                    "dividend": val,
+                    "yield": val / mean_prices[date.year] if date.year in mean_prices else None,
+                }
+            )
+    return records
+
+
+def transform_financials_batch(payloads, last_dates={}, wsj_formats={}):
+    """Computes the financials columns of (symbol, statements) payloads, see MetricPlan.compute"""
+    return FINANCIALS_PLAN.compute(dict(payloads), last_dates, wsj_formats)
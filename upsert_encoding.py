@@ -0,0 +1,144 @@
+import gzip
+import json
+import math
+from datetime import date, datetime
+
+import numpy as np
+
+try:
+    # optional, encodes several times faster than json and handles dates and NumPy values natively
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bytes of uncompressed JSON per upsert request body
+DEFAULT_MAX_BYTES = 1 << 20
+# gzip level of compressed request bodies, the repetitive keys of the records already compress well at level 1
+GZIP_LEVEL = 1
+# Records encoded per dumps call by iter_json_chunks
+ENCODE_BLOCK_SIZE = 256
+
+
+def _default(value):
+    """Converts the values json cannot encode, the way orjson does"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.datetime64):
+        return str(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _replace_non_finite(value):
+    """Returns value with NaN and infinite floats replaced by None, the way orjson writes them"""
+    if isinstance(value, (float, np.floating)):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    if isinstance(value, np.ndarray) and value.dtype.kind == "f":
+        return _replace_non_finite(value.tolist())
+    return value
+
+
+def dumps(value):
+    """Returns value as compact UTF-8 JSON bytes, with orjson when it is installed
+
+    Dates are written in ISO format and NumPy scalars and arrays as their
+    values. NaN and infinite floats are written as null by both encoders.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        _replace_non_finite(value),
+        separators=(",", ":"),
+        ensure_ascii=False,
+        allow_nan=False,
+        default=_default,
+    ).encode()
+
+
+class JsonChunk:
+    """A JSON array of records encoded once, ready to be sent and re-sent as a request body"""
+
+    def __init__(self, body, columns, row_count):
+        """
+        Args:
+            body (bytes): JSON array of the records
+            columns (list): Keys of the records, sorted
+            row_count (int): Number of records
+        """
+        self.body = body
+        self.columns = columns
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def compress(self, level=GZIP_LEVEL):
+        """Returns the body gzip-compressed"""
+        return gzip.compress(self.body, compresslevel=level)
+
+
+def _iter_blocks(records):
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) == ENCODE_BLOCK_SIZE:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def iter_json_chunks(records, max_bytes=DEFAULT_MAX_BYTES):
+    """Encodes records into JSON arrays of up to max_bytes each
+
+    Records are encoded a block at a time and the arrays are joined from the
+    encoded bytes, so requests are sized by their body rather than by a row
+    count and retries re-send the same bytes. A block too big for a chunk is
+    encoded record by record, and a record bigger than max_bytes gets a
+    chunk of its own. Records are consumed lazily, a DailyDataBuffer is
+    never turned into one list of dicts.
+
+    Args:
+        records (iterable): Record dicts
+        max_bytes (int, optional): Maximum body size in bytes. Defaults to DEFAULT_MAX_BYTES.
+
+    Yields:
+        JsonChunk: Encoded records
+    """
+    parts = []
+    size = 2
+    row_count = 0
+    columns = set()
+
+    for block in _iter_blocks(records):
+        # the array's items without its brackets
+        encoded = [(dumps(block)[1:-1], block)]
+        if len(encoded[0][0]) + 2 > max_bytes and len(block) > 1:
+            encoded = [(dumps(record), [record]) for record in block]
+
+        for part, part_records in encoded:
+            if parts and size + len(part) + 1 > max_bytes:
+                yield JsonChunk(b"[" + b",".join(parts) + b"]", sorted(columns), row_count)
+                parts = []
+                size = 2
+                row_count = 0
+                columns = set()
+
+            parts.append(part)
+            size += len(part) + 1
+            row_count += len(part_records)
+            columns.update(*part_records)
+
+    if parts:
+        yield JsonChunk(b"[" + b",".join(parts) + b"]", sorted(columns), row_count)
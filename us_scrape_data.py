@@ -1,39 +1,158 @@
 import os
 import argparse
-import json
 from dotenv import load_dotenv
 from neon_connector.neon_connector import NeonConnector
+from neon_pool import PooledNeonConnector
+from run_profiler import RunProfiler
+from work_queue import DEFAULT_LEASE_SIZE, open_work_queue
+from storage_sink import LocalSink
 from usyfdataupdater import USYFDataUpdater
 import pandas as pd
 
-def main(target_table, batch_size, batch_number):
+def seed_local_symbols(sink, symbols):
+    """Adds symbols missing from the company_stock table of a local sink, with new ids"""
+    stored = sink.select_page("company_stock", ["symbol", "id"], [("id", False)])
+    stored_symbols = {row["symbol"] for row in stored}
+    next_id = max([row["id"] for row in stored], default=0) + 1
+    dt_now = pd.Timestamp.now(tz='GMT').strftime('%Y-%m-%d %H:%M:%S')
+
+    rows = []
+    for symbol in symbols:
+        if symbol not in stored_symbols:
+            rows.append({"id": next_id, "symbol": symbol, "updated_on": dt_now})
+            next_id += 1
+    sink.upsert("company_stock", rows, ["id"])
+
+def main(target_table, batch_size, batch_number, replay_file=None, bulk_load=False, max_workers=1, time_budget=None, state_store=None, yf_session=None, db_workers=1, profile=None, trace_allocations=False, daily_lane="split", backfill_workers=1, transform_workers=1, local_db=None, seed_symbols=None, ignore_trading_calendar=False, work_queue=None, queue_job=None, lease_size=DEFAULT_LEASE_SIZE):
     load_dotenv()
-    connection_string = os.getenv('NEON_DATABASE_URL')
-    neon_connector = NeonConnector(connection_string)
+    if local_db:
+        # a dry run against a local SQLite/DuckDB file instead of Neon
+        db_client = LocalSink(local_db)
+        if seed_symbols:
+            seed_local_symbols(db_client, seed_symbols.split(","))
+    elif db_workers > 1:
+        db_client = PooledNeonConnector(os.getenv('NEON_DATABASE_URL'), max_connections=db_workers)
+    else:
+        db_client = NeonConnector(os.getenv('NEON_DATABASE_URL'))
     
-    try:
-        updater = USYFDataUpdater()
-        updater.upsert_data_to_db(neon_connector, target_table, batch_size, batch_number)
-    except Exception as e:
+    if replay_file:
+        updater = USYFDataUpdater(bulk_load=bulk_load)
+        updater.replay_staged_records(db_client, target_table, replay_file)
+        if db_workers > 1 or local_db:
+            db_client.close()
+        return f"Successfully replayed {replay_file} to {target_table} table."
+
+    # several comma separated tables are updated in a single pass over the symbols
+    target_tables = target_table.split(",")
+    updater = USYFDataUpdater(bulk_load=bulk_load, max_workers=max_workers)
+    if time_budget:
+        updater.set_time_budget(time_budget, "us_temp_data")
+    if state_store:
+        updater.set_state_store(state_store)
+    if yf_session:
+        updater.set_session_store(yf_session)
+    # "split" runs the incremental lane of every table first and then backfills new symbols
+    updater.set_daily_lane("incremental" if daily_lane == "split" else daily_lane, backfill_workers)
+    if ignore_trading_calendar:
+        updater.set_trading_calendar(None)
+    if transform_workers > 1:
+        updater.set_transform_pool(transform_workers)
+    profiler = None
+    if profile:
+        profiler = RunProfiler(profile, trace_allocations=trace_allocations)
+        profiler.instrument(updater)
+        profiler.start()
+
+    def save_records(failed_table, e):
         print("An error occurred:", e)
-        print("Saving data to CSV...")
+        print("Saving data to Parquet...")
         
         dir = "us_temp_data"
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-        
         dt_now = pd.Timestamp.now(tz='Asia/Jakarta').strftime('%Y%m%d_%H%M%S')
-        with open(f"{dir}/{target_table}_batch_{batch_number}_{dt_now}.json", "w") as f:
-            f.write(json.dumps(updater.new_records))
+        # in work queue mode the lease, not the batch, holds the failed records
+        name = f"lease_{updater.lease_num}" if work_queue else f"batch_{batch_number}"
+        updater.stage_new_records(failed_table, f"{dir}/{failed_table}_{name}_{dt_now}.parquet")
+
+    if work_queue and not queue_job:
+        queue_job = f"{','.join(target_tables)}:{pd.Timestamp.now(tz='America/New_York').strftime('%Y-%m-%d')}"
+
+    def upsert(tables, job_suffix=""):
+        try:
+            if work_queue:
+                queue = open_work_queue(work_queue, queue_job + job_suffix, lease_size)
+                try:
+                    updater.upsert_from_work_queue(db_client, tables, queue, on_error=save_records)
+                finally:
+                    queue.close()
+            elif len(tables) == 1:
+                updater.upsert_data_to_db(db_client, tables[0], batch_size, batch_number)
+            else:
+                updater.upsert_tables_to_db(db_client, tables, batch_size, batch_number, on_error=save_records)
+        except Exception as e:
+            save_records(tables[0], e)
+
+    try:
+        upsert(target_tables)
+        daily_tables = [t for t in target_tables if "daily_data" in t]
+        if daily_lane == "split" and daily_tables:
+            updater.set_daily_lane("backfill", backfill_workers)
+            upsert(daily_tables, ":backfill")
+    finally:
+        updater.close_transform_pool()
+        if db_workers > 1 or local_db:
+            db_client.close()
+        if profiler is not None:
+            profiler.stop()
         
+    metrics = updater.get_request_metrics()
+    print(f"YF API requests issued: {metrics['issued']}, coalesced: {metrics['coalesced']}")
     return f"Successfully upserted {target_table} table. The following data weren't updated due to errors: {updater.unadded_data}"
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Update data with YFDataUpdater.")
-    parser.add_argument("-tt", "--target_table", help="Target table to update", required=True, type=str)
+    parser.add_argument("-tt", "--target_table", "--tables", help="Target table to update, or comma separated tables to update in one pass (e.g. key_stats,daily_data,dividend)", required=True, type=str)
     parser.add_argument("-bs", "--batch_size", help="Batch size", type=int, default=-1)
     parser.add_argument("-bn", "--batch_number", help="Batch number", type=int, default=1)
+    parser.add_argument("-w", "--max_workers", help="Number of symbols fetched concurrently", type=int, default=1)
+    parser.add_argument("--time_budget", "--time-budget", help="Seconds the run may take; stale symbols are fetched first and the rest is checkpointed for the next run", type=float, default=None)
+    parser.add_argument("--state_store", "--state-store", help="SQLite file mirroring the last stored state per symbol, e.g. us_temp_data/last_state.sqlite", type=str, default=None)
+    parser.add_argument("--yf_session", "--yf-session", help="File sharing Yahoo cookies and crumb between the updater processes of a host, e.g. us_temp_data/yf_session.json", type=str, default=None)
+    parser.add_argument("--daily_lane", "--daily-lane", help="Daily data symbols to update: all, incremental (symbols with stored data), backfill (new symbols) or split (incremental, then backfill; default)", choices=["all", "incremental", "backfill", "split"], default="split")
+    parser.add_argument("--backfill_workers", "--backfill-workers", help="Number of new symbols backfilled concurrently by the backfill lane", type=int, default=1)
+    parser.add_argument("--transform_workers", "--transform-workers", help="Number of processes transforming fetched daily data, dividends and financials into records; 1 transforms in the fetching process", type=int, default=1)
+    parser.add_argument("--work_queue", "--work-queue", help="PostgreSQL connection string or SQLite file of a work queue shared by the runners; symbols are claimed in small leases from it instead of taking the batch's slice", type=str, default=None)
+    parser.add_argument("--queue_job", "--queue-job", help="Job name of the work queue, the same for every runner of the job (default: the target tables and today's date)", type=str, default=None)
+    parser.add_argument("--lease_size", "--lease-size", help="Symbols per work queue lease", type=int, default=DEFAULT_LEASE_SIZE)
+    parser.add_argument("--ignore_trading_calendar", "--ignore-trading-calendar", help="Fetch the daily data of every symbol, also when its last stored row is on the last trading session", action="store_true")
+    parser.add_argument("--profile", help="Write per stage cProfile stats and sampled stacks of the run to this directory", nargs="?", const="us_temp_data/profile", type=str, default=None)
+    parser.add_argument("--trace_allocations", "--trace-allocations", help="With --profile, also trace the memory allocations of the create_*_records methods", action="store_true")
+    parser.add_argument("--replay", help="Upsert records from a staged Parquet file instead of fetching", type=str, default=None)
+    parser.add_argument("--db_workers", help="Pooled database connections; above 1, upsert chunks are written concurrently and a table is written while the next one is fetched", type=int, default=1)
+    parser.add_argument("--local_db", "--local-db", help="Run against a local SQLite file (or DuckDB for a .duckdb file) instead of Neon, e.g. us_temp_data/dry_run.sqlite", type=str, default=None)
+    parser.add_argument("--seed_symbols", "--seed-symbols", help="With --local_db, comma separated symbols added to its company_stock table", type=str, default=None)
+    parser.add_argument("--bulk_load", help="Load records with COPY into a staging table and merge them in one statement", action="store_true")
 
     args = parser.parse_args()
-    main(args.target_table, args.batch_size, args.batch_number)
-
+    main(
+        target_table=args.target_table,
+        batch_size=args.batch_size,
+        batch_number=args.batch_number,
+        replay_file=args.replay,
+        bulk_load=args.bulk_load,
+        max_workers=args.max_workers,
+        time_budget=args.time_budget,
+        state_store=args.state_store,
+        yf_session=args.yf_session,
+        db_workers=args.db_workers,
+        profile=args.profile,
+        trace_allocations=args.trace_allocations,
+        daily_lane=args.daily_lane,
+        backfill_workers=args.backfill_workers,
+        transform_workers=args.transform_workers,
+        local_db=args.local_db,
+        seed_symbols=args.seed_symbols,
+        ignore_trading_calendar=args.ignore_trading_calendar,
+        work_queue=args.work_queue,
+        queue_job=args.queue_job,
+        lease_size=args.lease_size,
+    )
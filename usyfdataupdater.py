@@ -1,184 +1,255 @@
 import json
 import time
 
+from storage_sink import NeonSink
 from yfdataupdater import YFDataUpdater
 
 
 class USYFDataUpdater(YFDataUpdater):
-    def __init__(self):
-        super().__init__()
+    ON_CONFLICT = {
+        "daily_data": ["stock_id", "date"],
+        "key_stats": ["stock_id"],
+        "dividend": ["stock_id", "date"],
+        "financials": ["stock_id", "date"],
+    }
+    DEFAULT_SINK = NeonSink
+    TRADING_CALENDAR = "US"
+
+    def __init__(self, bulk_load=False, max_workers=1):
+        super().__init__(max_workers=max_workers)
+        # load records with COPY into a staging table and merge them in one statement
+        self.bulk_load = bulk_load
         
     def extract_symbols_from_db(
-        self, neon_connector, batch_size=100, batch_num=1
+        self, db_client, batch_size=100, batch_num=1
     ):
         """Extracts symbols from a table in the database
 
         Args:
-            neon_connector (NeonConnector): Neon connector instance
+            db_client (StorageSink or NeonConnector): Storage sink, or a Neon connector instance
             batch_size (int, optional): Number of symbols to extract. Defaults to 100. If batch_size is set to -1, all symbols will be extracted.
             batch_num (int, optional): Batch number. Defaults to 1.
 
         Raises:
             Exception:  If there are no symbols to extract
         """
-        response = neon_connector.select_query( "SELECT symbol, id FROM company_stock ORDER BY updated_on DESC")
-        self.symbol_id_map = {x['symbol']: x['id'] for x in response}
-        symbols = list(self.symbol_id_map.keys())
-        
+        sink = self._as_sink(db_client)
+        # a time-budgeted run starts with the least recently updated symbols
+        order = [("updated_on", self.time_budget is None), ("id", False)]
+
         if batch_size == -1:
-            batch_symbols = symbols
+            response = sink.select_page("company_stock", ["symbol", "id"], order)
         elif batch_size > 0:
-            batch_symbols = symbols[
-                (batch_num - 1) * batch_size : batch_num * batch_size
-            ]
+            offset = (int(batch_num) - 1) * int(batch_size)
+            response = sink.select_page(
+                "company_stock",
+                ["symbol", "id"],
+                order,
+                start=offset,
+                end=offset + int(batch_size) - 1,
+            )
+
+        self.symbol_id_map = {x['symbol']: x['id'] for x in response}
+        batch_symbols = list(self.symbol_id_map.keys())
 
         if len(batch_symbols) == 0:
             raise Exception("No symbols to extract")
 
         self.symbols = batch_symbols
 
+    def _get_last_daily_data(self, sink, target_table, symbols):
+        response = sink.select_last_rows(target_table, "symbol", symbols)
+
+        return {
+            entry["symbol"]: {
+                "date": entry["date"],
+                "close": entry["close"],
+                "volume": entry["volume"],
+                "market_cap": entry["market_cap"],
+                "mcap_method": entry["mcap_method"],
+            }
+            for entry in response
+        }
+
+    def _get_last_dates(self, sink, target_table, symbols):
+        response = sink.select_last_dates(
+            target_table, "stock_id", [self.symbol_id_map[s] for s in symbols]
+        )
+        id_symbol_map = {v: k for k, v in self.symbol_id_map.items()}
+
+        return {id_symbol_map[row["stock_id"]]: row["last_date"] for row in response}
+
+    def _get_stored_key_stats(self, sink, target_table, symbols):
+        response = sink.select_in(
+            target_table,
+            ["stock_id", "forward_eps"],
+            "stock_id",
+            [self.symbol_id_map[s] for s in symbols],
+        )
+        id_symbol_map = {v: k for k, v in self.symbol_id_map.items()}
+
+        return {id_symbol_map[row["stock_id"]]: row for row in response}
+
     def _batch_upsert(
-            self, neon_connector, target_table, records, on_conflict, batch_size=25, max_retry=3
-        ):
-            if not records:
-                print("No records to upsert")
-            else:
-                for i in range(0, len(records), batch_size):
-                    retry_count = 0
-                    while retry_count < max_retry:
-                        try:
-                            neon_connector.batch_upsert(target_table, records[i : i + batch_size], conflict_columns=on_conflict)
-                            break
-                        except Exception as e:
-                            retry_count += 1
-                            if retry_count == max_retry:
-                                raise e
-                            time.sleep(3)
-
-                print(f"Successfully upserted {len(records)} records to {target_table}")
+        self, db_client, target_table, records, on_conflict, batch_size=25, max_retry=3
+    ):
+        sink = self._as_sink(db_client)
+        if not records or not self.bulk_load or not isinstance(sink, NeonSink):
+            return super()._batch_upsert(
+                sink, target_table, records, on_conflict, batch_size, max_retry
+            )
+
+        retry_count = 0
+        while retry_count < max_retry:
+            try:
+                row_count = sink.copy_upsert(target_table, records, on_conflict)
+                break
+            except Exception as e:
+                retry_count += 1
+                if retry_count == max_retry:
+                    raise e
+                time.sleep(3)
+
+        print(f"Successfully bulk loaded {row_count} records to {target_table}")
 
     def upsert_data_to_db(
-        self, neon_connector, target_table, batch_size=100, batch_num=1
+        self, db_client, target_table, batch_size=100, batch_num=1, extract_symbols=True
     ):
         """Upserts data to the target table in the database
 
         Args:
-            neon_connector (NeonConnector): Neon connector instance
+            db_client (StorageSink or NeonConnector): Storage sink, or a Neon connector instance
             target_table (str): Target table name
             batch_size (int, optional): Number of symbols to extract. Defaults to 100. If batch_size is set to -1, all symbols will be extracted.
             batch_num (int, optional): Batch number. Defaults to 1.
+            extract_symbols (bool, optional): Whether to extract the batch's symbols first. Defaults to True, False keeps the current symbols.
         """
+        sink = self._as_sink(db_client)
 
-        try:
-            neon_connector.select_query(f"SELECT * FROM {target_table} LIMIT 1")
-        except Exception as e:
+        if not sink.table_exists(target_table):
             print(f"Table {target_table} does not exist")
             return
 
-        self.extract_symbols_from_db(
-                neon_connector, batch_size, batch_num, 
-            )
+        self._start_run(target_table, batch_size, batch_num)
 
-        if "daily_data" in target_table:
-            response = neon_connector.select_query("SELECT * from get_last_daily_data()")
-            
-            last_daily_data = {
-                entry["symbol"]: {
-                    "date": entry["date"].strftime("%Y-%m-%d"),
-                    "close": entry["close"],
-                    "volume": entry["volume"],
-                    "market_cap": entry["market_cap"],
-                    "mcap_method": entry["mcap_method"],
-                }
-                for entry in response
-            }
-            self.create_daily_data_records(last_daily_data)
-            records = self.new_records["daily_data"]
-            
-            for rec in records:
-                rec['stock_id'] = self.symbol_id_map[rec['symbol']]
-                del rec['symbol']
+        try:
+            if extract_symbols:
+                self.extract_symbols_from_db(
+                        sink, batch_size, batch_num, 
+                    )
+            self.run_stats.lap("extract_symbols")
+
+            if "daily_data" in target_table:
+                last_daily_data = self._get_last_state(
+                    target_table,
+                    lambda: self._get_max_updated_on(sink, target_table),
+                    lambda symbols: self._get_last_daily_data(sink, target_table, symbols),
+                )
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(
+                    target_table,
+                    batch_num,
+                    {symbol: datum["date"] for symbol, datum in last_daily_data.items()},
+                )
+                self.create_daily_data_records(last_daily_data)
+                records = self._skip_unchanged_records(
+                    target_table, self.new_records["daily_data"], last_daily_data
+                )
+                records.map_symbols('stock_id', self.symbol_id_map)
                 
-            on_conflict = ['stock_id', 'date']
-            
-
-        elif "key_stats" in target_table:
-            self.create_key_stats_records()
-            records = self.new_records["key_stats"]
-            
-            for rec in records:
-                rec['stock_id'] = self.symbol_id_map[rec['symbol']]
-                del rec['symbol']
-                rec['holders_breakdown'] = json.dumps(rec['holders_breakdown'])
+                on_conflict = self.ON_CONFLICT["daily_data"]
+            
+
+            elif "key_stats" in target_table:
+                stored_key_stats = self._get_stored_key_stats(
+                    sink, target_table, self.symbols
+                )
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(target_table, batch_num)
+                self.create_key_stats_records()
+                records = self._skip_unchanged_records(
+                    target_table, self.new_records["key_stats"], stored_key_stats
+                )
+                self.new_records["key_stats"] = records
+            
+                for rec in records:
+                    rec['stock_id'] = self.symbol_id_map[rec['symbol']]
+                    del rec['symbol']
+                    rec['holders_breakdown'] = json.dumps(rec['holders_breakdown'])
                 
-            on_conflict = ["stock_id"]
+                on_conflict = self.ON_CONFLICT["key_stats"]
             
 
-        elif "dividend" in target_table:
-            response = neon_connector.select_query("SELECT * FROM get_last_date('dividend')")
-            
-            last_dividend_dates_temp = {
-                row["stock_id"]: row["last_date"].strftime("%Y-%m-%d") for row in response
-            }
-            id_symbol_map = {v: k for k, v in self.symbol_id_map.items()}
-            
-            last_dividend_dates = {}
-            for stock_id in last_dividend_dates_temp:
-                symbol = id_symbol_map[stock_id]
-                last_dividend_dates[symbol] = last_dividend_dates_temp[stock_id]
+            elif "dividend" in target_table:
+                last_dividend_dates = self._get_last_state(
+                    target_table,
+                    lambda: self._get_max_updated_on(sink, target_table),
+                    lambda symbols: self._get_last_dates(sink, target_table, symbols),
+                )
 
-            del last_dividend_dates_temp
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(target_table, batch_num, last_dividend_dates)
+                self.create_dividend_records(last_dividend_dates)
+                records = self.new_records["dividend"]
             
-            self.create_dividend_records(last_dividend_dates)
-            records = self.new_records["dividend"]
-            
-            for rec in records:
-                rec['stock_id'] = self.symbol_id_map[rec['symbol']]
-                del rec['symbol']
+                for rec in records:
+                    rec['stock_id'] = self.symbol_id_map[rec['symbol']]
+                    del rec['symbol']
                 
-            on_conflict = ['stock_id', 'date']
+                on_conflict = self.ON_CONFLICT["dividend"]
             
 
-        elif "financials" in target_table:
-            if "quarterly" in target_table:
-                quarterly = True
-                period = "quarterly"
-            elif "annual" in target_table:
-                quarterly = False
-                period = "annual"
-            else:
-                raise Exception("Invalid table name")
-
-            # get_outdated_symbols function has two parameters: table_name and source (1 indicates YF API)
-            response = neon_connector.select_query(f"SELECT * FROM get_outdated_symbols('{target_table}', 1)")
-            
-            last_financial_dates = {
-                row["symbol"]: row["last_date"] for row in response
-            }
-            
-            self.symbols = [s for s in self.symbols if s in last_financial_dates]
+            elif "financials" in target_table:
+                if "quarterly" in target_table:
+                    quarterly = True
+                    period = "quarterly"
+                elif "annual" in target_table:
+                    quarterly = False
+                    period = "annual"
+                else:
+                    raise Exception("Invalid table name")
 
-            # response = (
-            #     supabase_client.table("idx_active_company_profile")
-            #     .select("symbol", "wsj_format")
-            #     .execute()
-            # )
-            
-            # hard code wsj_format for now
-            wsj_formats = {symbol: 1 for symbol in self.symbols}
+                response = sink.select_outdated_symbols(target_table, self.symbols)
             
-            self.create_financials_records(
-                quarterly=quarterly,
-                last_financial_dates=last_financial_dates,
-                wsj_formats=wsj_formats,
-            )
-            records = self.new_records["financials"][period]
+                last_financial_dates = {
+                    row["symbol"]: row["last_date"] for row in response
+                }
             
-            for rec in records:
-                rec['stock_id'] = self.symbol_id_map[rec['symbol']]
-                del rec['symbol']
+                self.symbols = [s for s in self.symbols if s in last_financial_dates]
+                self.run_stats.lap("last_state")
+                self._order_by_staleness(target_table, batch_num, last_financial_dates)
+
+                # response = (
+                #     supabase_client.table("idx_active_company_profile")
+                #     .select("symbol", "wsj_format")
+                #     .execute()
+                # )
+            
+                # hard code wsj_format for now
+                wsj_formats = {symbol: 1 for symbol in self.symbols}
+            
+                self.create_financials_records(
+                    quarterly=quarterly,
+                    last_financial_dates=last_financial_dates,
+                    wsj_formats=wsj_formats,
+                )
+                records = self.new_records["financials"][period]
+            
+                for rec in records:
+                    rec['stock_id'] = self.symbol_id_map[rec['symbol']]
+                    del rec['symbol']
                 
-            on_conflict = ["stock_id", "date"]
-            
-        
-        self._batch_upsert(neon_connector, target_table, records, on_conflict)
+                on_conflict = self.ON_CONFLICT["financials"]
+        except Exception as e:
+            self._fail_run(sink, e)
+            raise e
+
+        self._finish_upsert(
+            sink,
+            target_table,
+            records,
+            batch_num,
+            lambda: self._batch_upsert(sink, target_table, records, on_conflict),
+            # financials symbols come from get_outdated_symbols, which is not mirrored
+            update_state="financials" not in target_table,
+        )
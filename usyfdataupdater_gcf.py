@@ -5,7 +5,10 @@ import pandas as pd
 from dotenv import load_dotenv
 from neon_connector.neon_connector import NeonConnector
 
+from neon_pool import PooledNeonConnector
+from run_profiler import RunProfiler
 from usyfdataupdater import USYFDataUpdater
+from work_queue import DEFAULT_LEASE_SIZE, open_work_queue
 
 # In GCF, the main function should accept a request object
 # def main(request):
@@ -15,17 +18,84 @@ def main(request_dict):
     target_table = request_dict.get("target_table", "")
     batch_size = request_dict.get("batch_size", 100)
     batch_num = request_dict.get("batch_num", "")
+    max_workers = request_dict.get("max_workers", 1)
+    # e.g. /tmp/yf_session.json, shared by the invocations running on the instance
+    yf_session = request_dict.get("yf_session")
+    # e.g. /tmp/profile, a directory for per stage profiles of the invocation
+    profile = request_dict.get("profile")
+    trace_allocations = request_dict.get("trace_allocations", False)
+    # "all", "incremental", "backfill" or "split" (incremental, then backfill; default), see set_daily_lane
+    daily_lane = request_dict.get("daily_lane", "split")
+    backfill_workers = request_dict.get("backfill_workers", 1)
+    # worker processes of the record transforms, 1 transforms in the invocation's process
+    transform_workers = request_dict.get("transform_workers", 1)
+    # False fetches the daily data of symbols already up to date with the last trading session
+    trading_calendar = request_dict.get("trading_calendar", True)
+    # PostgreSQL connection string or SQLite path of a shared work queue; when set, symbols are
+    # claimed in leases from the queue instead of taking the batch_num slice, see upsert_from_work_queue
+    work_queue = request_dict.get("work_queue")
+    # job of the work queue, the same for every invocation working on it
+    queue_job = request_dict.get(
+        "queue_job", f"{target_table}:{pd.Timestamp.now(tz='America/New_York').strftime('%Y-%m-%d')}"
+    )
+    lease_size = request_dict.get("lease_size", DEFAULT_LEASE_SIZE)
+    bulk_load = request_dict.get("bulk_load", False)
+    db_workers = request_dict.get("db_workers", 1)
 
-    if not target_table or not batch_num:
+    if not target_table or not (batch_num or work_queue):
         return "Missing required parameters: target_table and batch_num", 400
     
     load_dotenv()
     connection_string = os.getenv('NEON_DATABASE_URL')
-    neon_connector = NeonConnector(connection_string)
+    if db_workers > 1:
+        neon_connector = PooledNeonConnector(connection_string, max_connections=db_workers)
+    else:
+        neon_connector = NeonConnector(connection_string)
 
-    updater = USYFDataUpdater()
-    updater.upsert_data_to_db(neon_connector, target_table, batch_size, batch_num)
+    updater = USYFDataUpdater(bulk_load=bulk_load, max_workers=max_workers)
+    if yf_session:
+        updater.set_session_store(yf_session)
+    updater.set_daily_lane("incremental" if daily_lane == "split" else daily_lane, backfill_workers)
+    if not trading_calendar:
+        updater.set_trading_calendar(None)
+    if transform_workers > 1:
+        updater.set_transform_pool(transform_workers)
+    profiler = None
+    if profile:
+        profiler = RunProfiler(profile, trace_allocations=trace_allocations)
+        profiler.instrument(updater)
+        profiler.start()
 
+    def log_failed_lease(failed_table, e):
+        # like the scripts' save_records, a failed lease is handed back to the queue and the next one is taken;
+        # its records are not staged, the function's filesystem does not outlive the invocation
+        print(f"Failed to upsert {failed_table} of lease {updater.lease_num}:", e)
+
+    def upsert(job_suffix=""):
+        if not work_queue:
+            updater.upsert_data_to_db(neon_connector, target_table, batch_size, batch_num)
+            return
+
+        queue = open_work_queue(work_queue, queue_job + job_suffix, lease_size)
+        try:
+            updater.upsert_from_work_queue(neon_connector, [target_table], queue, on_error=log_failed_lease)
+        finally:
+            queue.close()
+
+    try:
+        upsert()
+        if daily_lane == "split" and "daily_data" in target_table:
+            updater.set_daily_lane("backfill", backfill_workers)
+            upsert(":backfill")
+    finally:
+        updater.close_transform_pool()
+        if db_workers > 1:
+            neon_connector.close()
+        if profiler is not None:
+            profiler.stop()
+
+    metrics = updater.get_request_metrics()
+    print(f"YF API requests issued: {metrics['issued']}, coalesced: {metrics['coalesced']}")
     return f"Successfully upserted {target_table} table. The following data weren't updated due to errors: {updater.unadded_data}"
 
 if __name__ == "__main__":
@@ -0,0 +1,308 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Symbols per lease, small so a slow lease (e.g. one of new listings needing backfills) cannot hold up the job
+DEFAULT_LEASE_SIZE = 20
+# Seconds a lease is held without renewal before other workers may reclaim it
+DEFAULT_LEASE_SECONDS = 300
+# Claims of a symbol after which it is no longer handed out, so a symbol crashing its workers cannot stall the job
+MAX_ATTEMPTS = 3
+# Table of the queued symbols, shared by the jobs of every updater
+WORK_QUEUE_TABLE = "symbol_work_queue"
+# Seconds between checks for expired leases once no symbol is left to claim
+IDLE_POLL_SECONDS = 10
+# Symbols per IN (...) filter when completing or releasing symbols
+IN_CHUNK_SIZE = 500
+
+
+class WorkQueue:
+    """Shared queue of the symbols of a job, handed out to workers in small leases
+
+    Instead of a fixed batch_size/batch_num slice, every worker (GitHub
+    runner or GCF instance) seeds the job's symbols once and then claims a
+    lease of a few symbols at a time until none are left, so faster workers
+    simply take more leases. A claim skips the symbols other workers hold,
+    and a lease is renewed while its worker runs; the symbols of a worker
+    that dies become claimable again once its lease expires.
+
+    Lease expiry is compared in the workers' clocks (epoch seconds), which
+    only have to agree to well within the lease duration.
+    """
+
+    # appended to the claim's row selection by backends that lock rows
+    LOCK_CLAUSE = ""
+
+    def __init__(self, job, lease_size=DEFAULT_LEASE_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Args:
+            job (str): Name of the job, shared by all of its workers, e.g. "idx_daily_data:2025-01-02"
+            lease_size (int, optional): Symbols per lease. Defaults to DEFAULT_LEASE_SIZE.
+            lease_seconds (float, optional): Seconds a lease lasts without renewal. Defaults to DEFAULT_LEASE_SECONDS.
+        """
+        self.job = job
+        self.lease_size = lease_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_id = None
+        self._lock = threading.Lock()
+
+    def _execute(self, query, params=()):
+        """Runs query in its own transaction and returns the rows it returns"""
+        raise NotImplementedError
+
+    def _execute_many(self, query, rows):
+        raise NotImplementedError
+
+    def _create_table(self):
+        self._execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {WORK_QUEUE_TABLE} (
+                job TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                lease_id TEXT,
+                leased_until DOUBLE PRECISION,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                done_at DOUBLE PRECISION,
+                PRIMARY KEY (job, symbol)
+            )
+            """
+        )
+
+    def _update_symbols(self, assignments, params, symbols, leased_only=False):
+        """Runs SET assignments on the job's symbols, only those of the current lease if leased_only"""
+        condition = "AND lease_id = ? " if leased_only else ""
+        for i in range(0, len(symbols), IN_CHUNK_SIZE):
+            chunk = list(symbols[i : i + IN_CHUNK_SIZE])
+            self._execute(
+                f"UPDATE {WORK_QUEUE_TABLE} SET {assignments} "
+                f"WHERE job = ? {condition}AND symbol IN ({', '.join('?' for _ in chunk)})",
+                params + [self.job] + ([self.lease_id] if leased_only else []) + chunk,
+            )
+
+    def seed(self, symbols):
+        """Adds the job's symbols, in the order they are handed out, unless the job already has them
+
+        Every worker may call this; symbols already queued keep their state,
+        so a re-run of the job only works on the symbols not done yet.
+        """
+        rows = self._execute(f"SELECT 1 FROM {WORK_QUEUE_TABLE} WHERE job = ? LIMIT 1", [self.job])
+        if rows:
+            return
+
+        self._execute_many(
+            f"INSERT INTO {WORK_QUEUE_TABLE} (job, symbol, position) VALUES (?, ?, ?) "
+            "ON CONFLICT (job, symbol) DO NOTHING",
+            [(self.job, symbol, position) for position, symbol in enumerate(symbols)],
+        )
+        print(f"Seeded {len(symbols)} symbols to work queue job {self.job}")
+
+    def claim(self):
+        """Leases up to lease_size symbols that are neither done nor held by a live lease
+
+        Returns:
+            list: Leased symbols, empty when the job has none left to hand out
+        """
+        self.lease_id = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        rows = self._execute(
+            f"""
+            UPDATE {WORK_QUEUE_TABLE}
+            SET lease_id = ?, leased_until = ?, attempts = attempts + 1
+            WHERE job = ? AND symbol IN (
+                SELECT symbol FROM {WORK_QUEUE_TABLE}
+                WHERE job = ? AND done_at IS NULL AND attempts < ?
+                    AND (leased_until IS NULL OR leased_until < ?)
+                ORDER BY position
+                LIMIT ?
+                {self.LOCK_CLAUSE}
+            )
+            RETURNING symbol, position
+            """,
+            [
+                self.lease_id,
+                now + self.lease_seconds,
+                self.job,
+                self.job,
+                MAX_ATTEMPTS,
+                now,
+                self.lease_size,
+            ],
+        )
+        return [row[0] for row in sorted(rows, key=lambda row: row[1])]
+
+    def renew(self):
+        """Extends the current lease, returns False if it expired and was claimed by another worker"""
+        rows = self._execute(
+            f"UPDATE {WORK_QUEUE_TABLE} SET leased_until = ? "
+            "WHERE job = ? AND lease_id = ? AND done_at IS NULL RETURNING symbol",
+            [time.time() + self.lease_seconds, self.job, self.lease_id],
+        )
+        return len(rows) > 0
+
+    def complete(self, symbols):
+        """Marks symbols done, also if their lease was meanwhile reclaimed"""
+        self._update_symbols("done_at = ?, lease_id = NULL, leased_until = NULL", [time.time()], symbols)
+
+    def release(self, symbols, count_attempt=False):
+        """Hands symbols of the current lease back to the queue
+
+        Args:
+            symbols (list): Symbols of the current lease
+            count_attempt (bool, optional): Whether the claim counts towards MAX_ATTEMPTS, for failed symbols.
+                Defaults to False, for symbols that were not worked on, e.g. deferred ones.
+        """
+        assignments = "lease_id = NULL, leased_until = NULL"
+        if not count_attempt:
+            assignments += ", attempts = attempts - 1"
+        self._update_symbols(assignments, [], symbols, leased_only=True)
+
+    def get_progress(self):
+        """Returns the job's symbol counts: done, leased, pending and given up (claimed MAX_ATTEMPTS times)"""
+        now = time.time()
+        rows = self._execute(
+            f"""
+            SELECT
+                SUM(CASE WHEN done_at IS NOT NULL THEN 1 ELSE 0 END),
+                SUM(CASE WHEN done_at IS NULL AND leased_until >= ? THEN 1 ELSE 0 END),
+                SUM(CASE WHEN done_at IS NULL AND attempts < ? AND (leased_until IS NULL OR leased_until < ?) THEN 1 ELSE 0 END),
+                SUM(CASE WHEN done_at IS NULL AND attempts >= ? AND (leased_until IS NULL OR leased_until < ?) THEN 1 ELSE 0 END)
+            FROM {WORK_QUEUE_TABLE} WHERE job = ?
+            """,
+            [now, MAX_ATTEMPTS, now, MAX_ATTEMPTS, now, self.job],
+        )
+        done, leased, pending, given_up = [int(value or 0) for value in rows[0]]
+        return {"done": done, "leased": leased, "pending": pending, "given_up": given_up}
+
+    def _renew_until(self, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.renew():
+                    print(f"Lease {self.lease_id} of job {self.job} expired and was reclaimed")
+                    return
+            except Exception as e:
+                # a missed renewal only matters once the lease expires
+                print(f"Failed to renew lease {self.lease_id}: {e}")
+
+    def leases(self):
+        """Yields the symbols of one lease at a time until every symbol of the job is done or given up
+
+        The lease is renewed in the background while the caller works on it.
+        The caller completes or releases the symbols before taking the next
+        lease; symbols it leaves are reclaimed once the lease expires. With
+        nothing left to claim, this waits while other workers hold leases, to
+        take over the ones of a worker that died.
+        """
+        while True:
+            symbols = self.claim()
+            if not symbols:
+                if self.get_progress()["leased"] == 0:
+                    return
+                time.sleep(min(IDLE_POLL_SECONDS, self.lease_seconds))
+                continue
+
+            stop = threading.Event()
+            renewer = threading.Thread(target=self._renew_until, args=(stop,), daemon=True)
+            renewer.start()
+            try:
+                yield symbols
+            finally:
+                stop.set()
+                renewer.join()
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    """Work queue in a SQLite file, for workers on one machine and for testing the queue locally
+
+    SQLite has no row locks: each claim is a single UPDATE, which holds the
+    database's write lock while it selects and leases its rows, so
+    concurrent claims are serialized rather than skipped over.
+    """
+
+    def __init__(self, path, job, lease_size=DEFAULT_LEASE_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS):
+        super().__init__(job, lease_size, lease_seconds)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # autocommit, every statement is its own transaction; busy writers wait for each other
+        self.connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self._create_table()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def _execute_many(self, query, rows):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(query, rows)
+            except Exception as e:
+                self.connection.execute("ROLLBACK")
+                raise e
+            self.connection.execute("COMMIT")
+
+    def close(self):
+        self.connection.close()
+
+
+class PostgresWorkQueue(WorkQueue):
+    """Work queue in a PostgreSQL table, e.g. on Neon or Supabase's database, shared by any number of workers
+
+    Claims select their rows with FOR UPDATE SKIP LOCKED, so concurrent
+    claims never wait on or double-lease each other's symbols.
+    """
+
+    LOCK_CLAUSE = "FOR UPDATE SKIP LOCKED"
+
+    def __init__(self, connection_string, job, lease_size=DEFAULT_LEASE_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS):
+        super().__init__(job, lease_size, lease_seconds)
+        # psycopg2 comes with the US requirements only
+        import psycopg2
+
+        self.connection = psycopg2.connect(connection_string)
+        self.connection.autocommit = True
+        self._create_table()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            with self.connection.cursor() as cursor:
+                cursor.execute(query.replace("?", "%s"), params)
+                return cursor.fetchall() if cursor.description else []
+
+    def _execute_many(self, query, rows):
+        from psycopg2.extras import execute_values
+
+        # one multi-row INSERT per page instead of a round trip per symbol
+        values_at = query.index("VALUES")
+        on_conflict_at = query.index("ON CONFLICT")
+        query = query[:values_at] + "VALUES %s " + query[on_conflict_at:]
+        with self._lock:
+            with self.connection.cursor() as cursor:
+                execute_values(cursor, query, rows, page_size=1000)
+
+    def close(self):
+        self.connection.close()
+
+
+def open_work_queue(location, job, lease_size=DEFAULT_LEASE_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Returns the work queue of a PostgreSQL connection string or a SQLite file path
+
+    Args:
+        location (str): "postgres://..." or "postgresql://..." connection string, or SQLite file path
+        job (str): Name of the job, shared by all of its workers
+        lease_size (int, optional): Symbols per lease. Defaults to DEFAULT_LEASE_SIZE.
+        lease_seconds (float, optional): Seconds a lease lasts without renewal. Defaults to DEFAULT_LEASE_SECONDS.
+    """
+    if location.startswith(("postgres://", "postgresql://")):
+        return PostgresWorkQueue(location, job, lease_size, lease_seconds)
+    return SqliteWorkQueue(location, job, lease_size, lease_seconds)
@@ -0,0 +1,157 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from yfinance.data import YfData
+
+
+class SharedYahooSession:
+    """Shares yfinance's Yahoo cookies and crumb between processes through a file
+
+    yfinance does the cookie/crumb handshake once per process, which Yahoo
+    throttles when many runners or GCF instances start together. Once
+    installed, the process takes the cookies and crumb from the file when they
+    are younger than max_age, and otherwise does the handshake while holding
+    an exclusive lock on the file, so concurrent processes wait for one
+    handshake and then reuse its result. When yfinance drops a crumb after a
+    failed request, the file is cleared if it still holds that crumb, so the
+    next process refreshes it once for everybody.
+    """
+
+    def __init__(self, path, max_age=12 * 60 * 60):
+        """
+        Args:
+            path (str): Path of the JSON file holding the session state
+            max_age (float, optional): Seconds after which the state is refreshed. Defaults to 12 hours.
+        """
+        self.path = path
+        self.max_age = max_age
+        # reentrant, as yfinance's handshake may call back into invalidate
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            self._lock_depth += 1
+            try:
+                if self._lock_depth > 1:
+                    yield
+                    return
+
+                with open(self.path + ".lock", "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                self._lock_depth -= 1
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not state or time.time() - state["saved_at"] > self.max_age:
+            return None
+        return state
+
+    def _write(self, state):
+        # written aside and renamed, so readers never see a partial file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def _get_jar(self, session):
+        # curl_cffi wraps its CookieJar, requests' RequestsCookieJar is one
+        return getattr(session.cookies, "jar", session.cookies)
+
+    def _apply(self, data, state):
+        for cookie in state["cookies"]:
+            data._session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie["domain"],
+                path=cookie["path"],
+            )
+        data._cookie_strategy = state["strategy"]
+        data._cookie = True
+        data._crumb = state["crumb"]
+
+    def _save(self, data, crumb, strategy):
+        cookies = [
+            {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+            }
+            for cookie in self._get_jar(data._session)
+            if "yahoo" in cookie.domain
+        ]
+        self._write(
+            {
+                "saved_at": time.time(),
+                "pid": os.getpid(),
+                "strategy": strategy,
+                "crumb": crumb,
+                "cookies": cookies,
+            }
+        )
+
+    def get_cookie_and_crumb(self, data, handshake, timeout=30):
+        """Returns (crumb, strategy) from the file, or from one handshake shared with other processes"""
+        with self._locked():
+            state = self._read()
+            if state is not None:
+                self._apply(data, state)
+                return state["crumb"], state["strategy"]
+
+            crumb, strategy = handshake(timeout)
+            if crumb:
+                self._save(data, crumb, strategy)
+                print(f"Refreshed the shared Yahoo session in {self.path}")
+            return crumb, strategy
+
+    def invalidate(self, crumb):
+        """Clears the file if it still holds a crumb yfinance has given up on"""
+        if crumb is None:
+            return
+
+        with self._locked():
+            state = self._read()
+            if state is not None and state["crumb"] == crumb:
+                self._write({})
+
+    def install(self):
+        """Routes yfinance's cookie and crumb handling through this store"""
+        data = YfData()
+        if getattr(data, "_shared_session", None) is not None:
+            return
+        data._shared_session = self
+
+        handshake = data._get_cookie_and_crumb
+        set_cookie_strategy = data._set_cookie_strategy
+
+        def get_cookie_and_crumb(timeout=30):
+            crumb = data._crumb
+            if crumb is not None:
+                return crumb, data._cookie_strategy
+            return self.get_cookie_and_crumb(data, handshake, timeout)
+
+        def switch_cookie_strategy(strategy, have_lock=False):
+            # called by yfinance when a request with the current crumb failed
+            self.invalidate(data._crumb)
+            return set_cookie_strategy(strategy, have_lock)
+
+        data._get_cookie_and_crumb = get_cookie_and_crumb
+        data._set_cookie_strategy = switch_cookie_strategy
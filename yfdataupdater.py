@@ -1,3 +1,10 @@
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import numpy as np
@@ -8,6 +15,24 @@ from bs4 import BeautifulSoup
 from pyrate_limiter import Duration, Limiter, RequestRate
 from requests import Session
 from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
+from yfinance.data import YfData
+
+from daily_data_buffer import DailyDataBuffer
+from financial_metrics import FINANCIALS_PLAN
+from record_staging import iter_staged_records, read_staged_target_table, stage_records
+from run_stats import RUN_STATS_TABLE, RunStats
+from single_flight import SingleFlight
+from state_store import LastStateStore
+from storage_sink import StorageSink
+from time_budget import TimeBudget
+from trading_calendar import TradingCalendar
+from transform_pool import TransformPool, iter_batches
+from transforms import (
+    transform_daily_batch,
+    transform_dividends_batch,
+    transform_financials_batch,
+)
+from yf_session_store import SharedYahooSession
 
 
 class LimiterSession(LimiterMixin, Session):
@@ -20,9 +45,51 @@ class LimiterSession(LimiterMixin, Session):
         )
 
 
+# Statement attributes fetched together for every symbol by create_financials_records
+FINANCIAL_STATEMENTS = ["income_stmt", "balance_sheet", "cashflow"]
+
+# Batch quote endpoint serving forwardEps and marketCap for many symbols per request
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+QUOTE_FIELDS = ["forwardEps", "marketCap", "earningsTimestamp"]
+QUOTE_BATCH_SIZE = 100
+
+# Months between financial periods, and the days after a period end within which
+# its statements are expected (IDX: quarterly within 1-2 months, annual by the end
+# of March). Symbols are checked from the min lag until a new period is stored,
+# past the max lag only by the rolling sweep.
+FINANCIALS_PERIOD_MONTHS = {"quarterly": 3, "annual": 12}
+FINANCIALS_MIN_LAG_DAYS = {"quarterly": 20, "annual": 45}
+FINANCIALS_MAX_LAG_DAYS = {"quarterly": 120, "annual": 180}
+# Every symbol is checked at least once per this many weeks by the rolling sweep
+FINANCIALS_SWEEP_WEEKS = 4
+
+# Daily data history of a new symbol is requested this many days at a time
+BACKFILL_CHUNK_DAYS = 365
+
+# Columns compared with the stored row by _skip_unchanged_records, see also
+# daily_data_buffer.CHANGE_COLUMNS
+KEY_STATS_CHANGE_COLUMNS = ["forward_eps"]
+# Relative tolerance of the key_stats comparisons, float4 columns keep ~7 significant digits
+CHANGE_TOLERANCE = 1e-6
+
+
 class YFDataUpdater:
-    def __init__(self, symbols=[]):
+    # on_conflict columns of _batch_upsert per table kind, set by subclasses
+    ON_CONFLICT = {}
+    # StorageSink class wrapping the exchange's database client, set by subclasses
+    DEFAULT_SINK = None
+    # whether create_financials_records also reads info's financialCurrency
+    FETCH_FINANCIAL_CURRENCY = False
+    # whether financials are only fetched for symbols due for a new period, see
+    # _select_due_financials_symbols
+    SELECT_DUE_FINANCIALS = False
+    # exchange of the TradingCalendar consulted by the daily data update
+    TRADING_CALENDAR = None
+
+    def __init__(self, symbols=[], max_workers=1):
         self.symbols = symbols
+        # number of symbols fetched from the YF API concurrently
+        self.max_workers = max_workers
         self._session = LimiterSession()
         self.new_records = {
             "key_stats": None,
@@ -32,6 +99,831 @@ class YFDataUpdater:
         }
         self.unadded_data = {}
         self._conversion_rates = {"USD_IDR": {}}
+        self.financial_currencies = {}
+        # per-run cache of YF API results and Tickers, enabled by prefetch_companies_data
+        self._yf_cache = None
+        self._tickers = None
+        # batch quotes per symbol, see _get_companies_quotes
+        self._quotes = {}
+        # concurrent requests for the same (symbol, attribute) share one YF API call
+        self._yf_requests = SingleFlight()
+        self._cache_hits = 0
+        self._metrics_lock = threading.Lock()
+        # ledger row of the current upsert_data_to_db run, see _start_run
+        self.run_stats = None
+        self._failed_symbols = set()
+        # set with set_time_budget, symbols left out once it is used up are deferred
+        self.time_budget = None
+        self.checkpoint_dir = None
+        self.deferred_symbols = []
+        self._deferred_lock = threading.Lock()
+        # optional local mirror of the last stored state, set with set_state_store
+        self.state_store = None
+        # which daily data symbols are fetched, set with set_daily_lane
+        self.daily_lane = "all"
+        self.backfill_workers = 1
+        # set with set_financials_sweep
+        self.financials_sweep_weeks = FINANCIALS_SWEEP_WEEKS
+        # set with set_trading_calendar
+        self.trading_calendar = (
+            TradingCalendar(self.TRADING_CALENDAR) if self.TRADING_CALENDAR else None
+        )
+        # worker processes of the transforms, set with set_transform_pool
+        self.transform_pool = None
+        # table writes running in the background while the next table is fetched
+        self._pipeline_writes = False
+        self._pending_writes = []
+        # number of the work queue lease being upserted, counted over the updater's leases
+        self.lease_num = 0
+        # symbols that failed or were deferred in any table of the current lease, see upsert_from_work_queue
+        self._lease_failed_symbols = None
+        self._lease_deferred_symbols = None
+
+    def _get_table_kind(self, target_table):
+        for table_kind in ["daily_data", "key_stats", "dividend", "financials"]:
+            if table_kind in target_table:
+                return table_kind
+
+        raise Exception("Invalid table name")
+
+    def _get_table_records(self, target_table):
+        table_kind = self._get_table_kind(target_table)
+
+        if table_kind == "financials":
+            if "quarterly" in target_table:
+                return self.new_records["financials"]["quarterly"]
+            elif "annual" in target_table:
+                return self.new_records["financials"]["annual"]
+            else:
+                raise Exception("Invalid table name")
+
+        return self.new_records[table_kind]
+
+    def stage_new_records(self, target_table, file_path):
+        """Saves the records created for the target table to a compressed Parquet file
+
+        Args:
+            target_table (str): Target table name
+            file_path (str): Destination path of the Parquet file
+        """
+        return stage_records(
+            self._get_table_records(target_table),
+            self._get_table_kind(target_table),
+            target_table,
+            file_path,
+        )
+
+    def replay_staged_records(self, db_client, target_table, file_path, batch_size=1000):
+        """Upserts records from a file written by stage_new_records
+
+        Args:
+            db_client: StorageSink, or a database client wrapped in DEFAULT_SINK
+            target_table (str): Target table name
+            file_path (str): Path of the staged Parquet file
+            batch_size (int, optional): Number of records read from the file at a time. Defaults to 1000.
+        """
+        staged_table = read_staged_target_table(file_path)
+        if staged_table and staged_table != target_table:
+            print(f"Warning: {file_path} was staged for {staged_table}, replaying to {target_table}")
+
+        on_conflict = self.ON_CONFLICT[self._get_table_kind(target_table)]
+        for records in iter_staged_records(file_path, batch_size):
+            self._batch_upsert(db_client, target_table, records, on_conflict)
+
+    def _get_table_attributes(self, target_table):
+        table_kind = self._get_table_kind(target_table)
+
+        if table_kind in ["key_stats", "daily_data"]:
+            # forwardEps and marketCap come from batch quotes, history depends on the last dates
+            return []
+        elif table_kind == "dividend":
+            return ["dividends"]
+        elif self._selects_due_financials():
+            # statements are only fetched for the symbols selected by upsert_data_to_db
+            return []
+        else:
+            prefix = "quarterly_" if "quarterly" in target_table else ""
+            attributes = [prefix + attribute for attribute in FINANCIAL_STATEMENTS]
+            if self.FETCH_FINANCIAL_CURRENCY:
+                attributes.append("info")
+            return attributes
+
+    def prefetch_companies_data(self, target_tables):
+        """Fetches the union of the YF attributes needed by the target tables, visiting each symbol once
+
+        The results and Tickers are kept for the following create_*_records calls
+        until clear_companies_data_cache is called.
+
+        Args:
+            target_tables (list): Target table names
+        """
+        attributes = []
+        for target_table in target_tables:
+            for attribute in self._get_table_attributes(target_table):
+                if attribute not in attributes:
+                    attributes.append(attribute)
+
+        if self._yf_cache is None:
+            self._yf_cache = {}
+            self._tickers = {}
+
+        quote_table_kinds = ["key_stats", "daily_data"]
+        if self._selects_due_financials():
+            quote_table_kinds.append("financials")
+        if any(
+            self._get_table_kind(target_table) in quote_table_kinds
+            for target_table in target_tables
+        ):
+            self._get_companies_quotes(self.symbols)
+
+        if not attributes:
+            return
+
+        def fetch(symbol):
+            ticker = self._get_ticker(symbol)
+            for attribute in attributes:
+                try:
+                    self._request_yf_api(symbol, attribute, ticker)
+                except:
+                    # left for the create_*_records call to retry and report
+                    pass
+
+        self._map_symbols(fetch, ", ".join(attributes))
+
+    def clear_companies_data_cache(self):
+        self._yf_cache = None
+        self._tickers = None
+        self._quotes = {}
+
+    def upsert_tables_to_db(
+        self, db_client, target_tables, batch_size=100, batch_num=1, on_error=None, extract_symbols=True
+    ):
+        """Upserts data to several target tables, fetching shared YF data once per symbol
+
+        Args:
+            db_client: Database client accepted by upsert_data_to_db
+            target_tables (list): Target table names
+            batch_size (int, optional): Number of symbols to extract. Defaults to 100. If batch_size is set to -1, all symbols will be extracted.
+            batch_num (int, optional): Batch number. Defaults to 1.
+            on_error (callable, optional): Called with (target_table, exception) when a table fails, the remaining tables are still updated. Defaults to None, which raises.
+            extract_symbols (bool, optional): Whether to extract the batch's symbols first. Defaults to True, False keeps the current symbols.
+        """
+        db_client = self._as_sink(db_client)
+        if extract_symbols:
+            self.extract_symbols_from_db(db_client, batch_size, batch_num)
+        self.prefetch_companies_data(target_tables)
+
+        symbols = self.symbols
+        # with a sink that can submit writes, a table is written while the next one is fetched
+        self._pipeline_writes = True
+        try:
+            for target_table in target_tables:
+                # a table may narrow self.symbols (e.g. to outdated financials)
+                self.symbols = symbols
+                try:
+                    self.upsert_data_to_db(
+                        db_client,
+                        target_table,
+                        batch_size,
+                        batch_num,
+                        extract_symbols=False,
+                    )
+                except Exception as e:
+                    if on_error is None:
+                        raise e
+                    on_error(target_table, e)
+            self.flush_writes(on_error)
+        finally:
+            self._pipeline_writes = False
+            self.clear_companies_data_cache()
+
+    def upsert_from_work_queue(self, db_client, target_tables, work_queue, on_error=None):
+        """Upserts data to the target tables for symbol leases claimed from a shared work queue
+
+        Replaces the static batch_size/batch_num slice: every worker seeds the
+        job with all symbols (once per job) and takes leases until none are
+        left. Only the symbols written to every table are completed. Symbols
+        that failed to be fetched, and all of a lease's symbols when one of its
+        tables failed, are handed back with the attempt counted, so another
+        claim retries them up to MAX_ATTEMPTS times. Symbols deferred by the
+        time budget are handed back without counting, and once the budget is
+        used up no further lease is claimed.
+
+        Args:
+            db_client: Database client accepted by upsert_data_to_db
+            target_tables (list): Target table names
+            work_queue (WorkQueue): Queue of the job, see work_queue.open_work_queue
+            on_error (callable, optional): See upsert_tables_to_db, self.lease_num is the failed lease. Defaults to None, which hands the lease back and raises.
+        """
+        db_client = self._as_sink(db_client)
+        self.extract_symbols_from_db(db_client, -1, 1)
+        work_queue.seed(self.symbols)
+
+        for symbols in work_queue.leases():
+            if self.time_budget is not None and not self.time_budget.can_start():
+                work_queue.release(symbols)
+                print("Time budget used up, no further leases are claimed")
+                break
+
+            self.lease_num += 1
+            print(f"Lease {self.lease_num} of job {work_queue.job}: {len(symbols)} symbols")
+            self.symbols = symbols
+            self._lease_failed_symbols = set()
+            self._lease_deferred_symbols = set()
+            failed_tables = []
+
+            def on_table_error(target_table, e):
+                failed_tables.append(target_table)
+                on_error(target_table, e)
+
+            try:
+                self.upsert_tables_to_db(
+                    db_client,
+                    target_tables,
+                    len(symbols),
+                    self.lease_num,
+                    on_table_error if on_error is not None else None,
+                    extract_symbols=False,
+                )
+            except Exception as e:
+                work_queue.release(symbols, count_attempt=True)
+                raise e
+            finally:
+                failed = self._lease_failed_symbols
+                deferred = self._lease_deferred_symbols
+                self._lease_failed_symbols = None
+                self._lease_deferred_symbols = None
+
+            if failed_tables:
+                failed = set(symbols)
+            deferred = deferred - failed
+            work_queue.complete(
+                [symbol for symbol in symbols if symbol not in failed and symbol not in deferred]
+            )
+            if deferred:
+                work_queue.release([symbol for symbol in symbols if symbol in deferred])
+            if failed:
+                print(f"{len(failed)} symbols of lease {self.lease_num} failed, handing them back for a retry")
+                work_queue.release([symbol for symbol in symbols if symbol in failed], count_attempt=True)
+
+        print(f"Work queue job {work_queue.job}: {work_queue.get_progress()}")
+
+    def _start_run(self, target_table, batch_size, batch_num):
+        """Starts the run_stats ledger row of an upsert_data_to_db run"""
+        self._failed_symbols = set()
+        # symbols deferred by an earlier table or lane pass are not this run's
+        self.deferred_symbols = []
+        self.run_stats = RunStats(
+            target_table, batch_size, batch_num, self.get_request_metrics()
+        )
+
+    def _fail_run(self, db_client, error):
+        """Writes the failed run_stats ledger row of a run that raised before its write"""
+        run_stats = self.run_stats
+        run_stats.lap("fetch")
+        run_stats.finish_fetch(
+            self.symbols,
+            self._failed_symbols,
+            self.deferred_symbols,
+            self.get_request_metrics(),
+        )
+        self._write_run_stats(db_client, run_stats, 0, error)
+
+    def _as_sink(self, db_client):
+        """Returns db_client as a StorageSink, wrapping a database client in DEFAULT_SINK"""
+        if isinstance(db_client, StorageSink):
+            return db_client
+        return self.DEFAULT_SINK(db_client)
+
+    def _get_max_updated_on(self, sink, target_table):
+        return sink.select_max_updated_on(target_table)
+
+    def _batch_upsert(
+        self, db_client, target_table, records, on_conflict, batch_size=25, max_retry=3
+    ):
+        if not records:
+            print("No records to upsert")
+            return
+
+        sink = self._as_sink(db_client)
+        chunks = sink.chunk_records(records, batch_size)
+
+        def upsert_chunk(chunk):
+            retry_count = 0
+            while retry_count < max_retry:
+                try:
+                    sink.upsert(target_table, chunk, on_conflict)
+                    break
+                except Exception as e:
+                    retry_count += 1
+                    if retry_count == max_retry:
+                        raise e
+                    time.sleep(3)
+
+        if sink.map is not None:
+            # chunks are written concurrently on the sink's connections
+            sink.map(upsert_chunk, chunks)
+        else:
+            for chunk in chunks:
+                upsert_chunk(chunk)
+
+        print(f"Successfully upserted {len(records)} records to {target_table}")
+
+    def _insert_run_stats(self, db_client, record):
+        self._as_sink(db_client).insert(RUN_STATS_TABLE, record)
+
+    def _write_run_stats(self, db_client, run_stats, rows_written, error=None):
+        if run_stats is None:
+            return
+
+        try:
+            self._insert_run_stats(db_client, run_stats.to_record(rows_written, error))
+        except Exception as e:
+            # the ledger never fails a run
+            print(f"Failed to write run stats of {run_stats.target_table}: {e}")
+
+    def _finish_upsert(self, db_client, target_table, records, batch_num, write, update_state=True):
+        """Runs write() and then records the table's progress and run stats
+
+        When several tables are upserted and the sink can submit writes (see
+        PooledNeonConnector), write() runs in the background and the progress
+        is recorded by flush_writes once it has succeeded.
+
+        Args:
+            db_client (StorageSink): Sink the records are written to
+            target_table (str): Target table name
+            records (list): Records written by write
+            batch_num (int): Batch number
+            write (callable): Upserts the records
+            update_state (bool, optional): Whether to advance the local state mirror. Defaults to True.
+        """
+        if self._lease_failed_symbols is not None:
+            self._lease_failed_symbols.update(self._failed_symbols)
+            self._lease_deferred_symbols.update(self.deferred_symbols)
+
+        run_stats = self.run_stats
+        if run_stats is not None:
+            run_stats.lap("fetch")
+            run_stats.finish_fetch(
+                self.symbols,
+                self._failed_symbols,
+                self.deferred_symbols,
+                self.get_request_metrics(),
+            )
+
+        def timed_write():
+            started = time.monotonic()
+            try:
+                write()
+            finally:
+                if run_stats is not None:
+                    run_stats.add_stage("upsert", time.monotonic() - started)
+
+        pending = (
+            db_client,
+            target_table,
+            records,
+            batch_num,
+            update_state,
+            list(self.deferred_symbols),
+            run_stats,
+        )
+
+        submit = getattr(db_client, "submit", None)
+        if not self._pipeline_writes or submit is None:
+            try:
+                timed_write()
+            except Exception as e:
+                self._write_run_stats(db_client, run_stats, 0, e)
+                raise e
+            self._complete_upsert(*pending)
+            return
+
+        self._pending_writes.append((pending, submit(timed_write)))
+
+    def _complete_upsert(
+        self, db_client, target_table, records, batch_num, update_state, deferred, run_stats
+    ):
+        if update_state:
+            self._update_last_state(target_table, records)
+        self._save_checkpoint(target_table, batch_num, deferred)
+        self._write_run_stats(db_client, run_stats, len(records) if records else 0)
+
+    def flush_writes(self, on_error=None):
+        """Waits for background writes, in submission order
+
+        Args:
+            on_error (callable, optional): Called with (target_table, exception) for a failed write. Defaults to None, which raises the first failure after waiting for all writes.
+        """
+        pending_writes, self._pending_writes = self._pending_writes, []
+        error = None
+
+        for pending, future in pending_writes:
+            db_client, target_table = pending[0], pending[1]
+            try:
+                future.result()
+            except Exception as e:
+                self._write_run_stats(db_client, pending[-1], 0, e)
+                if on_error is not None:
+                    on_error(target_table, e)
+                elif error is None:
+                    error = e
+                continue
+
+            self._complete_upsert(*pending)
+
+        if error is not None:
+            raise error
+
+    def set_time_budget(self, seconds, checkpoint_dir):
+        """Stops fetching new symbols when the run is projected to exceed the budget
+
+        Symbols are then ordered by staleness, and the symbols that were not
+        fetched are written to a checkpoint in checkpoint_dir so the next run
+        starts with them.
+
+        Args:
+            seconds (float): Time budget of the run, counted from now
+            checkpoint_dir (str): Directory of the checkpoint files
+        """
+        self.time_budget = TimeBudget(seconds)
+        self.checkpoint_dir = checkpoint_dir
+
+    def _get_checkpoint_path(self, target_table, batch_num):
+        # the backfill lane defers its own symbols
+        if self.daily_lane == "backfill" and self._get_table_kind(target_table) == "daily_data":
+            target_table = f"{target_table}_backfill"
+
+        return os.path.join(
+            self.checkpoint_dir, f"{target_table}_batch_{batch_num}_checkpoint.json"
+        )
+
+    def _order_by_staleness(self, target_table, batch_num, last_dates={}):
+        """Orders symbols so that a time-budgeted run fetches the stalest ones first
+
+        Symbols deferred by the previous run come first, then symbols without a
+        last date, then the rest by oldest last date. Ties keep the extraction order.
+
+        Args:
+            target_table (str): Target table name
+            batch_num (int): Batch number
+            last_dates (dict, optional): Last stored date per symbol. Defaults to {}.
+        """
+        if self.time_budget is None:
+            return
+
+        checkpoint_path = self._get_checkpoint_path(target_table, batch_num)
+        checkpoint_symbols = set()
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                checkpoint_symbols = set(json.load(f)["deferred_symbols"])
+
+        positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        def staleness(symbol):
+            last_date = last_dates.get(symbol)
+            return (
+                symbol not in checkpoint_symbols,
+                last_date is not None,
+                str(last_date or ""),
+                positions[symbol],
+            )
+
+        self.symbols = sorted(self.symbols, key=staleness)
+
+    def _save_checkpoint(self, target_table, batch_num, deferred_symbols=None):
+        if self.time_budget is None:
+            return
+
+        if deferred_symbols is None:
+            deferred_symbols = self.deferred_symbols
+
+        checkpoint_path = self._get_checkpoint_path(target_table, batch_num)
+        if deferred_symbols:
+            if not os.path.exists(self.checkpoint_dir):
+                os.makedirs(self.checkpoint_dir)
+
+            with open(checkpoint_path, "w") as f:
+                json.dump(
+                    {
+                        "target_table": target_table,
+                        "batch_num": batch_num,
+                        "saved_at": pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S"),
+                        "deferred_symbols": deferred_symbols,
+                    },
+                    f,
+                )
+            print(
+                f"Time budget used up, {len(deferred_symbols)} symbols deferred to {checkpoint_path}"
+            )
+        elif os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def set_state_store(self, path):
+        """Mirrors the last stored state per symbol in a local SQLite file
+
+        Args:
+            path (str): Path of the SQLite file
+        """
+        self.state_store = LastStateStore(path)
+
+    def set_daily_lane(self, lane, backfill_workers=1):
+        """Splits daily data updates into an incremental and a backfill lane
+
+        Symbols without stored daily data need five years of history, which a
+        few new listings can make dominate an incremental run. The
+        "incremental" lane leaves them out, the "backfill" lane fetches only
+        them, on backfill_workers threads, and "all" fetches both.
+
+        Args:
+            lane (str): "all", "incremental" or "backfill"
+            backfill_workers (int, optional): Number of symbols backfilled concurrently. Defaults to 1.
+        """
+        if lane not in ["all", "incremental", "backfill"]:
+            raise ValueError(f"Invalid daily data lane: {lane}")
+
+        self.daily_lane = lane
+        self.backfill_workers = backfill_workers
+
+    def _select_daily_lane_symbols(self, last_daily_data):
+        if self.daily_lane == "all":
+            return self.symbols
+
+        new_symbols = [symbol for symbol in self.symbols if symbol not in last_daily_data]
+        if self.daily_lane == "backfill":
+            print(f"Backfilling daily data of {len(new_symbols)} new symbols")
+            return new_symbols
+
+        if new_symbols:
+            print(f"{len(new_symbols)} new symbols are left for the backfill lane")
+        return [symbol for symbol in self.symbols if symbol in last_daily_data]
+
+    def set_trading_calendar(self, exchange):
+        """Sets the exchange calendar the daily data update skips up-to-date symbols with
+
+        Args:
+            exchange (str): "IDX" or "US", or None to fetch every symbol on every run
+        """
+        self.trading_calendar = TradingCalendar(exchange) if exchange else None
+
+    def _select_session_due_symbols(self, symbols, last_daily_data):
+        """Leaves out the symbols whose last stored row is on or after the last trading session
+
+        Their history cannot have new rows before the next session opens, so on
+        holidays and weekends a whole run makes no requests.
+        """
+        if self.trading_calendar is None:
+            return symbols
+
+        due_symbols = [
+            symbol
+            for symbol in symbols
+            if symbol not in last_daily_data
+            or not self.trading_calendar.is_up_to_date(last_daily_data[symbol]["date"])
+        ]
+        if len(due_symbols) < len(symbols):
+            last_session = self.trading_calendar.get_last_session()
+            print(
+                f"{len(symbols) - len(due_symbols)} of {len(symbols)} symbols are up to date "
+                f"with the {self.trading_calendar.exchange} session of {last_session}, skipping them"
+            )
+        return due_symbols
+
+    def set_financials_sweep(self, weeks):
+        """Sets how often every symbol is checked for new financials
+
+        Args:
+            weeks (int): Length of the rolling sweep in weeks, 1 or less checks every symbol on every run
+        """
+        self.financials_sweep_weeks = weeks
+
+    def _selects_due_financials(self):
+        return self.SELECT_DUE_FINANCIALS and self.financials_sweep_weeks > 1
+
+    def _select_due_financials_symbols(self, last_financial_dates, quarterly=False, now=None):
+        """Returns the symbols whose next financial period may be available
+
+        A symbol is due when it has no stored period, when its next period end
+        is between the min and max reporting lag ago, or when Yahoo's earnings
+        date shows results announced after that period end. The earnings date
+        only adds symbols: Yahoo moves it to the next announcement soon after
+        a company reports, so a future date does not mean the period is still
+        unreported. Symbols of this week's share of the rolling sweep are
+        always included, so every symbol is checked once per
+        financials_sweep_weeks.
+
+        Args:
+            last_financial_dates (dict): Last stored period end per symbol
+            quarterly (bool, optional): Whether quarterly periods are selected. Defaults to False.
+            now (pd.Timestamp, optional): Time of the selection. Defaults to the current time.
+
+        Returns:
+            list: Selected symbols, in the order of self.symbols
+        """
+        if not self._selects_due_financials():
+            return self.symbols
+
+        period = "quarterly" if quarterly else "annual"
+        if now is None:
+            now = pd.Timestamp.now()
+        sweep_week = now.to_period("W").ordinal % self.financials_sweep_weeks
+        period_offset = pd.DateOffset(months=FINANCIALS_PERIOD_MONTHS[period])
+        min_lag = pd.Timedelta(days=FINANCIALS_MIN_LAG_DAYS[period])
+        max_lag = pd.Timedelta(days=FINANCIALS_MAX_LAG_DAYS[period])
+        # earningsTimestamp of many symbols per request
+        quotes = self._get_companies_quotes(self.symbols)
+
+        def get_period_end(date):
+            return date + period_offset + pd.offsets.MonthEnd(0)
+
+        due_symbols = []
+        swept = 0
+        for symbol in self.symbols:
+            last_date = last_financial_dates.get(symbol)
+            if zlib.crc32(symbol.encode()) % self.financials_sweep_weeks == sweep_week:
+                due_symbols.append(symbol)
+                swept += 1
+                continue
+            if last_date is None:
+                due_symbols.append(symbol)
+                continue
+
+            # the latest period end after last_date whose min lag has passed, so
+            # symbols several periods behind are checked in each filing season
+            next_period_end = get_period_end(pd.Timestamp(last_date))
+            while get_period_end(next_period_end) + min_lag <= now:
+                next_period_end = get_period_end(next_period_end)
+
+            earnings_ts = quotes.get(symbol, {}).get("earningsTimestamp")
+            earnings_date = pd.Timestamp(earnings_ts, unit="s") if earnings_ts else None
+
+            if next_period_end + min_lag <= now <= next_period_end + max_lag:
+                due_symbols.append(symbol)
+            elif earnings_date is not None and next_period_end < earnings_date <= now:
+                due_symbols.append(symbol)
+
+        print(
+            f"{len(due_symbols)} of {len(self.symbols)} symbols are due for new {period} "
+            f"financials, {swept} of them in this week's share of the rolling sweep"
+        )
+        return due_symbols
+
+    def set_transform_pool(self, max_workers):
+        """Runs the daily data, dividend and financials transforms in worker processes
+
+        Fetch threads then hand raw payloads to the pool in batches and the
+        transforms scale across cores independently of the fetches. Close the
+        pool with close_transform_pool.
+
+        Args:
+            max_workers (int): Number of worker processes
+        """
+        self.transform_pool = TransformPool(max_workers)
+
+    def close_transform_pool(self):
+        if self.transform_pool is not None:
+            self.transform_pool.close()
+            self.transform_pool = None
+
+    def _transform_batches(self, func, payloads, *args):
+        """Returns func(batch, *args) of batches of payloads, one batch when there is no transform pool"""
+        if self.transform_pool is None:
+            return [func(list(payloads), *args)]
+        return self.transform_pool.map_batches(func, payloads, *args)
+
+    def set_session_store(self, path):
+        """Shares Yahoo cookies and crumb with the other updater processes on the host
+
+        Args:
+            path (str): Path of the shared session file
+        """
+        SharedYahooSession(path).install()
+
+    def _get_last_state(self, target_table, get_db_max_updated_on, read_from_db):
+        """Returns the last stored state of self.symbols, from the local mirror when it is in sync
+
+        Args:
+            target_table (str): Target table name
+            get_db_max_updated_on (callable): Returns max(updated_on) of the target table
+            read_from_db (callable): Reads the state of a list of symbols from the database
+
+        Returns:
+            dict: State per symbol
+        """
+        if self.state_store is None:
+            return read_from_db(self.symbols)
+
+        db_max_updated_on = get_db_max_updated_on()
+        if not self.state_store.is_in_sync(target_table, db_max_updated_on):
+            print(f"Local state of {target_table} is out of date, reloading it from the database")
+            self.state_store.reset(target_table, db_max_updated_on)
+
+        missing_symbols = self.state_store.get_missing_symbols(target_table, self.symbols)
+        if missing_symbols:
+            self.state_store.put_states(
+                target_table, read_from_db(missing_symbols), missing_symbols
+            )
+
+        return self.state_store.get_states(target_table, self.symbols)
+
+    def _update_last_state(self, target_table, records):
+        """Advances the local mirror with successfully upserted records"""
+        table_kind = self._get_table_kind(target_table)
+        if self.state_store is None or not records or table_kind == "key_stats":
+            return
+
+        # US records are keyed by stock_id once they are ready to upsert
+        id_symbol_map = {v: k for k, v in getattr(self, "symbol_id_map", {}).items()}
+
+        def get_symbol(record):
+            if "symbol" in record:
+                return record["symbol"]
+            return id_symbol_map[record["stock_id"]]
+
+        if table_kind == "daily_data":
+            if hasattr(records, "get_last_records"):
+                records = records.get_last_records()
+
+            states = {}
+            for record in records:
+                symbol = get_symbol(record)
+                if symbol not in states or record["date"] >= states[symbol]["date"]:
+                    states[symbol] = {
+                        key: record[key]
+                        for key in ["date", "close", "volume", "market_cap", "mcap_method"]
+                    }
+            get_date = lambda state: state["date"]
+        else:
+            states = {}
+            for record in records:
+                symbol = get_symbol(record)
+                states[symbol] = max(states.get(symbol, record["date"]), record["date"])
+            get_date = lambda state: state
+
+        max_updated_on = max(record["updated_on"] for record in records)
+        self.state_store.update_states(target_table, states, max_updated_on, get_date)
+
+    def _same_value(self, value, stored):
+        if value is None or value != value:
+            return stored is None or stored != stored
+        if stored is None or stored != stored:
+            return False
+        try:
+            return math.isclose(
+                float(value), float(stored), rel_tol=CHANGE_TOLERANCE, abs_tol=0
+            )
+        except (TypeError, ValueError):
+            return value == stored
+
+    def _skip_unchanged_records(self, target_table, records, stored):
+        """Removes records that would rewrite the stored values before they are upserted
+
+        Args:
+            target_table (str): Target table name
+            records (list | DailyDataBuffer): key_stats records or daily data rows, keyed by symbol
+            stored (dict): Stored values per symbol, the last row of each symbol for daily data
+
+        Returns:
+            list | DailyDataBuffer: Records to write
+        """
+        if self.run_stats is not None:
+            self.run_stats.lap("fetch")
+
+        if not records:
+            return records
+
+        if self._get_table_kind(target_table) == "daily_data":
+            skipped = records.drop_unchanged(stored)
+        else:
+            kept = []
+            for record in records:
+                stored_record = stored.get(record["symbol"])
+                if stored_record is None or not all(
+                    self._same_value(record.get(col), stored_record.get(col))
+                    for col in KEY_STATS_CHANGE_COLUMNS
+                ):
+                    kept.append(record)
+            skipped = len(records) - len(kept)
+            records = kept
+
+        print(f"Skipped {skipped} unchanged rows of {target_table}, writing {len(records)}")
+        if self.run_stats is not None:
+            self.run_stats.rows_skipped += skipped
+            self.run_stats.lap("change_detection")
+        return records
+
+    def _start_symbol(self, symbol):
+        """Returns the start time of a symbol's fetch, or None if it is deferred by the time budget"""
+        if self.time_budget is not None and not self.time_budget.can_start():
+            with self._deferred_lock:
+                if symbol not in self.deferred_symbols:
+                    self.deferred_symbols.append(symbol)
+            return None
+        return time.monotonic()
+
+    def _finish_symbol(self, started):
+        if self.time_budget is not None:
+            self.time_budget.record(time.monotonic() - started)
 
     def _cast_int(self, num):
         if pd.notna(num):
@@ -55,23 +947,197 @@ class YFDataUpdater:
 
         return records
 
-    def _request_yf_api(self, symbol, attribute):
-        ticker = yf.Ticker(symbol)  # , session=self._session)
-        data_dict = getattr(ticker, attribute)
-        if type(data_dict) in [pd.DataFrame, pd.Series]:
-            data_dict = data_dict.to_dict()
+    def _get_ticker(self, symbol):
+        if self._tickers is None:
+            return yf.Ticker(symbol)  # , session=self._session)
 
-        return data_dict
+        ticker = self._tickers.get(symbol)
+        if ticker is None:
+            ticker = yf.Ticker(symbol)  # , session=self._session)
+            self._tickers[symbol] = ticker
+        return ticker
+
+    def _count_cache_hits(self, n=1):
+        with self._metrics_lock:
+            self._cache_hits += n
+
+    def _request_yf_api(self, symbol, attribute, ticker=None):
+        if self._yf_cache is not None and (symbol, attribute) in self._yf_cache:
+            self._count_cache_hits()
+            return self._yf_cache[(symbol, attribute)]
+
+        def request():
+            # the call may have finished between the cache check and joining the flight
+            if self._yf_cache is not None and (symbol, attribute) in self._yf_cache:
+                return self._yf_cache[(symbol, attribute)]
+
+            data_dict = getattr(ticker or self._get_ticker(symbol), attribute)
+            if type(data_dict) in [pd.DataFrame, pd.Series]:
+                data_dict = data_dict.to_dict()
+
+            if self._yf_cache is not None:
+                self._yf_cache[(symbol, attribute)] = data_dict
+
+            return data_dict
+
+        return self._yf_requests.do((symbol, attribute), request)
+
+    def _request_yf_history(self, ticker, start, end=None):
+        # goes through the single flight too, so history requests are counted
+        return self._yf_requests.do(
+            (ticker.ticker, "history", start, end),
+            lambda: ticker.history(start=start, end=end, auto_adjust=False),
+        )
+
+    def _request_yf_history_chunked(self, ticker, start, chunk_days=BACKFILL_CHUNK_DAYS):
+        """Requests the history since start chunk_days at a time, for long backfills"""
+        end = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+        chunk_start = pd.Timestamp(start)
+        chunks = []
+        while chunk_start < end:
+            # end is exclusive, so the chunks do not overlap
+            chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days), end)
+            chunks.append(
+                self._request_yf_history(
+                    ticker, chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")
+                )
+            )
+            chunk_start = chunk_end
+
+        non_empty_chunks = [chunk for chunk in chunks if len(chunk) > 0]
+        if not non_empty_chunks:
+            return chunks[-1]
+
+        data = pd.concat(non_empty_chunks)
+        return data[~data.index.duplicated(keep="last")]
+
+    def get_request_metrics(self):
+        """Returns the number of issued YF API requests, of requests coalesced into them and of cache hits"""
+        metrics = self._yf_requests.get_metrics()
+        with self._metrics_lock:
+            metrics["cache_hits"] = self._cache_hits
+        return metrics
+
+    def _map_symbols(self, func, description, symbols=None):
+        """Calls func(symbol) for every symbol, on max_workers threads
+
+        Args:
+            func (callable): Called with each symbol
+            description (str): What func retrieves, for the failure message
+            symbols (list, optional): Symbols to call func for. Defaults to None, which uses self.symbols.
+
+        Returns:
+            dict: Result per symbol. Symbols for which func raised are left out.
+        """
+
+        def fetch(symbol):
+            started = self._start_symbol(symbol)
+            if started is None:
+                return symbol, None, False
 
-    def _get_companies_data(self, attribute):
-        companies_data_dict = {}
-        for symbol in self.symbols:
             try:
-                data_dict = self._request_yf_api(symbol, attribute)
-                companies_data_dict[symbol] = data_dict
+                return symbol, func(symbol), True
             except:
-                print(f"Failed to retrieve {symbol}'s {attribute} from YF API.")
-        return companies_data_dict
+                print(f"Failed to retrieve {symbol}'s {description} from YF API.")
+                with self._metrics_lock:
+                    self._failed_symbols.add(symbol)
+                return symbol, None, False
+            finally:
+                self._finish_symbol(started)
+
+        if symbols is None:
+            symbols = self.symbols
+
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(fetch, symbols))
+        else:
+            results = [fetch(symbol) for symbol in symbols]
+
+        return {symbol: data for symbol, data, ok in results if ok}
+
+    def _get_companies_data(self, attribute, symbols=None):
+        return self._map_symbols(
+            lambda symbol: self._request_yf_api(symbol, attribute), attribute, symbols
+        )
+
+    def _request_yf_quotes(self, symbols):
+        """Requests the QUOTE_FIELDS of several symbols from the batch quote endpoint"""
+
+        def request():
+            response = YfData().get_raw_json(
+                QUOTE_URL,
+                params={"symbols": ",".join(symbols), "fields": ",".join(QUOTE_FIELDS)},
+            )
+            return {
+                quote["symbol"]: quote for quote in response["quoteResponse"]["result"]
+            }
+
+        return self._yf_requests.do(("quote", tuple(symbols)), request)
+
+    def _get_companies_quotes(self, symbols):
+        """Returns the batch quote of each symbol, requesting QUOTE_BATCH_SIZE symbols at a time
+
+        Quotes are kept until clear_companies_data_cache. Symbols left out by
+        Yahoo, or in a failed batch, are missing from the result so callers
+        can fall back to the symbol's info.
+        """
+        missing_symbols = [symbol for symbol in symbols if symbol not in self._quotes]
+        self._count_cache_hits(len(symbols) - len(missing_symbols))
+        batches = [
+            missing_symbols[i : i + QUOTE_BATCH_SIZE]
+            for i in range(0, len(missing_symbols), QUOTE_BATCH_SIZE)
+        ]
+
+        def fetch(batch):
+            try:
+                return self._request_yf_quotes(batch)
+            except Exception as e:
+                print(f"Failed to retrieve quotes of {len(batch)} symbols from YF API: {e}")
+                return {}
+
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(fetch, batches))
+        else:
+            results = [fetch(batch) for batch in batches]
+
+        for quotes in results:
+            self._quotes.update(quotes)
+
+        return {symbol: self._quotes[symbol] for symbol in symbols if symbol in self._quotes}
+
+    def _request_yf_statements(self, symbol, quarterly=False, include_currency=False):
+        # one Ticker serves all statements of a symbol
+        ticker = self._get_ticker(symbol)
+        prefix = "quarterly_" if quarterly else ""
+
+        statements = {}
+        for attribute in FINANCIAL_STATEMENTS:
+            try:
+                statements[attribute] = self._request_yf_api(
+                    symbol, prefix + attribute, ticker
+                )
+            except:
+                print(f"Failed to retrieve {symbol}'s {prefix + attribute} from YF API.")
+
+        if include_currency:
+            try:
+                statements["financialCurrency"] = self._request_yf_api(
+                    symbol, "info", ticker
+                ).get("financialCurrency")
+            except:
+                print(f"Failed to retrieve {symbol}'s info from YF API.")
+
+        return statements
+
+    def _get_companies_statements(self, quarterly=False, include_currency=False):
+        return self._map_symbols(
+            lambda symbol: self._request_yf_statements(
+                symbol, quarterly, include_currency
+            ),
+            "financial statements",
+        )
 
     def _convert_ts_to_date(self, ts):
         try:
@@ -83,49 +1149,36 @@ class YFDataUpdater:
         attribute = "dividends"
         companies_data_dict = self._get_companies_data(attribute)
 
-        records = []
+        five_yrs_ago = (
+            (pd.Timestamp.now() - pd.DateOffset(years=5))
+            .replace(month=1, day=1)
+            .strftime("%Y-%m-%d")
+        )
+        this_yr = pd.Timestamp.now().year
+
+        payloads = []
         for symbol, data in companies_data_dict.items():
             if data:
-                ticker = yf.Ticker(symbol)  # , session=self._session)
-                five_yrs_ago = (
-                    (pd.Timestamp.now() - pd.DateOffset(years=5))
-                    .replace(month=1, day=1)
-                    .strftime("%Y-%m-%d")
-                )
+                ticker = self._get_ticker(symbol)
                 last_dividend_date = last_dividend_dates.get(symbol, five_yrs_ago)
 
                 ser = pd.Series(data)
                 ser = ser[ser.index > last_dividend_date]
 
+                # one history request per past year with dividends
                 mean_prices = {}
-                for date, val in ser.items():
-                    this_yr = pd.Timestamp.now().year
-                    if date.year < this_yr:
-                        mean_price = mean_prices.get(date, None)
-                        if not mean_price:
-                            start_date = date.replace(month=1, day=1).strftime(
-                                "%Y-%m-%d"
-                            )
-                            end_date = date.replace(month=12, day=31).strftime(
-                                "%Y-%m-%d"
-                            )
-                            price_hist = ticker.history(
-                                start=start_date, end=end_date, auto_adjust=False
-                            )
-                            mean_price = price_hist["Close"].mean()
-                            mean_prices[date] = mean_price
-                        div_yield = val / mean_price
-                    else:
-                        div_yield = None
-
-                    records.append(
-                        {
-                            "symbol": symbol,
-                            "date": date.strftime("%Y-%m-%d"),
-                            "dividend": val,
-                            "yield": div_yield,
-                        }
-                    )
+                for year in sorted({date.year for date in ser.index}):
+                    if year < this_yr:
+                        price_hist = self._request_yf_history(
+                            ticker, start=f"{year}-01-01", end=f"{year}-12-31"
+                        )
+                        mean_prices[year] = price_hist["Close"].mean()
+
+                payloads.append((symbol, ser.to_dict(), mean_prices))
+
+        records = []
+        for batch in self._transform_batches(transform_dividends_batch, payloads):
+            records.extend(batch)
 
         dt_now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
         records = [{"updated_on": dt_now, **record} for record in records]
@@ -135,8 +1188,13 @@ class YFDataUpdater:
     def create_key_stats_records(self):
         companies_key_stats_dict = {}
 
-        attribute = "info"
-        companies_data_dict = self._get_companies_data(attribute)
+        # forwardEps of many symbols per request, info only for symbols without a quote
+        companies_data_dict = self._get_companies_quotes(self.symbols)
+        missing_symbols = [s for s in self.symbols if s not in companies_data_dict]
+        if missing_symbols:
+            companies_data_dict.update(
+                self._get_companies_data("info", missing_symbols)
+            )
 
         # metric_dict = {"forwardEps": "forward_eps", "fullTimeEmployees": "employee_num"}
         # Restrict to forward_eps only based on user request
@@ -175,175 +1233,6 @@ class YFDataUpdater:
             companies_key_stats_df, int_cols, include_updated_on=False
         )
 
-    def _get_companies_financial_df(
-        self,
-        attribute,
-        target_metrics,
-        quarterly=False,
-        last_financial_dates={},
-    ):
-        if quarterly:
-            attribute = "quarterly_" + attribute
-
-        companies_data_dict = self._get_companies_data(attribute)
-
-        companies_financial_dict = {}
-        for symbol, date_data in companies_data_dict.items():
-            for date, data in date_data.items():
-                for metric in target_metrics:
-                    if metric in data.keys():
-                        companies_financial_dict.setdefault(symbol, {}).setdefault(
-                            date, {}
-                        )[metric] = data[metric]
-                    else:
-                        companies_financial_dict.setdefault(symbol, {}).setdefault(
-                            date, {}
-                        )[metric] = None
-
-        if last_financial_dates:
-            filtered_companies_financial_dict = {}
-            for symbol, data in companies_financial_dict.items():
-                for date in data.keys():
-                    last_financial_date = (
-                        last_financial_dates.get(symbol) or "1900-01-01"
-                    )
-                    if date > pd.to_datetime(last_financial_date):
-                        filtered_companies_financial_dict.setdefault(symbol, {})[
-                            date
-                        ] = data[date]
-
-        else:
-            filtered_companies_financial_dict = companies_financial_dict
-
-        companies_financial_df = pd.DataFrame(
-            columns=["symbol", "date"] + target_metrics
-        )
-        for symbol, dates_data in filtered_companies_financial_dict.items():
-            for date, metrics in dates_data.items():
-                row_data = [symbol, date] + [
-                    metrics.get(metric, None) for metric in target_metrics
-                ]
-                columns = ["symbol", "date"] + target_metrics
-                if companies_financial_df.empty:
-                    companies_financial_df = pd.DataFrame([row_data], columns=columns)
-                else:
-                    companies_financial_df = pd.concat(
-                        [
-                            companies_financial_df,
-                            pd.DataFrame([row_data], columns=columns),
-                        ],
-                        axis=0,
-                    )
-
-        return companies_financial_df
-
-    def _get_companies_income_stmt_df(self, quarterly=False, last_financial_dates={}):
-        attribute = "income_stmt"
-        metrics_dict = {
-            "Total Revenue": "total_revenue",
-            "Gross Profit": "gross_income",
-            "Operating Income": "operating_income",
-            "Pretax Income": "pretax_income",
-            "Tax Provision": "income_taxes",
-            "Net Income": "net_income",
-            "EBIT": "ebit",
-            "EBITDA": "ebitda",
-            "Diluted Average Shares": "diluted_shares_outstanding",
-            "Interest Expense Non Operating": "interest_expense_non_operating",
-            # --- ADDED: New mappings ---
-            "Interest Income": "interest_income",
-            "Interest Expense": "interest_expense",
-            "Net Interest Income": "net_interest_income",
-            "Interest Income Non Operating": "non_interest_income",  # Direct source
-            "Operating Expense": "operating_expense",
-            "Provision For Doubtful Accounts": "provision_1",  # Temp name 1 for provision
-            "Provision For Credit Losses": "provision_2",  # Temp name 2 for provision
-            "Net Non Operating Interest Income Expense": "non_operating_income_or_loss",
-            "Minority Interests": "minorities",
-            "Cost Of Revenue": "cost_of_revenue_1",  # Temp name 1 for cost of revenue
-            "Reconciled Cost Of Revenue": "cost_of_revenue_2",  # Temp name 2 for cost of revenue
-        }
-        target_metrics = list(metrics_dict.keys())
-        income_stmt_df = self._get_companies_financial_df(
-            attribute, target_metrics, quarterly, last_financial_dates
-        )
-        income_stmt_df = income_stmt_df.rename(columns=metrics_dict)
-
-        # --- ADDED: Logic to combine metrics from multiple possible source names ---
-        # Combine provision fields
-        if (
-            "provision_1" in income_stmt_df.columns
-            and "provision_2" in income_stmt_df.columns
-        ):
-            income_stmt_df["provision"] = income_stmt_df["provision_1"].fillna(
-                income_stmt_df["provision_2"]
-            )
-            income_stmt_df = income_stmt_df.drop(columns=["provision_1", "provision_2"])
-
-        # Combine cost of revenue fields
-        if (
-            "cost_of_revenue_1" in income_stmt_df.columns
-            and "cost_of_revenue_2" in income_stmt_df.columns
-        ):
-            income_stmt_df["cost_of_revenue"] = income_stmt_df[
-                "cost_of_revenue_1"
-            ].fillna(income_stmt_df["cost_of_revenue_2"])
-            income_stmt_df = income_stmt_df.drop(
-                columns=["cost_of_revenue_1", "cost_of_revenue_2"]
-            )
-
-        return income_stmt_df
-
-    def _get_companies_balance_sheet_df(self, quarterly=False, last_financial_dates={}):
-        attribute = "balance_sheet"
-        # cash_only and total_cash_and_due_from_banks are missing from YF API
-        metrics_dict = {
-            "Cash Cash Equivalents And Short Term Investments": "cash_and_short_term_investments",
-            "Total Assets": "total_assets",
-            "Total Non Current Assets": "total_non_current_assets",
-            "Total Liabilities Net Minority Interest": "total_liabilities",
-            "Current Liabilities": "total_current_liabilities",
-            "Total Debt": "total_debt",
-            "Stockholders Equity": "stockholders_equity",
-            "Total Equity Gross Minority Interest": "total_equity",
-            "Inventory": "inventories",
-            "Retained Earnings": "retained_earnings",
-            "Prepaid Assets": "prepaid_assets",
-            # --- ADDED: New mappings ---
-            "Allowance For Doubtful Accounts Receivable": "allowance_for_loans",
-            "Current Assets": "total_current_asset",
-            "Total Non Current Liabilities Net Minority Interest": "total_non_current_liabilities",
-        }
-        target_metrics = list(metrics_dict.keys())
-        balance_sheet_df = self._get_companies_financial_df(
-            attribute, target_metrics, quarterly, last_financial_dates
-        )
-        balance_sheet_df = balance_sheet_df.rename(columns=metrics_dict)
-
-        return balance_sheet_df
-
-    def _get_companies_cash_flow_df(self, quarterly=False, last_financial_dates={}):
-        attribute = "cashflow"
-        metric_dict = {
-            "Free Cash Flow": "free_cash_flow",
-            "Cash Flowsfromusedin Operating Activities Direct": "net_operating_cash_flow",
-            "Operating Cash Flow": "net_operating_cash_flow_alt",
-            # --- ADDED: New mappings ---
-            "Changes In Cash": "net_cash_flow",
-            "Capital Expenditure": "capital_expenditure",
-        }
-        target_metrics = list(metric_dict.keys())
-        cash_flow_df = self._get_companies_financial_df(
-            attribute, target_metrics, quarterly, last_financial_dates
-        )
-        cash_flow_df = cash_flow_df.rename(columns=metric_dict)
-        cash_flow_df["net_operating_cash_flow"] = cash_flow_df[
-            "net_operating_cash_flow"
-        ].fillna(cash_flow_df["net_operating_cash_flow_alt"])
-        cash_flow_df = cash_flow_df.drop(columns=["net_operating_cash_flow_alt"])
-
-        return cash_flow_df
-
     def create_financials_records(
         self, quarterly=False, last_financial_dates={}, wsj_formats={}
     ):
@@ -352,118 +1241,37 @@ class YFDataUpdater:
         else:
             period = "annual"
 
-        companies_income_stmt_df = self._get_companies_income_stmt_df(
-            quarterly, last_financial_dates
-        )
-        companies_balance_sheet_df = self._get_companies_balance_sheet_df(
-            quarterly, last_financial_dates
-        )
-        companies_cash_flow_df = self._get_companies_cash_flow_df(
-            quarterly, last_financial_dates
+        # all statements of a symbol are fetched in one unit of work
+        companies_statements = self._get_companies_statements(
+            quarterly, include_currency=self.FETCH_FINANCIAL_CURRENCY
         )
+        self.financial_currencies = {
+            symbol: statements.get("financialCurrency")
+            for symbol, statements in companies_statements.items()
+        }
 
-        if not (
-            companies_income_stmt_df.empty
-            and companies_balance_sheet_df.empty
-            and companies_cash_flow_df.empty
-        ):
-            companies_financials_df = pd.merge(
-                companies_income_stmt_df,
-                companies_balance_sheet_df,
-                on=["symbol", "date"],
-                how="outer",
-            )
-
-            companies_financials_df = pd.merge(
-                companies_financials_df,
-                companies_cash_flow_df,
-                on=["symbol", "date"],
-                how="outer",
+        # columns, fallbacks, derivations and types are declared in FINANCIAL_METRICS
+        updated_on = pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S")
+        if self.transform_pool is None:
+            records = FINANCIALS_PLAN.transform(
+                companies_statements,
+                last_financial_dates,
+                wsj_formats,
+                updated_on=updated_on,
             )
-
-            # --- ADDED: Calculation for non_interest_income as a fallback ---
-            if all(
-                c in companies_financials_df.columns
-                for c in ["non_interest_income", "total_revenue", "net_interest_income"]
+        else:
+            keys, values = [], [np.empty((0, len(FINANCIALS_PLAN.columns)))]
+            for batch_keys, batch_values in self.transform_pool.map_batches(
+                transform_financials_batch,
+                companies_statements.items(),
+                last_financial_dates,
+                wsj_formats,
             ):
-                companies_financials_df[
-                    "non_interest_income"
-                ] = companies_financials_df["non_interest_income"].fillna(
-                    companies_financials_df["total_revenue"]
-                    - companies_financials_df["net_interest_income"]
-                )
-
-            companies_financials_df["source"] = 1
-
-            if wsj_formats:
-                companies_financials_df["wsj_format"] = companies_financials_df[
-                    "symbol"
-                ].map(wsj_formats)
-                companies_financials_df.loc[
-                    companies_financials_df["wsj_format"].isin([3, 4]),
-                    [
-                        "gross_income",
-                        "ebitda",
-                        "cash_and_short_term_investments",
-                        "total_non_current_assets",
-                        "total_current_liabilities",
-                    ],
-                ] = None
-                companies_financials_df.loc[
-                    companies_financials_df["wsj_format"].isin([4]),
-                    ["ebit", "interest_expense_non_operating"],
-                ] = None
-                companies_financials_df = companies_financials_df.drop(
-                    columns=["wsj_format"]
-                )
-
-            int_cols = [
-                "net_operating_cash_flow",
-                "total_assets",
-                "total_liabilities",
-                "total_current_liabilities",
-                "total_equity",
-                "total_revenue",
-                "net_income",
-                "total_debt",
-                "stockholders_equity",
-                "ebit",
-                "ebitda",
-                "cash_and_short_term_investments",
-                # "cash_only",
-                # "total_cash_and_due_from_banks",
-                "diluted_shares_outstanding",
-                "gross_income",
-                "pretax_income",
-                "income_taxes",
-                "total_non_current_assets",
-                "free_cash_flow",
-                "interest_expense_non_operating",
-                "operating_income",
-                "source",
-                "inventories",
-                "retained_earnings",
-                "prepaid_assets",
-                # --- ADDED: New columns ---
-                "interest_income",
-                "interest_expense",
-                "net_interest_income",
-                "non_interest_income",
-                "operating_expense",
-                "provision",
-                "non_operating_income_or_loss",
-                "minorities",
-                "cost_of_revenue",
-                "allowance_for_loans",
-                "total_current_asset",
-                "total_non_current_liabilities",
-                "net_cash_flow",
-                "capital_expenditure",
-            ]
-
-            self.new_records["financials"][period] = self._convert_df_to_records(
-                companies_financials_df, int_cols=int_cols
-            )
+                keys.extend(batch_keys)
+                values.append(batch_values)
+            records = FINANCIALS_PLAN.to_records(keys, np.vstack(values), updated_on)
+        if records:
+            self.new_records["financials"][period] = records
 
     def _retrieve_mcap_yf_web(self, symbol):
         multiplier_map = {"T": 1e12, "B": 1e9, "M": 1e6, "K": 1e3}
@@ -487,59 +1295,21 @@ class YFDataUpdater:
 
         return mcap_value
 
-    def _get_daily_data(self, symbol, last_daily_datum=None):
-        def process_data(data, ticker, calc_share_db=None):
-            symbol = ticker.ticker
-            temp_data = data.copy()
-            temp_data.index = temp_data.index.strftime("%Y-%m-%d")
-
-            new_mcap = ticker.info.get("marketCap", None)
-            if not new_mcap:
-                try:
-                    new_mcap = self._retrieve_mcap_yf_web(symbol)
-                except:
-                    new_mcap = None
-
-            mcap_method = 1 if new_mcap else None
-
-            # fill mcap
-            # try:
-            #     new_mcap = ticker.info.get("marketCap", self._retrieve_mcap_yf_web(symbol))
-            #     mcap_method = 1
-            # except:
-            #     new_mcap = None
-            #     mcap_method = None
-
-            temp_data.loc[temp_data.index.max(), "Market Cap"] = new_mcap
-            temp_data.loc[temp_data.index.max(), "mcap_method"] = mcap_method
-
-            if new_mcap:
-                calc_share_api = (
-                    new_mcap / temp_data.loc[temp_data.index.max(), "Close"]
-                )
-                calc_share_number = calc_share_api
-                # temp_data['mcap_method'] = temp_data['mcap_method'].fillna(2)
-                mcap_method = 2
-            else:
-                calc_share_number = calc_share_db
-                # temp_data['mcap_method'] = temp_data['mcap_method'].fillna(3)
-                mcap_method = 3
-
-            if calc_share_number:
-                null_mcap_rows = temp_data[temp_data["Market Cap"].isnull()].index
-                temp_data.loc[null_mcap_rows, "Market Cap"] = (
-                    temp_data.loc[null_mcap_rows, "Close"] * calc_share_number
-                )
-                temp_data.loc[null_mcap_rows, "mcap_method"] = mcap_method
-
-            temp_data = temp_data.replace(np.nan, None)
-            return temp_data
+    def _get_daily_mcap(self, symbol, ticker):
+        # the batch quote, or info when the symbol has none
+        quote = self._quotes.get(symbol) or self._request_yf_api(symbol, "info", ticker)
+        new_mcap = quote.get("marketCap", None)
+        if not new_mcap:
+            try:
+                new_mcap = self._retrieve_mcap_yf_web(symbol)
+            except:
+                new_mcap = None
 
-        # price_vol_rows = []
-        # mcap_row = None
-        symbol_rows = []
+        return new_mcap
 
-        ticker = yf.Ticker(symbol)  # , session=self._session)
+    def _get_daily_data_payload(self, symbol, last_daily_datum=None):
+        """Fetches what transform_daily_batch needs: (history, market cap, stored share number)"""
+        ticker = self._get_ticker(symbol)
 
         if last_daily_datum:
             last_date, last_close, last_volume, last_mcap, last_mcap_method = (
@@ -549,7 +1319,7 @@ class YFDataUpdater:
                 last_daily_datum["market_cap"],
                 last_daily_datum["mcap_method"],
             )
-            data = ticker.history(start=last_date, auto_adjust=False)[
+            data = self._request_yf_history(ticker, start=last_date)[
                 ["Close", "Volume"]
             ]
             data.loc[last_date, "Market Cap"] = last_mcap
@@ -560,85 +1330,112 @@ class YFDataUpdater:
             except:
                 calc_share_db = None
 
-            if len(data) > 0:
-                data = process_data(data, ticker, calc_share_db)
-
-                if (
-                    last_close == data.loc[last_date, "Close"]
-                    and last_volume == data.loc[last_date, "Volume"]
-                    and last_mcap == data.loc[last_date, "Market Cap"]
-                ):
-                    data = data.drop(last_date)
+            # the last_date row is dropped by DailyDataBuffer.drop_unchanged if it did not change
 
         # new ticker
         else:
             date_5y_ago = (datetime.now() - timedelta(days=5 * 365)).strftime(
                 "%Y-%m-%d"
             )
-            data = ticker.history(start=date_5y_ago, auto_adjust=False)[
+            data = self._request_yf_history_chunked(ticker, start=date_5y_ago)[
                 ["Close", "Volume"]
             ]
             # data = ticker.history(start=date_5y_ago, auto_adjust=False)[
             #     ["Close", "Volume"]
             # ]
+            calc_share_db = None
 
-            if len(data) > 0:
-                data = process_data(data, ticker)
+        new_mcap = self._get_daily_mcap(symbol, ticker) if len(data) > 0 else None
 
-        if len(data) > 0:
-            for idx, row in data.iterrows():
-                symbol_rows.append(
-                    {
-                        "symbol": symbol,
-                        "date": idx,
-                        "close": (row["Close"]),
-                        "volume": (row["Volume"]),
-                        "market_cap": (row["Market Cap"]),
-                        "mcap_method": (row["mcap_method"]),
-                    }
-                )
+        return data, new_mcap, calc_share_db
 
-        return symbol_rows
+    def _fetch_daily_data(self, symbols, last_daily_data, all_symbols_rows, max_workers=1):
+        """Appends the daily data of symbols to all_symbols_rows
 
-    def create_daily_data_records(self, last_daily_data={}, int_close=False):
-        # last_daily_data should be a dict with symbol as key and dict with date, close, volume and market_cap as value
-        # e.g. {'BBCA.JK': {'date': '2021-01-01', 'close': 100.0, 'volume': 20, 'market_cap':200000}, 'BBRI.JK': {'date': '2022-01-01', 'close': 200.0, , 'volume': 40, 'market_cap':100000}}
-        all_symbols_rows = []
-        retry_symbols = []
-        unadded_symbols = []
+        Returns:
+            list: (symbol, exception) of the symbols that failed
+        """
 
-        for symbol in self.symbols:
-            last_daily_datum = last_daily_data.get(symbol)
-            try:
-                symbol_rows = self._get_daily_data(symbol, last_daily_datum)
-            except Exception as e:
-                retry_symbols.append(symbol)
-            else:
-                all_symbols_rows.extend(symbol_rows) if symbol_rows else None
+        def fetch(symbol):
+            started = self._start_symbol(symbol)
+            if started is None:
+                return symbol, None, None
 
-        for symbol in retry_symbols:
-            last_daily_datum = last_daily_data.get(symbol)
             try:
-                symbol_rows = self._get_daily_data(symbol, last_daily_datum)
+                return symbol, self._get_daily_data_payload(symbol, last_daily_data.get(symbol)), None
             except Exception as e:
-                unadded_symbols.append(symbol)
-                print(f"Failed to add {symbol} to daily data because of {e}")
-            else:
-                all_symbols_rows.extend(symbol_rows) if symbol_rows else None
+                return symbol, None, e
+            finally:
+                self._finish_symbol(started)
 
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                failed = self._append_daily_data(executor.map(fetch, symbols), all_symbols_rows)
+        else:
+            failed = self._append_daily_data(map(fetch, symbols), all_symbols_rows)
+
+        return failed
+
+    def _append_daily_data(self, results, all_symbols_rows):
+        # the buffer is only appended to from the calling thread
+        failed = []
+
+        def payloads():
+            for symbol, payload, e in results:
+                if e is not None:
+                    failed.append((symbol, e))
+                elif payload is not None:
+                    yield (symbol, *payload)
+
+        if self.transform_pool is None:
+            # frames are held a batch at a time and transformed together
+            batches = (transform_daily_batch(batch) for batch in iter_batches(payloads()))
+        else:
+            batches = self.transform_pool.map_batches(transform_daily_batch, payloads())
+
+        for batch in batches:
+            for symbol, rows, error in batch:
+                if error is not None:
+                    failed.append((symbol, Exception(error)))
+                else:
+                    all_symbols_rows.append_rows(symbol, rows)
+        return failed
+
+    def create_daily_data_records(self, last_daily_data={}, int_close=False):
+        # last_daily_data should be a dict with symbol as key and dict with date, close, volume and market_cap as value
+        # e.g. {'BBCA.JK': {'date': '2021-01-01', 'close': 100.0, 'volume': 20, 'market_cap':200000}, 'BBRI.JK': {'date': '2022-01-01', 'close': 200.0, , 'volume': 40, 'market_cap':100000}}
         dt_now = pd.Timestamp.now(tz="GMT").strftime("%Y-%m-%d %H:%M:%S")
-        all_symbols_rows = [
-            {"updated_on": dt_now, **record} for record in all_symbols_rows
-        ]
 
         int_cols = ["volume", "market_cap", "mcap_method"]
 
         if int_close:
             int_cols.append("close")
 
-        for row in all_symbols_rows:
-            for col in int_cols:
-                row[col] = self._cast_int(row[col])
+        self.symbols = self._select_session_due_symbols(
+            self._select_daily_lane_symbols(last_daily_data), last_daily_data
+        )
+
+        # marketCap of many symbols per request, read by _get_daily_data
+        self._get_companies_quotes(self.symbols)
+
+        # rows are kept in a typed buffer and only turned into dicts at upsert time
+        all_symbols_rows = DailyDataBuffer(dt_now, int_cols)
+        # backfills of new symbols get their own concurrency, incremental updates run one at a time
+        max_workers = self.backfill_workers if self.daily_lane == "backfill" else 1
+
+        retry_symbols = [
+            symbol
+            for symbol, _ in self._fetch_daily_data(
+                self.symbols, last_daily_data, all_symbols_rows, max_workers
+            )
+        ]
+        unadded_symbols = []
+        for symbol, e in self._fetch_daily_data(
+            retry_symbols, last_daily_data, all_symbols_rows, max_workers
+        ):
+            unadded_symbols.append(symbol)
+            print(f"Failed to add {symbol} to daily data because of {e}")
 
         self.new_records["daily_data"] = all_symbols_rows
         self.unadded_data["daily_data"] = unadded_symbols
+        self._failed_symbols.update(unadded_symbols)